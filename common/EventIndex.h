@@ -0,0 +1,255 @@
+#ifndef EventIndex_h
+#define EventIndex_h
+
+#include "TTree.h"
+#include "TFile.h"
+#include "TBranch.h"
+#include "TLeaf.h"
+#include "TString.h"
+
+#include <vector>
+#include <algorithm>
+#include <fstream>
+#include <iostream>
+#include <cstring>
+#include <cstdio>
+
+//! Sorted (run, lumi, event) -> (file, entry) lookup table stored in a binary file.
+/*!
+ * File layout: 8-byte magic, number of files (UInt_t), for each file the path length (UInt_t) and the path,
+ * number of records (Long64_t), and the records sorted by (run, lumi, event).
+ * Lookups are binary searches over the records on disk; only the header is held in memory.
+ */
+class EventIndex {
+public:
+  struct Record {
+    UInt_t runNumber;
+    UInt_t lumiNumber;
+    UInt_t eventNumber;
+    UInt_t file;
+    Long64_t entry;
+
+    bool operator<(Record const& rhs) const {
+      if (runNumber != rhs.runNumber)
+        return runNumber < rhs.runNumber;
+      if (lumiNumber != rhs.lumiNumber)
+        return lumiNumber < rhs.lumiNumber;
+      return eventNumber < rhs.eventNumber;
+    }
+  };
+
+  EventIndex() {}
+  ~EventIndex() { close(); }
+
+  //! Scan the id branches of the tree in each file and write the index. Returns false on failure.
+  static bool build(std::vector<TString> const& paths, char const* outPath, char const* treeName = "events", char const* runBranch = "runNumber", char const* lumiBranch = "lumiNumber", char const* eventBranch = "eventNumber");
+
+  bool open(char const* path);
+  void close();
+
+  //! Look up an event. On success, getFoundFile and getFoundEntry return the file path and the entry number in the file.
+  bool find(UInt_t run, UInt_t lumi, UInt_t event);
+  char const* getFoundFile() const { return foundFile_ < files_.size() ? files_[foundFile_].Data() : ""; }
+  Long64_t getFoundEntry() const { return foundEntry_; }
+
+  unsigned getNFiles() const { return files_.size(); }
+  char const* getFile(unsigned i) const { return files_.at(i).Data(); }
+  Long64_t getNRecords() const { return nRecords_; }
+
+private:
+  bool readRecord_(Long64_t, Record&);
+
+  static char const* magic() { return "EVIDX01"; }
+
+  std::ifstream source_{};
+  std::vector<TString> files_{};
+  std::streamoff recordsBegin_{0};
+  Long64_t nRecords_{0};
+  Record first_{};
+  Record last_{};
+
+  unsigned foundFile_{0};
+  Long64_t foundEntry_{-1};
+};
+
+inline
+bool
+EventIndex::build(std::vector<TString> const& _paths, char const* _outPath, char const* _treeName/* = "events"*/, char const* _runBranch/* = "runNumber"*/, char const* _lumiBranch/* = "lumiNumber"*/, char const* _eventBranch/* = "eventNumber"*/)
+{
+  std::vector<Record> records;
+
+  for (unsigned iF(0); iF != _paths.size(); ++iF) {
+    auto* source(TFile::Open(_paths[iF]));
+    if (!source || source->IsZombie()) {
+      std::cerr << "EventIndex: Cannot open " << _paths[iF] << std::endl;
+      delete source;
+      return false;
+    }
+
+    auto* tree(static_cast<TTree*>(source->Get(_treeName)));
+    if (!tree) {
+      std::cerr << "EventIndex: No tree " << _treeName << " in " << _paths[iF] << std::endl;
+      delete source;
+      return false;
+    }
+
+    TBranch* branches[3]{tree->GetBranch(_runBranch), tree->GetBranch(_lumiBranch), tree->GetBranch(_eventBranch)};
+    TLeaf* leaves[3]{};
+    for (unsigned iB(0); iB != 3; ++iB) {
+      if (!branches[iB]) {
+        std::cerr << "EventIndex: Missing id branch in " << _paths[iF] << std::endl;
+        delete source;
+        return false;
+      }
+      leaves[iB] = static_cast<TLeaf*>(branches[iB]->GetListOfLeaves()->At(0));
+    }
+
+    // leaf values are read through GetValue so that any integer type works
+    long nEntries(tree->GetEntries());
+    for (long iEntry(0); iEntry != nEntries; ++iEntry) {
+      for (auto* branch : branches)
+        branch->GetEntry(iEntry);
+
+      records.push_back({UInt_t(leaves[0]->GetValue()), UInt_t(leaves[1]->GetValue()), UInt_t(ULong64_t(leaves[2]->GetValue()) % 0x100000000ULL), iF, iEntry});
+    }
+
+    delete source;
+  }
+
+  std::stable_sort(records.begin(), records.end());
+
+  TString tmpPath(TString::Format("%s.tmp", _outPath));
+  std::ofstream out(tmpPath.Data(), std::ios::binary);
+  if (!out.is_open()) {
+    std::cerr << "EventIndex: Cannot write " << _outPath << std::endl;
+    return false;
+  }
+
+  out.write(magic(), 8);
+
+  UInt_t nFiles(_paths.size());
+  out.write(reinterpret_cast<char const*>(&nFiles), sizeof(UInt_t));
+  for (auto& path : _paths) {
+    UInt_t len(path.Length());
+    out.write(reinterpret_cast<char const*>(&len), sizeof(UInt_t));
+    out.write(path.Data(), len);
+  }
+
+  Long64_t nRecords(records.size());
+  out.write(reinterpret_cast<char const*>(&nRecords), sizeof(Long64_t));
+  if (nRecords != 0)
+    out.write(reinterpret_cast<char const*>(records.data()), sizeof(Record) * nRecords);
+
+  out.close();
+
+  return std::rename(tmpPath.Data(), _outPath) == 0;
+}
+
+inline
+bool
+EventIndex::open(char const* _path)
+{
+  close();
+
+  source_.open(_path, std::ios::binary);
+  if (!source_.is_open())
+    return false;
+
+  char buf[8];
+  source_.read(buf, 8);
+  if (!source_ || std::strcmp(buf, magic()) != 0) {
+    std::cerr << "EventIndex: " << _path << " is not an event index" << std::endl;
+    close();
+    return false;
+  }
+
+  UInt_t nFiles(0);
+  source_.read(reinterpret_cast<char*>(&nFiles), sizeof(UInt_t));
+  for (UInt_t iF(0); iF != nFiles; ++iF) {
+    UInt_t len(0);
+    source_.read(reinterpret_cast<char*>(&len), sizeof(UInt_t));
+    std::vector<char> path(len + 1, '\0');
+    source_.read(path.data(), len);
+    files_.emplace_back(path.data());
+  }
+
+  source_.read(reinterpret_cast<char*>(&nRecords_), sizeof(Long64_t));
+  recordsBegin_ = source_.tellg();
+
+  if (!source_) {
+    close();
+    return false;
+  }
+
+  if (nRecords_ != 0) {
+    readRecord_(0, first_);
+    readRecord_(nRecords_ - 1, last_);
+  }
+
+  return true;
+}
+
+inline
+void
+EventIndex::close()
+{
+  if (source_.is_open())
+    source_.close();
+  source_.clear();
+
+  files_.clear();
+  recordsBegin_ = 0;
+  nRecords_ = 0;
+  foundFile_ = 0;
+  foundEntry_ = -1;
+}
+
+inline
+bool
+EventIndex::readRecord_(Long64_t _pos, Record& _record)
+{
+  source_.seekg(recordsBegin_ + _pos * sizeof(Record));
+  source_.read(reinterpret_cast<char*>(&_record), sizeof(Record));
+  return bool(source_);
+}
+
+inline
+bool
+EventIndex::find(UInt_t _run, UInt_t _lumi, UInt_t _event)
+{
+  foundEntry_ = -1;
+
+  if (nRecords_ == 0)
+    return false;
+
+  Record key{_run, _lumi, _event, 0, 0};
+
+  // whole index outside the range
+  if (key < first_ || last_ < key)
+    return false;
+
+  // lower bound
+  Long64_t low(0);
+  Long64_t high(nRecords_);
+  Record record;
+  while (low < high) {
+    Long64_t mid(low + (high - low) / 2);
+    if (!readRecord_(mid, record))
+      return false;
+
+    if (record < key)
+      low = mid + 1;
+    else
+      high = mid;
+  }
+
+  if (low == nRecords_ || !readRecord_(low, record) || key < record)
+    return false;
+
+  foundFile_ = record.file;
+  foundEntry_ = record.entry;
+
+  return true;
+}
+
+#endif
@@ -1,5 +1,131 @@
 #include "GoodLumiFilter.h"
 
+#include <algorithm>
+#include <fstream>
+#include <sstream>
+#include <string>
+#include <cctype>
+#include <cstdlib>
+
+void
+GoodLumiFilter::addLumiRange(unsigned run, unsigned first, unsigned last)
+{
+  if (last < first)
+    return;
+
+  auto& ranges(goodLumiList_[run]);
+
+  // first range that is not entirely below [first, last] and not adjacent to it
+  auto begin(std::lower_bound(ranges.begin(), ranges.end(), first, [](LumiRange const& r, unsigned l) { return r.second + 1 < l; }));
+  // first range that is entirely above [first, last] and not adjacent to it
+  auto end(begin);
+  while (end != ranges.end() && end->first <= last + 1)
+    ++end;
+
+  if (begin == end)
+    ranges.insert(begin, LumiRange(first, last));
+  else {
+    begin->first = std::min(begin->first, first);
+    begin->second = std::max((end - 1)->second, last);
+    ranges.erase(begin + 1, end);
+  }
+
+  // the map may have been modified
+  currentRun_ = 0;
+  currentRanges_ = nullptr;
+  currentLumi_ = 0;
+}
+
+bool
+GoodLumiFilter::readJSON(char const* path)
+{
+  std::ifstream source(path);
+  if (!source.is_open())
+    return false;
+
+  std::stringstream ss;
+  ss << source.rdbuf();
+  std::string const content(ss.str());
+
+  char const* c(content.c_str());
+
+  auto skipSpace([&c]() {
+      while (std::isspace(*c))
+        ++c;
+    });
+  auto expect([&c, &skipSpace](char ch)->bool {
+      skipSpace();
+      if (*c != ch)
+        return false;
+      ++c;
+      return true;
+    });
+  auto readNumber([&c, &skipSpace](unsigned& n)->bool {
+      skipSpace();
+      char* end(nullptr);
+      n = std::strtoul(c, &end, 10);
+      if (end == c)
+        return false;
+      c = end;
+      return true;
+    });
+
+  if (!expect('{'))
+    return false;
+
+  skipSpace();
+  if (*c == '}')
+    return true;
+
+  while (true) {
+    unsigned run(0);
+    if (!expect('"') || !readNumber(run) || !expect('"') || !expect(':') || !expect('['))
+      return false;
+
+    skipSpace();
+    if (*c == ']')
+      ++c;
+    else {
+      while (true) {
+        unsigned first(0);
+        unsigned last(0);
+        if (!expect('[') || !readNumber(first) || !expect(',') || !readNumber(last) || !expect(']'))
+          return false;
+
+        addLumiRange(run, first, last);
+
+        skipSpace();
+        if (*c == ',')
+          ++c;
+        else if (*c == ']') {
+          ++c;
+          break;
+        }
+        else
+          return false;
+      }
+    }
+
+    skipSpace();
+    if (*c == ',')
+      ++c;
+    else if (*c == '}')
+      break;
+    else
+      return false;
+  }
+
+  return true;
+}
+
+bool
+GoodLumiFilter::inRanges_(LumiRanges const& ranges, unsigned lumi) const
+{
+  // first range with last >= lumi
+  auto itr(std::lower_bound(ranges.begin(), ranges.end(), lumi, [](LumiRange const& r, unsigned l) { return r.second < l; }));
+  return itr != ranges.end() && itr->first <= lumi;
+}
+
 bool
 GoodLumiFilter::isGoodLumi(unsigned run, unsigned lumi) const
 {
@@ -9,19 +135,18 @@ GoodLumiFilter::isGoodLumi(unsigned run, unsigned lumi) const
   if (run == currentRun_ && lumi == currentLumi_)
     return currentStatus_;
 
-  currentRun_ = run;
-  currentLumi_ = lumi;
-
-  auto rItr(goodLumiList_.find(run));
-  if (rItr != goodLumiList_.end()) {
-    auto lItr(rItr->second.find(lumi));
-    if (lItr != rItr->second.end()) {
-      currentStatus_ = true;
-      return currentStatus_;
-    }
+  if (run != currentRun_) {
+    currentRun_ = run;
+    auto rItr(goodLumiList_.find(run));
+    if (rItr != goodLumiList_.end())
+      currentRanges_ = &rItr->second;
+    else
+      currentRanges_ = nullptr;
   }
 
-  currentStatus_ = false;
+  currentLumi_ = lumi;
+  currentStatus_ = currentRanges_ != nullptr && inRanges_(*currentRanges_, lumi);
+
   return currentStatus_;
 }
 
@@ -33,3 +158,40 @@ GoodLumiFilter::hasGoodLumi(unsigned run) const
 
   return goodLumiList_.find(run) != goodLumiList_.end();
 }
+
+void
+GoodLumiFilter::mask(unsigned n, unsigned const* runs, unsigned const* lumis, unsigned char* results) const
+{
+  for (unsigned i(0); i != n; ++i)
+    results[i] = isGoodLumi(runs[i], lumis[i]) ? 1 : 0;
+}
+
+std::vector<bool>
+GoodLumiFilter::mask(std::vector<unsigned> const& runs, std::vector<unsigned> const& lumis) const
+{
+  std::vector<bool> results(std::min(runs.size(), lumis.size()));
+  for (unsigned i(0); i != results.size(); ++i)
+    results[i] = isGoodLumi(runs[i], lumis[i]);
+
+  return results;
+}
+
+unsigned
+GoodLumiFilter::getNRanges() const
+{
+  unsigned n(0);
+  for (auto& rr : goodLumiList_)
+    n += rr.second.size();
+
+  return n;
+}
+
+GoodLumiFilter::LumiRanges const*
+GoodLumiFilter::getRanges(unsigned run) const
+{
+  auto rItr(goodLumiList_.find(run));
+  if (rItr == goodLumiList_.end())
+    return nullptr;
+
+  return &rItr->second;
+}
@@ -2,20 +2,40 @@
 #define GoodLumiFilter_h
 
 #include <map>
-#include <set>
+#include <vector>
+#include <utility>
 
+//! Good lumi list stored as sorted, non-overlapping closed lumi ranges per run.
 class GoodLumiFilter {
 public:
+  typedef std::pair<unsigned, unsigned> LumiRange; //!< [first, last]
+  typedef std::vector<LumiRange> LumiRanges;
+
   GoodLumiFilter() {}
   ~GoodLumiFilter() {}
 
-  void addLumi(unsigned run, unsigned lumi) { goodLumiList_[run].insert(lumi); }
+  void addLumi(unsigned run, unsigned lumi) { addLumiRange(run, lumi, lumi); }
+  //! Add the lumis first to last (inclusive). Overlapping and adjacent ranges are merged.
+  void addLumiRange(unsigned run, unsigned first, unsigned last);
+  //! Add the lumis from a JSON lumi list ({"run": [[first, last], ...], ...}). Returns false if the file cannot be parsed.
+  bool readJSON(char const* path);
+
   bool isGoodLumi(unsigned run, unsigned lumi) const;
   bool hasGoodLumi(unsigned run) const;
+  //! Set results[i] to isGoodLumi(runs[i], lumis[i]) for i in [0, n).
+  void mask(unsigned n, unsigned const* runs, unsigned const* lumis, unsigned char* results) const;
+  std::vector<bool> mask(std::vector<unsigned> const& runs, std::vector<unsigned> const& lumis) const;
+
+  unsigned getNRuns() const { return goodLumiList_.size(); }
+  unsigned getNRanges() const;
+  LumiRanges const* getRanges(unsigned run) const;
 
 private:
-  std::map<unsigned, std::set<unsigned>> goodLumiList_;
+  bool inRanges_(LumiRanges const&, unsigned lumi) const;
+
+  std::map<unsigned, LumiRanges> goodLumiList_;
   mutable unsigned currentRun_{0};
+  mutable LumiRanges const* currentRanges_{nullptr};
   mutable unsigned currentLumi_{0};
   mutable bool currentStatus_{false};
 };
@@ -638,6 +638,24 @@ MultiDraw::fillPlots(long _nEntries/* = -1*/, long _firstEntry/* = 0*/)
   else if (printLevel_ >= 4)
     printEvery = 1;
 
+  if (tree_.LoadTree(_firstEntry) >= 0) {
+    std::vector<TString> branches;
+    if (cacheLearnEntries_ == 0) {
+      for (auto& ff : library_) {
+        for (auto& bname : getFormulaBranches(*ff.second))
+          branches.push_back(bname);
+      }
+      if (weightBranchName_.Length() != 0)
+        branches.push_back(weightBranchName_);
+      if (prescale_ > 1)
+        branches.push_back("eventNumber");
+    }
+
+    setupReadCache(tree_, cacheSize_, cacheLearnEntries_, branches);
+  }
+
+  readStats_ = ReadStats("MultiDraw input");
+
   long iEntry(_firstEntry);
   long iEntryMax(_firstEntry + _nEntries);
   long iLocalEntry(0);
@@ -708,6 +726,9 @@ MultiDraw::fillPlots(long _nEntries/* = -1*/, long _firstEntry/* = 0*/)
     for (auto& ff : library_)
       ff.second->ResetCache();
 
+    if (printReadStats_)
+      readStats_.update(tree_);
+
     if (weightBranch) {
       weightBranch->GetEntry(iLocalEntry);
       if (weightF != nullptr)
@@ -849,6 +870,12 @@ MultiDraw::fillPlots(long _nEntries/* = -1*/, long _firstEntry/* = 0*/)
     std::cout << std::endl;
   }
 
+  if (printReadStats_) {
+    // account for the reads of the last entry
+    readStats_.update(tree_);
+    readStats_.print(std::cout);
+  }
+
   if (printLevel_ > 0) {
     std::cout << "      " << passBase << " passed base selection" << std::endl;
     std::cout << "      " << passFull << " passed full selection" << std::endl;
@@ -6,6 +6,8 @@
 #include "TH1.h"
 #include "TString.h"
 
+#include "ReadCache.h"
+
 #include <map>
 #include <vector>
 
@@ -203,8 +205,20 @@ public:
   //! Run and fill the plots and trees.
   void fillPlots(long nEntries = -1, long firstEntry = 0);
 
+  //! Set the input read cache size in bytes. If 0, the ROOT default is used.
+  void setCacheSize(long s) { cacheSize_ = s; }
+  //! Set the number of cache learning entries.
+  /*!
+   * If negative, the ROOT default is used. If 0, the branches used by the formulas are
+   * registered to the cache directly and the learning phase is skipped.
+   */
+  void setCacheLearnEntries(int n) { cacheLearnEntries_ = n; }
+  //! Print per-file read statistics at the end of fillPlots.
+  void setPrintReadStats(bool b) { printReadStats_ = b; }
+
   void setPrintLevel(int l) { printLevel_ = l; }
   long getTotalEvents() { return totalEvents_; }
+  ReadStats const& getReadStats() const { return readStats_; }
 
   unsigned numObjs() const { return unconditional_.size() + postBase_.size() + postFull_.size(); }
 
@@ -230,6 +244,11 @@ private:
 
   std::map<TString, TTreeFormulaCached*> library_;
 
+  long cacheSize_{0};
+  int cacheLearnEntries_{-1};
+  bool printReadStats_{false};
+  ReadStats readStats_{"MultiDraw input"};
+
   int printLevel_{0};
   long totalEvents_{0};
 };
@@ -0,0 +1,145 @@
+#ifndef ReadCache_h
+#define ReadCache_h
+
+#include "TChain.h"
+#include "TFile.h"
+#include "TBranch.h"
+#include "TLeaf.h"
+#include "TTreeCache.h"
+#include "TTreeFormula.h"
+#include "TString.h"
+
+#include <vector>
+#include <iostream>
+
+//! Names of the branches of the current tree of the chain that are not disabled by SetBranchStatus.
+inline std::vector<TString>
+getActiveBranches(TChain& _chain)
+{
+  std::vector<TString> names;
+
+  auto* tree(_chain.GetTree());
+  if (!tree)
+    return names;
+
+  auto* leaves(tree->GetListOfLeaves());
+  for (int iL(0); iL != leaves->GetEntriesFast(); ++iL) {
+    auto* branch(static_cast<TLeaf*>(leaves->At(iL))->GetBranch());
+    if (!branch->TestBit(TBranch::kDoNotProcess))
+      names.emplace_back(branch->GetName());
+  }
+
+  return names;
+}
+
+//! Names of the branches (including leaf counts) a formula reads.
+inline std::vector<TString>
+getFormulaBranches(TTreeFormula& _formula)
+{
+  std::vector<TString> names;
+
+  for (int iC(0); iC != _formula.GetNcodes(); ++iC) {
+    auto* leaf(_formula.GetLeaf(iC));
+    if (!leaf)
+      continue;
+
+    names.emplace_back(leaf->GetBranch()->GetName());
+    if (leaf->GetLeafCount())
+      names.emplace_back(leaf->GetLeafCount()->GetBranch()->GetName());
+  }
+
+  return names;
+}
+
+//! Configure the TTreeCache of a chain.
+/*!
+ * The chain must have a tree loaded (call LoadTree first).
+ * \param size          Cache size in bytes. If 0, the ROOT default is kept.
+ * \param learnEntries  Number of entries for the cache learning phase. If negative, the ROOT default is kept.
+ *                      If 0, the given branches are registered directly and the learning phase is skipped.
+ * \param branches      Branches to register when learnEntries == 0.
+ */
+inline void
+setupReadCache(TChain& _chain, Long64_t _size, int _learnEntries, std::vector<TString> const& _branches)
+{
+  if (_size > 0)
+    _chain.SetCacheSize(_size);
+
+  if (_learnEntries > 0)
+    TTreeCache::SetLearnEntries(_learnEntries);
+  else if (_learnEntries == 0) {
+    for (auto& bname : _branches)
+      _chain.AddBranchToCache(bname, true);
+
+    _chain.StopCacheLearningPhase();
+  }
+}
+
+//! Per-file read statistics of a TChain.
+/*!
+ * Call update() after every read from the chain. The counters of the file currently being read
+ * are kept up to date, and a new record is started when the chain moves to the next file.
+ */
+class ReadStats {
+public:
+  struct FileStats {
+    TString path{};
+    Long64_t bytesRead{0};
+    Int_t readCalls{0};
+    double cacheEfficiency{0.};
+  };
+
+  ReadStats(char const* name = "") : name_(name) {}
+
+  void update(TChain& chain);
+  void print(std::ostream& = std::cout) const;
+  std::vector<FileStats> const& getStats() const { return stats_; }
+
+private:
+  TString name_;
+  std::vector<FileStats> stats_{};
+  int treeNumber_{-1};
+};
+
+inline void
+ReadStats::update(TChain& _chain)
+{
+  auto* file(_chain.GetCurrentFile());
+  if (!file)
+    return;
+
+  if (_chain.GetTreeNumber() != treeNumber_) {
+    treeNumber_ = _chain.GetTreeNumber();
+    stats_.emplace_back();
+    stats_.back().path = file->GetName();
+  }
+
+  auto& current(stats_.back());
+  current.bytesRead = file->GetBytesRead();
+  current.readCalls = file->GetReadCalls();
+
+  auto* cache(_chain.GetReadCache(file));
+  if (cache)
+    current.cacheEfficiency = cache->GetEfficiency();
+}
+
+inline void
+ReadStats::print(std::ostream& _stream/* = std::cout*/) const
+{
+  _stream << "Read statistics";
+  if (name_.Length() != 0)
+    _stream << " for " << name_;
+  _stream << " (bytes read, read calls, cache hit rate):" << std::endl;
+
+  Long64_t totalBytes(0);
+  Int_t totalCalls(0);
+  for (auto& stats : stats_) {
+    _stream << " " << stats.path << " " << stats.bytesRead << " " << stats.readCalls << " " << stats.cacheEfficiency << std::endl;
+    totalBytes += stats.bytesRead;
+    totalCalls += stats.readCalls;
+  }
+
+  _stream << " total " << totalBytes << " " << totalCalls << std::endl;
+}
+
+#endif
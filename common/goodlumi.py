@@ -1,5 +1,5 @@
 import os
-import json
+import array
 import ROOT
 
 thisdir = os.path.dirname(os.path.realpath(__file__))
@@ -9,13 +9,20 @@ ROOT.gROOT.LoadMacro(thisdir + '/GoodLumiFilter.cc+')
 def makeGoodLumiFilter(jsonPath):
     goodLumi = ROOT.GoodLumiFilter()
 
-    with open(jsonPath) as source:
-        lumiList = json.loads(source.read())
-
-        for run, lumiranges in lumiList.items():
-            for lumirange in lumiranges:
-                lumirange[1] += 1
-                for lumi in range(*tuple(lumirange)):
-                    goodLumi.addLumi(int(run), lumi)
+    if not goodLumi.readJSON(jsonPath):
+        raise RuntimeError('Could not parse lumi list ' + jsonPath)
 
     return goodLumi
+
+def maskLumis(goodLumi, runs, lumis):
+    """
+    Return an array('B') of 1 (good) and 0 (bad) for each (run, lumi) pair of the two sequences.
+    """
+
+    runs = array.array('I', runs)
+    lumis = array.array('I', lumis)
+    results = array.array('B', [0] * len(runs))
+
+    goodLumi.mask(len(runs), runs, lumis, results)
+
+    return results
@@ -0,0 +1,312 @@
+"""
+Histogram source layer for the fit scripts (workspace.py, tfValidation.py, plotFit.py).
+
+[HistSource]
+One ROOT file. The key names of each directory are listed once and saved in an index file under the cache
+directory (default /tmp/$USER/histsource, or $HISTSOURCE_CACHE). The index is reused as long as the size
+and the mtime of the ROOT file do not change, so repeated runs do not list the source files again.
+Histograms are read only on request; each get() returns a new object detached from the file.
+
+[HistDict]
+{variation: histogram} of one (process, region), filled with key names only. A histogram is read from the
+source when it is first accessed.
+"""
+
+import os
+import sys
+import re
+import json
+import hashlib
+import collections
+
+import ROOT
+
+cacheDir = os.environ.get('HISTSOURCE_CACHE', '/tmp/' + os.environ.get('USER', 'nobody') + '/histsource')
+
+class HistSource(object):
+    VERSION = 1
+
+    def __init__(self, path, hstore = None):
+        self.path = path
+        self.hstore = hstore
+
+        self._file = None
+        self._index = None # {directory: [key names]}
+
+    def keys(self, dirname = ''):
+        """
+        Key names in the directory, in the order of the key list of the file.
+        """
+
+        if self._index is None:
+            self._index = self._loadIndex()
+
+        try:
+            return self._index[dirname]
+        except KeyError:
+            pass
+
+        tfile = self._open()
+        if dirname:
+            directory = tfile.GetDirectory(dirname)
+        else:
+            directory = tfile
+
+        if directory:
+            names = [key.GetName() for key in directory.GetListOfKeys()]
+        else:
+            names = []
+
+        self._index[dirname] = names
+        self._saveIndex()
+
+        return names
+
+    def find(self, histname):
+        """
+        Find the histogram histname and its systematic variations histname_(variation)(Up|Down).
+        Returns [(variation, key path)] in the key order, with variation 'nominal' for histname itself.
+        """
+
+        dirname = os.path.dirname(histname)
+        basename = os.path.basename(histname)
+
+        found = []
+        for name in self.keys(dirname):
+            matches = re.match(basename + '(_.+(?:Up|Down)|)$', name)
+            if matches is None:
+                continue
+
+            variation = matches.group(1)
+            if variation:
+                variation = variation[1:]
+            else:
+                variation = 'nominal'
+
+            if dirname:
+                found.append((variation, dirname + '/' + name))
+            else:
+                found.append((variation, name))
+
+        return found
+
+    def get(self, name):
+        """
+        Read the histogram. Returns None if it does not exist.
+        """
+
+        hist = self._open().Get(name)
+        if not hist:
+            return None
+
+        hist.SetDirectory(self.hstore)
+
+        return hist
+
+    def close(self):
+        if self._file:
+            self._file.Close()
+
+        self._file = None
+
+    def _open(self):
+        if self._file is None:
+            self._file = ROOT.TFile.Open(self.path)
+            if not self._file or self._file.IsZombie():
+                raise IOError('Cannot open ' + self.path)
+
+        return self._file
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            # remote file - no persistent index
+            return None
+
+        return [HistSource.VERSION, stat.st_size, stat.st_mtime]
+
+    def _indexPath(self):
+        return cacheDir + '/' + hashlib.sha1(os.path.realpath(self.path)).hexdigest() + '.json'
+
+    def _loadIndex(self):
+        stamp = self._stamp()
+        if stamp is None:
+            return {}
+
+        try:
+            with open(self._indexPath()) as source:
+                content = json.load(source)
+        except (IOError, ValueError):
+            return {}
+
+        if content['stamp'] != stamp:
+            return {}
+
+        return dict((str(d), map(str, names)) for d, names in content['dirs'].items())
+
+    def _saveIndex(self):
+        stamp = self._stamp()
+        if stamp is None:
+            return
+
+        if not os.path.isdir(cacheDir):
+            try:
+                os.makedirs(cacheDir)
+            except OSError:
+                pass
+
+        path = self._indexPath()
+        tmpPath = path + '.%d' % os.getpid()
+        try:
+            with open(tmpPath, 'w') as out:
+                json.dump({'path': self.path, 'stamp': stamp, 'dirs': self._index}, out)
+
+            # rename is atomic - concurrent jobs never read partial files
+            os.rename(tmpPath, path)
+        except (IOError, OSError):
+            pass
+
+
+# shared HistSources {path: source}
+_sources = {}
+
+def getSource(path, hstore = None):
+    try:
+        return _sources[path]
+    except KeyError:
+        source = HistSource(path, hstore)
+        _sources[path] = source
+        return source
+
+def closeSources():
+    for source in _sources.values():
+        source.close()
+
+    _sources.clear()
+
+
+class HistDict(collections.MutableMapping):
+    """
+    Dictionary of histograms read on first access. transform (if given) is applied to each histogram once
+    after reading. Iterating over items() or values() reads every variation; iterate over the keys to read only
+    the variations that are used.
+    """
+
+    def __init__(self, source, names, transform = None):
+        self._source = source
+        # names is [(variation, key path)]; inserting in the key order of the source keeps the iteration order
+        # identical to a dict filled while looping over the keys
+        self._names = dict(names)
+        self._hists = {}
+        self._transform = transform
+
+    def __getitem__(self, variation):
+        try:
+            return self._hists[variation]
+        except KeyError:
+            pass
+
+        hist = self._source.get(self._names[variation])
+        if self._transform is not None:
+            self._transform(hist)
+
+        self._hists[variation] = hist
+
+        return hist
+
+    def __setitem__(self, variation, hist):
+        self._names[variation] = None
+        self._hists[variation] = hist
+
+    def __delitem__(self, variation):
+        del self._names[variation]
+        self._hists.pop(variation, None)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, variation):
+        return variation in self._names
+
+    def keys(self):
+        return self._names.keys()
+
+    def loaded(self):
+        return len(self._hists)
+
+
+def denormalize(hist, makeInt = False):
+    for iX in range(1, hist.GetNbinsX() + 1):
+        cont = hist.GetBinContent(iX) * hist.GetXaxis().GetBinWidth(iX)
+        if makeInt:
+            cont = round(cont)
+
+        hist.SetBinContent(iX, cont)
+
+def fetchHistograms(config, sourcePlots, totals, hstore):
+    """
+    Fill sourcePlots {region: {process: HistDict}} and totals {region: sum of nominals} for the workspace configuration.
+    Only the nominal histograms are read here; systematic variations are read when they are used.
+    """
+
+    for region in config.regions:
+        sourcePlots[region] = collections.defaultdict(dict)
+
+        # data histogram
+        source = getSource(config.sourcename.format(process = config.data, region = region), hstore)
+
+        histname = config.histname.format(process = config.data, region = region)
+
+        hist = source.get(histname)
+        if not hist:
+            print histname, 'not found'
+            sys.exit(1)
+
+        if config.binWidthNormalized:
+            denormalize(hist, makeInt = True)
+
+        # name does not have _*Up or _*Down suffix -> is a nominal histogram
+        sourcePlots[region]['data_obs']['nominal'] = hist
+
+        if config.binWidthNormalized:
+            transform = denormalize
+        else:
+            transform = None
+
+        # background and signal histograms
+        for process in config.bkgProcesses + config.signals:
+            source = getSource(config.sourcename.format(process = process, region = region), hstore)
+
+            if process in config.signals and config.signalHistname:
+                histname = config.signalHistname.format(process = process, region = region)
+            else:
+                histname = config.histname.format(process = process, region = region)
+
+            # find all histograms matching the specified histogram name pattern + (_variation)
+            names = source.find(histname)
+            if len(names) == 0:
+                continue
+
+            plots = HistDict(source, names, transform = transform)
+            sourcePlots[region][process] = plots
+
+            if 'nominal' in plots:
+                hist = plots['nominal']
+
+                if region not in totals:
+                    totals[region] = hist.Clone('total_' + region)
+                    totals[region].SetDirectory(hstore)
+                else:
+                    totals[region].Add(hist)
+
+    # make sure all signal processes appear at least in one region
+    for process in config.signals:
+        for region in config.regions:
+            if process in sourcePlots[region]:
+                break
+        else:
+            raise RuntimeError('Signal process ' + process + ' was not found in any of the regions.')
@@ -38,17 +38,7 @@ ROOT.gROOT.LoadMacro(thisdir + '/MakeLumiList.cc+')
 mask = {}
 if args.mask:
     mask = ROOT.GoodLumiFilter()
-    try:
-        with open(args.mask) as maskFile:
-            maskJSON = eval(maskFile.read())
-
-        for runStr, lumiRanges in maskJSON.items():
-            run = int(runStr)
-            for begin, end in lumiRanges:
-                for lumi in range(begin, end + 1):
-                    mask.addLumi(run, lumi)
-
-    except:
+    if not mask.readJSON(args.mask):
         print 'Could not parse mask JSON', args.mask
         sys.exit(1)
 
@@ -52,6 +52,7 @@ else:
 execfile(configPath, {'__file__': os.path.realpath(configPath)})
 
 from workspace_config import config
+from histsource import fetchHistograms
 
 ROOT.gSystem.Load('libRooFit.so')
 ROOT.gSystem.Load('libRooFitCore.so')
@@ -64,6 +65,9 @@ STATCUTOFF = 100.
 PRINTNUISANCE = False
 
 nuisances = []
+nuisanceSet = set()
+# {sample: (BinContents, nominal bin errors)}
+contentCache = {}
 
 def fct(*args):
     """
@@ -74,7 +78,8 @@ def fct(*args):
 
 def nuisance(nuis, up, down = None):
     """
-    Specific to symmetric log-normal nuisance (which is all we use in the end). Create the nuisance RooRealVar and return the variation
+    Specific to symmetric log-normal nuisance (which is all we use in the end). Return the variation and the nuisance name.
+    The nuisance RooRealVars are created in bulk through defineNuisances.
     """
 
     if down != None:
@@ -86,10 +91,6 @@ def nuisance(nuis, up, down = None):
         # can't be used for log-normal as is
         a1 = -1. + 1.e-5
 
-    if not workspace.arg(nuis):
-        fct('{nuis}[0,-5,5]'.format(nuis = nuis))
-        nuisances.append(nuis)
-
     return a1, nuis
 
 def nuisance_old(nuis, target, up, down, form):
@@ -165,459 +166,516 @@ def isLinkSource(source):
 
     return False
 
-def openHistSource(config, process, region, sources):
-    fname = config.sourcename.format(process = process, region = region)
-    try:
-        source = sources[fname]
-    except KeyError:
-        source = ROOT.TFile.Open(fname)
-        sources[fname] = source
+def defineVars(specs):
+    """
+    Bulk equivalent of fct(spec) for RooRealVar specs of form name[value], name[min,max], or name[value,min,max].
+    The variables are created directly (with the factory_tag the factory would set) and imported in one call.
+    """
 
-    return source
+    if len(specs) == 0:
+        return
+
+    created = []
+    argset = ROOT.RooArgSet()
+    for spec in specs:
+        name, values = re.match('([^[]+)\[(.+)\]$', spec).groups()
+        var = ROOT.RooRealVar(name, name, *map(float, values.split(',')))
+        var.setStringAttribute('factory_tag', spec)
+        created.append(var)
+        argset.add(var)
+
+    wsimport(argset)
+
+def defineNuisances(modifiers):
+    """
+    Create the nuisance RooRealVars of the (a1, nuisance name) modifiers that are not defined yet.
+    """
+
+    specs = []
+    for _, nuis in modifiers:
+        if nuis in nuisanceSet or workspace.arg(nuis):
+            continue
+
+        specs.append('{nuis}[0,-5,5]'.format(nuis = nuis))
+        nuisances.append(nuis)
+        nuisanceSet.add(nuis)
+
+    defineVars(specs)
+
+def constructionOrder(sourcePlots):
+    """
+    Order the samples so that every link target comes after its source chain.
+    Samples are otherwise visited in the order of config.regions and sourcePlots.
+    """
+
+    order = []
+    state = {} # sample -> 'visiting' or 'done'
+
+    def visit(sample):
+        if state.get(sample) == 'done':
+            return
+        if state.get(sample) == 'visiting':
+            raise RuntimeError('Circular link involving {0}'.format(sample))
+
+        state[sample] = 'visiting'
 
-def denormalize(hist, makeInt = False):
-    for iX in range(1, hist.GetNbinsX() + 1):
-        cont = hist.GetBinContent(iX) * hist.GetXaxis().GetBinWidth(iX)
-        if makeInt:
-            cont = round(cont)
+        source = linkSource(sample)
+        if source is not None:
+            if source[0] not in sourcePlots[source[1]]:
+                raise RuntimeError('{0} linked from missing sample {1}'.format(sample, source))
 
-        hist.SetBinContent(iX, cont)
+            visit(source)
 
-def fetchHistograms(config, sourcePlots, totals, hstore):
-    sources = {}
+        state[sample] = 'done'
+        order.append(sample)
 
     for region in config.regions:
-        sourcePlots[region] = collections.defaultdict(dict)
+        for process in sourcePlots[region]:
+            if process != 'data_obs':
+                visit((process, region))
 
-        # data histogram
-        sourceDir = openHistSource(config, config.data, region, sources)
+    return order
 
-        histname = config.histname.format(process = config.data, region = region)
+class BinContents(object):
+    """
+    {variation: bin contents (list indexed by bin - 1)} of a HistDict. A variation is converted (and read from the
+    source) only when it is first accessed, so nuisances skipped by the configuration are never read.
+    """
 
-        hist = sourceDir.Get(histname)
-        if not hist:
-            print histname, 'not found'
-            sys.exit(1)
+    def __init__(self, plots):
+        self._plots = plots
+        self._contents = {}
 
-        hist.SetDirectory(hstore)
+    def __getitem__(self, variation):
+        try:
+            return self._contents[variation]
+        except KeyError:
+            pass
 
-        if config.binWidthNormalized:
-            denormalize(hist, makeInt = True)
+        hist = self._plots[variation]
+        contents = [hist.GetBinContent(iX) for iX in range(1, hist.GetNbinsX() + 1)]
+        self._contents[variation] = contents
 
-        # name does not have _*Up or _*Down suffix -> is a nominal histogram
-        sourcePlots[region]['data_obs']['nominal'] = hist
-        
-        # background and signal histograms
-        for process in config.bkgProcesses + config.signals:
-            sourceDir = openHistSource(config, process, region, sources)
+        return contents
 
-            if process in config.signals and config.signalHistname:
-                histname = config.signalHistname.format(process = process, region = region)
-            else:
-                histname = config.histname.format(process = process, region = region)
+def binContents(sample):
+    """
+    Bin contents of the histograms of the sample (BinContents) and the bin errors of the nominal.
+    Cached; base samples are read once for all their link targets.
+    """
 
-            if '/' in histname:
-                # to automatically find all the variations, we need to do an "ls" of the directory
-                sourceDir = sourceDir.GetDirectory(os.path.dirname(histname))
-                histname = os.path.basename(histname)
+    try:
+        return contentCache[sample]
+    except KeyError:
+        pass
 
-            # find all histograms matching the specified histogram name pattern + (_variation)
-            for key in sourceDir.GetListOfKeys():
-                matches = re.match(histname + '(_.+(?:Up|Down)|)$', key.GetName())
-                if matches is None:
-                    continue
+    process, region = sample
+    plots = sourcePlots[region][process]
+    contents = BinContents(plots)
 
-                variation = matches.group(1)
+    nominal = plots['nominal']
+    errors = [nominal.GetBinError(iX) for iX in range(1, nominal.GetNbinsX() + 1)]
 
-                hist = key.ReadObj()
-                hist.SetDirectory(hstore)
+    contentCache[sample] = (contents, errors)
 
-                if config.binWidthNormalized:
-                    denormalize(hist)
+    return contents, errors
 
-                if not variation:
-                    # name does not have _*Up or _*Down suffix -> is a nominal histogram
-                    sourcePlots[region][process]['nominal'] = hist
+def makeBins(binSpecs, binModifiers):
+    """
+    Create the bin yields of a sample in bulk. binSpecs are the variable specs and binModifiers are per bin
+    (bin name, raw yield expression or None, list of modifiers). Bins with modifiers are raw x ProcessNormalization.
+    Returns the RooArgList of the bin yields.
+    """
 
-                    if region not in totals:
-                        totals[region] = hist.Clone('total_' + region)
-                        totals[region].SetDirectory(hstore)
-                    else:
-                        totals[region].Add(hist)
-                else:
-                    sourcePlots[region][process][variation[1:]] = hist
+    defineNuisances(sum((modifiers for _, _, modifiers in binModifiers), []))
+    defineVars(binSpecs)
 
-    for source in sources.values():
-        source.Close()
+    procnorms = []
+    argset = ROOT.RooArgSet()
+    for binName, _, modifiers in binModifiers:
+        if len(modifiers) == 0:
+            continue
 
-    sources = {}
+        procnorm = ROOT.ProcessNormalization('mod_{bin}'.format(bin = binName), 'mod_{bin}'.format(bin = binName))
+        for m in modifiers:
+            procnorm.addLogNormal(1. + m[0], workspace.var(m[1]))
 
-    # make sure all signal processes appear at least in one region
-    for process in config.signals:
-        for region in config.regions:
-            if process in sourcePlots[region]:
-                break
+        procnorms.append(procnorm)
+        argset.add(procnorm)
+
+    if argset.getSize() != 0:
+        wsimport(argset)
+
+    bins = ROOT.RooArgList()
+    for binName, raw, modifiers in binModifiers:
+        if len(modifiers) > 0:
+            if raw is not None:
+                fct(raw)
+
+            bin = fct('prod::mu_{bin}(raw_{bin},mod_{bin})'.format(bin = binName))
+        elif raw is not None:
+            bin = fct(raw.replace('::raw_', '::mu_', 1))
         else:
-            raise RuntimeError('Signal process ' + process + ' was not found in any of the regions.')
+            bin = workspace.arg('mu_{bin}'.format(bin = binName))
 
+        bins.add(bin)
 
-if __name__ == '__main__':
+    return bins
 
-    ## INPUT
-    # fetch all source histograms first    
+def linkTargetBins(sample, sbase, normModifiers):
+    """
+    Bins of a link target: mu is TF x the mu of the source.
+    """
 
-    sourcePlots = {}
-    totals = {} # {region: background total}
+    process, region = sample
+    sampleName = '{0}_{1}'.format(*sample)
+    sbaseName = '{0}_{1}'.format(*sbase)
 
-    hstore = ROOT.gROOT.mkdir('hstore')
+    plots = sourcePlots[region][process]
+    basePlots = sourcePlots[sbase[1]][sbase[0]]
 
-    fetchHistograms(config, sourcePlots, totals, hstore)
+    contents, errors = binContents(sample)
+    baseContents, baseErrors = binContents(sbase)
 
-    ## WORKSPACE
+    numer = contents['nominal']
+    denom = baseContents['nominal']
 
-    workspace = ROOT.RooWorkspace('wspace')
-    wsimport = SafeWorkspaceImporter(workspace)
+    # same as TH1::Divide
+    ratio = [n / d if d != 0. else 0. for n, d in zip(numer, denom)]
 
-    ROOT.RooMsgService.instance().setGlobalKillBelow(ROOT.RooFit.WARNING)
+    # collect all variations on numerator and denominator
+    upVariations = set(v for v in plots.keys() if v.endswith('Up'))
+    upVariations |= set(v for v in basePlots.keys() if v.endswith('Up'))
 
-    x = fct('{xname}[-1.e+10,1.e+10]'.format(xname = config.xname))
-    x.SetTitle(config.xtitle)
-    x.setUnit(config.xunit)
+    binSpecs = []
+    binModifiers = []
+
+    for ibin in range(1, len(numer) + 1):
+        rbin = ratio[ibin - 1]
+
+        binName = sampleName + '_bin{0}'.format(ibin)
+        baseBinName = sbaseName + '_bin{0}'.format(ibin)
+
+        if rbin == 0.:
+            print '    WARNING: {region} {process} bin{ibin} has tf = 0'.format(region = region, process = process, ibin = ibin)
+            binSpecs.append('mu_{bin}[0.]'.format(bin = binName))
+            binModifiers.append((binName, None, []))
+            continue
+
+        # tfName = binName + '_tf'
+        tfName = sampleName + '_' + sbaseName + '_bin{0}'.format(ibin) + '_tf'
+
+        # nominal tfactor (constant)
+        binSpecs.append('{tf}[{val}]'.format(tf = tfName, val = rbin))
+
+        # list of yield modifiers
+        modifiers = []
+
+        # statistical uncertainty on tfactor
+        binRelErr = errors[ibin - 1] / numer[ibin - 1]
+        baseRelErr = baseErrors[ibin - 1] / denom[ibin - 1]
+
+        modifiers.append(nuisance(baseBinName + '_stat', baseRelErr))
+        modifiers.append(nuisance(binName + '_stat', binRelErr))
+
+        # other systematic uncertainties on tfactor
+        for variation in upVariations:
+            var = variation[:-2]
+
+            if sample in config.ignoredNuisances and var in config.ignoredNuisances[sample]:
+                continue
+
+            if var in config.scaleNuisances and var in normModifiers:
+                # this uncertainty is non-shape and is taken care of already
+                continue
+
+            if var + 'Up' in plots:
+                numerUp = contents[var + 'Up'][ibin - 1]
+                numerDown = contents[var + 'Down'][ibin - 1]
+            else:
+                numerUp = numer[ibin - 1]
+                numerDown = numer[ibin - 1]
+
+            if var + 'Up' in basePlots:
+                denomUp = baseContents[var + 'Up'][ibin - 1]
+                denomDown = baseContents[var + 'Down'][ibin - 1]
+            else:
+                denomUp = denom[ibin - 1]
+                denomDown = denom[ibin - 1]
+
+            rup = numerUp / denomUp / rbin - 1.
+            rdown = numerDown / denomDown / rbin - 1.
+
+            if (sample, sbase, var) in config.ratioCorrelations:
+                # need to split the nuisance into correlated and anti-correlated
+                # assuming no scaleNuisance is partially correlated
+                correlation = config.ratioCorrelations[(sample, sbase, var)]
+                raup = numerUp / denomDown / rbin - 1.
+                radown = numerDown / denomUp / rbin - 1.
+
+                if var in config.deshapedNuisances:
+                    # this nuisance is artificially decorrelated among bins
+                    # calling "corr"Uncert function, but in reality this results in one nuisance per bin
+                    var = var + '_bin{ibin}'.format(ibin = ibin)
+
+                if abs(rup) > SMALLNUMBER or abs(rdown) > SMALLNUMBER:
+                    coeff = (1. + correlation) * 0.5
+                    if coeff != 0.:
+                        modifiers.append(nuisance(var + '_corr', coeff * rup, coeff * rdown))
+
+                if abs(raup) > SMALLNUMBER or abs(radown) > SMALLNUMBER:
+                    coeff = (1. - correlation) * 0.5
+                    if coeff != 0.:
+                        modifiers.append(nuisance(var + '_acorr', coeff * raup, coeff * radown))
+
+            else:
+                if abs(rup) < SMALLNUMBER and abs(rdown) < SMALLNUMBER:
+                    # fully correlated uncertainty that affects the numerator and denominator identically
+                    continue
+
+                if var in config.scaleNuisances:
+                    # this is a bin-independent modifier
+                    if var not in normModifiers:
+                        normModifiers[var] = nuisance(var, rup, rdown)
+                else:
+                    if var in config.deshapedNuisances:
+                        # this nuisance is artificially decorrelated among bins
+                        # calling "corr"Uncert function, but in reality this results in one nuisance per bin
+                        var = var + '_bin{ibin}'.format(ibin = ibin)
+
+                    modifiers.append(nuisance(var, rup, rdown))
+
+        # "raw" yield (= base x tfactor)
+        raw = 'expr::raw_{bin}("@0*@1", {{{tf}, mu_{baseBin}}})'.format(bin = binName, tf = tfName, baseBin = baseBinName)
+        binModifiers.append((binName, raw, modifiers))
+
+    defineNuisances(normModifiers.values())
+
+    return makeBins(binSpecs, binModifiers)
+
+def linkSourceBins(sample):
+    """
+    Bins of a link source: mu is its own, but has no uncertainty assigned.
+    """
+
+    process, region = sample
+    sampleName = '{0}_{1}'.format(*sample)
+    nominal = sourcePlots[region][process]['nominal']
+    contents = binContents(sample)[0]['nominal']
+
+    if sample in config.staticBase:
+        print '    this sample is a static base of some other sample'
+
+        fct('mu_{sample}_scale[1., 1.0e-6, 1.0e6.]'.format(sample = sampleName))
+        # bin mu is raw x norm
+        defineVars(['rawmu_{sample}_bin{bin}[{val}]'.format(sample = sampleName, bin = ibin, val = contents[ibin - 1]) for ibin in range(1, len(contents) + 1)])
+
+        bins = ROOT.RooArgList()
+        for ibin in range(1, len(contents) + 1):
+            bin = fct('prod::mu_{sample}_bin{bin}(rawmu_{sample}_bin{bin},mu_{sample}_scale)'.format(sample = sampleName, bin = ibin))
+            bins.add(bin)
 
-    # binning
-    h = sourcePlots[config.regions[0]]['data_obs']['nominal']
-    xaxis = h.GetXaxis()
-    if xaxis.GetXbins().GetSize():
-        x.setBinning(ROOT.RooBinning(h.GetNbinsX(), xaxis.GetXbins().GetArray()), 'default')
     else:
-        x.setBinning(ROOT.RooBinning(h.GetNbinsX(), xaxis.GetXmin(), xaxis.GetXmax()), 'default')
+        print '    this sample is a base of some other sample'
+        # each bin must be described by a free-floating RooRealVar unless this is a fixed base
+        # uncertainties are all casted on tfactors
 
-    print 'Constructing the workspace'
+        maxVal = nominal.GetMaximum() * 1.0e6
+        binSpecs = ['mu_{sample}_bin{bin}[{val},0.,{max}]'.format(sample = sampleName, bin = ibin, val = contents[ibin - 1], max = maxVal) for ibin in range(1, len(contents) + 1)]
+        defineVars(binSpecs)
+
+        bins = ROOT.RooArgList()
+        for ibin in range(1, len(contents) + 1):
+            bins.add(workspace.arg('mu_{sample}_bin{bin}'.format(sample = sampleName, bin = ibin)))
+
+    return bins
+
+def independentBins(sample, normModifiers):
+    """
+    Bins of a sample that does not participate in constraints: mu is its own and has uncertainties.
+    """
+
+    process, region = sample
+    sampleName = '{0}_{1}'.format(*sample)
+    plots = sourcePlots[region][process]
+
+    contents, errors = binContents(sample)
+    totalHist = totals[region]
 
-    # will construct the workspace iteratively to resolve links
-    iteration = 0
-    done = False
-    while not done:
+    binSpecs = []
+    binModifiers = []
 
-        done = True
+    for ibin in range(1, len(contents['nominal']) + 1):
+        binName = sampleName + '_bin{0}'.format(ibin)
 
-        print '<Iteration {0}>'.format(iteration)
-        iteration += 1
+        cval = contents['nominal'][ibin - 1]
+        if cval <= 0.:
+            # bin content is 0
+            binSpecs.append('mu_{bin}[0.]'.format(bin = binName))
+            binModifiers.append((binName, None, []))
+            continue
 
-        for region in config.regions:
-            dataObsName = 'data_obs_' + region
+        modifiers = []
 
-            if workspace.data(dataObsName):
-                # data_obs DataHist is added to the workspace only when all background & signal PDFs are constructed.
-                # -> this region is fully constructed
+        # statistical uncertainty - often not considered
+        relErr = errors[ibin - 1] / cval
+        bkgTotal = totalHist.GetBinContent(ibin)
+        if relErr > SMALLNUMBER and (bkgTotal <= 0. or cval / bkgTotal > STATCUTOFF):
+            modifiers.append(nuisance('{bin}_stat'.format(bin = binName), relErr))
+
+        for variation in plots:
+            if not variation.endswith('Up'):
                 continue
 
-            regionDone = True
-            for process, plots in sourcePlots[region].items():
-                if process == 'data_obs':
+            var = variation[:-2]
+
+            try:
+                if var in config.ignoredNuisances[sample]:
                     continue
+            except KeyError:
+                pass
 
-                sample = (process, region)
-                sampleName = '{0}_{1}'.format(*sample)
+            dup = contents[var + 'Up'][ibin - 1] / cval - 1.
+            ddown = contents[var + 'Down'][ibin - 1] / cval - 1.
 
-                if workspace.arg(sampleName + '_norm'):
-                    # this (process, region) is constructed already
+            if abs(dup - ddown) < SMALLNUMBER:
+                continue
+
+            if var in config.scaleNuisances:
+                # this is a bin-independent variation
+                if var in normModifiers:
+                    # we took care of this already
                     continue
 
-                # now construct the ParametricHist + norm
-                bins = ROOT.RooArgList()
-                # collect nuisances that affect the overall normalization
-                normModifiers = {}
+                if sample[0] in config.floatProcesses:
+                    # if this sample is freely floating; scale modifiers are unnecessary degrees of freedom
+                    continue
 
-                nominal = plots['nominal']
+                normModifiers[var] = nuisance(var, dup, ddown)
+            else:
+                if var in config.deshapedNuisances:
+                    # this nuisance is artificially decorrelated among bins
+                    # treat each (variation name)_(bin name) as a variation name
+                    var += '_bin{ibin}'.format(ibin = ibin)
 
-                print '  Constructing pdf for', sampleName
+                modifiers.append(nuisance(var, dup, ddown))
 
-                # there are three different types of samples
-                # 1. link target: mu is TF x someone else's mu
-                # 2. link source: mu is its own, but has no uncertainty assigned
-                # 3. independent: mu is its own and has uncertainties
+        if len(modifiers) > 0:
+            binSpecs.append('raw_{bin}[{val}]'.format(bin = binName, val = cval))
+        else:
+            binSpecs.append('mu_{bin}[{val}]'.format(bin = binName, val = cval))
 
-                sbase = linkSource(sample)
-                if sbase is not None:
-                    print '    this sample is a function of the yields in', sbase
-
-                    try:
-                        # check for source recursively
-                        source = sbase
-                        while source is not None:
-                            if not workspace.arg('{0}_{1}_norm'.format(*source)):
-                                # source of this sample is not constructed yet
-                                raise ReferenceError()
-
-                            source = linkSource(source)
-
-                    except ReferenceError:
-                        print '    but source', source, 'is not constructed yet.'
-                        # try again in a later iteration
-                        regionDone = False
-                        continue
+        binModifiers.append((binName, None, modifiers))
 
-                    sbaseName = '{0}_{1}'.format(*sbase)
-                    # sampleName = sampleName + '_' + sbaseName
-
-                    numer = nominal
-                    basePlots = sourcePlots[sbase[1]][sbase[0]]
-                    denom = basePlots['nominal']
-
-                    ratio = numer.Clone('ratio')
-                    ratio.Divide(denom)
-
-                    for ibin in range(1, nominal.GetNbinsX() + 1):
-                        rbin = ratio.GetBinContent(ibin)
-
-                        binName = sampleName + '_bin{0}'.format(ibin)
-                        baseBinName = sbaseName + '_bin{0}'.format(ibin)
-
-                        if rbin == 0.:
-                            print '    WARNING: {region} {process} bin{ibin} has tf = 0'.format(region = region, process = process, ibin = ibin)
-                            bin = fct('mu_{bin}[0.]'.format(bin = binName))
-                            bins.add(bin)
-                            continue
-
-                        # tfName = binName + '_tf'
-                        tfName = sampleName + '_' + sbaseName + '_bin{0}'.format(ibin) + '_tf'
-
-                        # nominal tfactor (constant)
-                        fct('{tf}[{val}]'.format(tf = tfName, val = rbin))
+    defineNuisances(normModifiers.values())
 
-                        # list of yield modifiers (switch to using RooArgList if the chained string becomes too long)
-                        modifiers = []
-
-                        # statistical uncertainty on tfactor
-                        binRelErr = nominal.GetBinError(ibin) / nominal.GetBinContent(ibin)
-                        baseRelErr = denom.GetBinError(ibin) / denom.GetBinContent(ibin)
-
-                        modifiers.append(nuisance(baseBinName + '_stat', baseRelErr))
-                        modifiers.append(nuisance(binName + '_stat', binRelErr))
-
-                        # other systematic uncertainties on tfactor
-                        # collect all variations on numerator and denominator
-                        upVariations = set(v for v in plots.keys() if v.endswith('Up'))
-                        upVariations |= set(v for v in basePlots.keys() if v.endswith('Up'))
-
-                        for variation in upVariations:
-                            var = variation[:-2]
-
-                            if sample in config.ignoredNuisances and var in config.ignoredNuisances[sample]:
-                                continue
-
-                            if var in config.scaleNuisances and var in normModifiers:
-                                # this uncertainty is non-shape and is taken care of already
-                                continue
-
-                            if var + 'Up' in plots:
-                                numerUp = plots[var + 'Up'].GetBinContent(ibin)
-                                numerDown = plots[var + 'Down'].GetBinContent(ibin)
-                            else:
-                                numerUp = numer.GetBinContent(ibin)
-                                numerDown = numer.GetBinContent(ibin)
-
-                            if var + 'Up' in basePlots:
-                                denomUp = basePlots[var + 'Up'].GetBinContent(ibin)
-                                denomDown = basePlots[var + 'Down'].GetBinContent(ibin)
-                            else:
-                                denomUp = denom.GetBinContent(ibin)
-                                denomDown = denom.GetBinContent(ibin)
-
-                            rup = numerUp / denomUp / rbin - 1.
-                            rdown = numerDown / denomDown / rbin - 1.
-
-                            if (sample, sbase, var) in config.ratioCorrelations:
-                                # need to split the nuisance into correlated and anti-correlated
-                                # assuming no scaleNuisance is partially correlated
-                                correlation = config.ratioCorrelations[(sample, sbase, var)]
-                                raup = numerUp / denomDown / rbin - 1.
-                                radown = numerDown / denomUp / rbin - 1.
-
-                                if var in config.deshapedNuisances:
-                                    # this nuisance is artificially decorrelated among bins
-                                    # calling "corr"Uncert function, but in reality this results in one nuisance per bin
-                                    var = var + '_bin{ibin}'.format(ibin = ibin)
-
-                                if abs(rup) > SMALLNUMBER or abs(rdown) > SMALLNUMBER:
-                                    coeff = (1. + correlation) * 0.5
-                                    if coeff != 0.:
-                                        modifiers.append(nuisance(var + '_corr', coeff * rup, coeff * rdown))
-
-                                if abs(raup) > SMALLNUMBER or abs(radown) > SMALLNUMBER:
-                                    coeff = (1. - correlation) * 0.5
-                                    if coeff != 0.:
-                                        modifiers.append(nuisance(var + '_acorr', coeff * raup, coeff * radown))
-
-                            else:
-                                if abs(rup) < SMALLNUMBER and abs(rdown) < SMALLNUMBER:
-                                    # fully correlated uncertainty that affects the numerator and denominator identically
-                                    continue
-
-                                if var in config.scaleNuisances:
-                                    # this is a bin-independent modifier
-                                    if var not in normModifiers:
-                                        normModifiers[var] = nuisance(var, rup, rdown)
-                                else:
-                                    if var in config.deshapedNuisances:
-                                        # this nuisance is artificially decorrelated among bins
-                                        # calling "corr"Uncert function, but in reality this results in one nuisance per bin
-                                        var = var + '_bin{ibin}'.format(ibin = ibin)
-
-                                    modifiers.append(nuisance(var, rup, rdown))
-
-                        if len(modifiers) > 0:
-                            # "raw" yield (= base x tfactor)
-                            fct('expr::raw_{bin}("@0*@1", {{{tf}, mu_{baseBin}}})'.format(bin = binName, tf = tfName, baseBin = baseBinName))
-
-                            procnorm = ROOT.ProcessNormalization('mod_{bin}'.format(bin = binName), 'mod_{bin}'.format(bin = binName))
-                            for m in modifiers:
-                                procnorm.addLogNormal(1. + m[0], workspace.var(m[1]))
-
-                            wsimport(procnorm)
-
-                            # mu = raw x mod
-                            bin = fct('prod::mu_{bin}(raw_{bin},mod_{bin})'.format(bin = binName))
-                        else:
-                            bin = fct('expr::mu_{bin}("@0*@1", {{{tf}, mu_{baseBin}}})'.format(bin = binName, tf = tfName, baseBin = baseBinName))
-
-                        bins.add(bin)
-
-                    ratio.Delete()
-
-                elif isLinkSource(sample):
-                    if sample in config.staticBase:
-                        print '    this sample is a static base of some other sample'
-    
-                        fct('mu_{sample}_scale[1., 1.0e-6, 1.0e6.]'.format(sample = sampleName))
-                        # bin mu is raw x norm
-                        for ibin in range(1, nominal.GetNbinsX() + 1):
-                            fct('rawmu_{sample}_bin{bin}[{val}]'.format(sample = sampleName, bin = ibin, val = nominal.GetBinContent(ibin)))
-                            bin = fct('prod::mu_{sample}_bin{bin}(rawmu_{sample}_bin{bin},mu_{sample}_scale)'.format(sample = sampleName, bin = ibin))
-                            bins.add(bin)
+    return makeBins(binSpecs, binModifiers)
 
-                    else:
-                        print '    this sample is a base of some other sample'
-                        # each bin must be described by a free-floating RooRealVar unless this is a fixed base
-                        # uncertainties are all casted on tfactors
-    
-                        for ibin in range(1, nominal.GetNbinsX() + 1):
-                            bin = fct('mu_{sample}_bin{bin}[{val},0.,{max}]'.format(sample = sampleName, bin = ibin, val = nominal.GetBinContent(ibin), max = nominal.GetMaximum() * 1.0e6))
-                            bins.add(bin)
+def constructSample(sample):
+    """
+    Construct the ParametricHist + norm of a (process, region). Link sources must be constructed already.
+    """
 
-                else:
-                    print '    this sample does not participate in constraints'
+    process, region = sample
+    sampleName = '{0}_{1}'.format(*sample)
 
-                    for ibin in range(1, nominal.GetNbinsX() + 1):
-                        binName = sampleName + '_bin{0}'.format(ibin)
+    nominal = sourcePlots[region][process]['nominal']
 
-                        cval = nominal.GetBinContent(ibin)
-                        if cval <= 0.:
-                            # bin content is 0
-                            bin = fct('mu_{bin}[0.]'.format(bin = binName))
-                        else:
-                            modifiers = []
+    # collect nuisances that affect the overall normalization
+    normModifiers = {}
 
-                            # statistical uncertainty - often not considered
-                            relErr = nominal.GetBinError(ibin) / cval
-                            bkgTotal = totals[region].GetBinContent(ibin)
-                            if relErr > SMALLNUMBER and (bkgTotal <= 0. or cval / bkgTotal > STATCUTOFF):
-                                modifiers.append(nuisance('{bin}_stat'.format(bin = binName), relErr))
+    print '  Constructing pdf for', sampleName
 
-                            for variation in plots:
-                                if not variation.endswith('Up'):
-                                    continue
+    # there are three different types of samples
+    # 1. link target: mu is TF x someone else's mu
+    # 2. link source: mu is its own, but has no uncertainty assigned
+    # 3. independent: mu is its own and has uncertainties
 
-                                var = variation[:-2]
+    sbase = linkSource(sample)
+    if sbase is not None:
+        print '    this sample is a function of the yields in', sbase
+        bins = linkTargetBins(sample, sbase, normModifiers)
 
-                                try:
-                                    if var in config.ignoredNuisances[sample]:
-                                        continue
-                                except KeyError:
-                                    pass
+    elif isLinkSource(sample):
+        bins = linkSourceBins(sample)
 
-                                dup = plots[var + 'Up'].GetBinContent(ibin) / cval - 1.
-                                ddown = plots[var + 'Down'].GetBinContent(ibin) / cval - 1.
+    else:
+        print '    this sample does not participate in constraints'
+        bins = independentBins(sample, normModifiers)
 
-                                if abs(dup - ddown) < SMALLNUMBER:
-                                    continue
+    # now compile the bins into a parametric hist pdf and a norm
+    shape = ROOT.RooParametricHist(sampleName, sampleName, x, bins, nominal)
+    wsimport(shape)
 
-                                if var in config.scaleNuisances:
-                                    # this is a bin-independent variation
-                                    if var in normModifiers:
-                                        # we took care of this already
-                                        continue
+    if sample[0] in config.floatProcesses:
+        print '      normalization is floated'
+        normName = 'rawnorm'
+        fct('mod_{sample}_norm[1.,0.,1.0e6]'.format(sample = sampleName))
 
-                                    if sample[0] in config.floatProcesses:
-                                        # if this sample is freely floating; scale modifiers are unnecessary degrees of freedom
-                                        continue
+    elif len(normModifiers) > 0:
+        normName = 'rawnorm'
+        procnorm = ROOT.ProcessNormalization('mod_{sample}_norm'.format(sample = sampleName), 'mod_{sample}_norm'.format(sample = sampleName))
+        for m in normModifiers.values():
+            procnorm.addLogNormal(1. + m[0], workspace.var(m[1]))
 
-                                    normModifiers[var] = nuisance(var, dup, ddown)
-                                else:
-                                    if var in config.deshapedNuisances:
-                                        # this nuisance is artificially decorrelated among bins
-                                        # treat each (variation name)_(bin name) as a variation name
-                                        var += '_bin{ibin}'.format(ibin = ibin)
+        wsimport(procnorm)
 
-                                    modifiers.append(nuisance(var, dup, ddown))
+    else:
+        # if there is no normModifier, RooAddition of the bins is the norm
+        normName = 'norm'
 
-                            if len(modifiers) > 0:
-                                raw = fct('raw_{bin}[{val}]'.format(bin = binName, val = cval))
+    if bins.getSize() > 1:
+        binNames = ','.join(bins.at(ib).GetName() for ib in range(bins.getSize()))
+        fct('sum::{sample}_{norm}({binNames})'.format(sample = sampleName, norm = normName, binNames = binNames))
+    else:
+        fct('expr::{sample}_{norm}("@0", {{{bin}}})'.format(sample = sampleName, norm = normName, bin = bins.at(0).GetName()))
 
-                                procnorm = ROOT.ProcessNormalization('mod_{bin}'.format(bin = binName), 'mod_{bin}'.format(bin = binName))
-                                for m in modifiers:
-                                    procnorm.addLogNormal(1. + m[0], workspace.var(m[1]))
+    if normName == 'rawnorm':
+        fct('expr::{sample}_norm("@0*@1", {{{sample}_rawnorm, mod_{sample}_norm}})'.format(sample = sampleName))
 
-                                wsimport(procnorm)
 
-                                bin = fct('prod::mu_{bin}(raw_{bin},mod_{bin})'.format(bin = binName))
-                            else:
-                                bin = fct('mu_{bin}[{val}]'.format(bin = binName, val = cval))
+if __name__ == '__main__':
 
-                        bins.add(bin)
+    ## INPUT
+    # fetch all source histograms first    
 
-                    # close switch between the three types of samples
+    sourcePlots = {}
+    totals = {} # {region: background total}
 
-                # now compile the bins into a parametric hist pdf and a norm
-                shape = ROOT.RooParametricHist(sampleName, sampleName, x, bins, nominal)
-                wsimport(shape)
+    hstore = ROOT.gROOT.mkdir('hstore')
 
-                if sample[0] in config.floatProcesses:
-                    print '      normalization is floated'
-                    normName = 'rawnorm'
-                    fct('mod_{sample}_norm[1.,0.,1.0e6]'.format(sample = sampleName))
+    fetchHistograms(config, sourcePlots, totals, hstore)
 
-                elif len(normModifiers) > 0:
-                    normName = 'rawnorm'
-                    procnorm = ROOT.ProcessNormalization('mod_{sample}_norm'.format(sample = sampleName), 'mod_{sample}_norm'.format(sample = sampleName))
-                    for m in normModifiers.values():
-                        procnorm.addLogNormal(1. + m[0], workspace.var(m[1]))
+    ## WORKSPACE
 
-                    wsimport(procnorm)
+    workspace = ROOT.RooWorkspace('wspace')
+    wsimport = SafeWorkspaceImporter(workspace)
 
-                else:
-                    # if there is no normModifier, RooAddition of the bins is the norm
-                    normName = 'norm'
+    ROOT.RooMsgService.instance().setGlobalKillBelow(ROOT.RooFit.WARNING)
 
-                if bins.getSize() > 1:
-                    binNames = ','.join(bins.at(ib).GetName() for ib in range(bins.getSize()))
-                    fct('sum::{sample}_{norm}({binNames})'.format(sample = sampleName, norm = normName, binNames = binNames))
-                else:
-                    fct('expr::{sample}_{norm}("@0", {{{bin}}})'.format(sample = sampleName, norm = normName, bin = bins.at(0).GetName()))
+    x = fct('{xname}[-1.e+10,1.e+10]'.format(xname = config.xname))
+    x.SetTitle(config.xtitle)
+    x.setUnit(config.xunit)
 
-                if normName == 'rawnorm':
-                    fct('expr::{sample}_norm("@0*@1", {{{sample}_rawnorm, mod_{sample}_norm}})'.format(sample = sampleName))
-            
-            # / for process, plots in sourcePlots[region].items():
+    # binning
+    h = sourcePlots[config.regions[0]]['data_obs']['nominal']
+    xaxis = h.GetXaxis()
+    if xaxis.GetXbins().GetSize():
+        x.setBinning(ROOT.RooBinning(h.GetNbinsX(), xaxis.GetXbins().GetArray()), 'default')
+    else:
+        x.setBinning(ROOT.RooBinning(h.GetNbinsX(), xaxis.GetXmin(), xaxis.GetXmax()), 'default')
 
-            if regionDone:
-                # All processes in the region are constructed. Add the observed RooDataHist.
-                data_obs = ROOT.RooDataHist(dataObsName, dataObsName, ROOT.RooArgList(x), sourcePlots[region]['data_obs']['nominal'])
-                wsimport(data_obs)
+    print 'Constructing the workspace'
 
-            else:
-                done = False
+    # link graph is resolved once; sources are constructed before their targets
+    for sample in constructionOrder(sourcePlots):
+        constructSample(sample)
+
+    for region in config.regions:
+        # All processes in the region are constructed. Add the observed RooDataHist.
+        dataObsName = 'data_obs_' + region
+        data_obs = ROOT.RooDataHist(dataObsName, dataObsName, ROOT.RooArgList(x), sourcePlots[region]['data_obs']['nominal'])
+        wsimport(data_obs)
 
     if PRINTNUISANCE:
         for n in sorted(nuisances):
@@ -1,8 +1,12 @@
 #include <iostream>
+#include <algorithm>
 #include "TGraph.h"
 #include "TF1.h"
 #include "TH2D.h"
 #include "TLegend.h"
+#include "TProfile.h"
+#include "TTreeFormula.h"
+#include "TTreeFormulaManager.h"
 
 #include "PlotBase.h"
 
@@ -152,3 +156,119 @@ PlotBase::AddLegendEntry(TString LegendEntry, Color_t ColorEntry, Int_t LineWidt
   fLineWidths.push_back(LineWidth);
   fLineStyles.push_back(LineStyle);
 }
+
+//--------------------------------------------------------------------
+void
+PlotBase::FillLines(std::vector<FillLine> const& lines)
+{
+  // Same filling as TTree::Draw (entries with zero weight are skipped, array expressions
+  // are iterated over their instances), but every tree is read only once.
+
+  struct Formulas {
+    TTreeFormulaManager* manager;
+    TTreeFormula*        cut;
+    TTreeFormula*        x;
+    TTreeFormula*        y;
+  };
+
+  std::vector<TTree*> trees;
+  for (UInt_t iL = 0; iL < lines.size(); iL++) {
+    if (std::find(trees.begin(), trees.end(), lines[iL].tree) == trees.end())
+      trees.push_back(lines[iL].tree);
+  }
+
+  for (UInt_t iT = 0; iT < trees.size(); iT++) {
+    TTree *tree = trees[iT];
+
+    std::vector<FillLine const*> treeLines;
+    std::vector<Formulas> formulas;
+    std::vector<TTreeFormula*> allFormulas;
+
+    for (UInt_t iL = 0; iL < lines.size(); iL++) {
+      if (lines[iL].tree != tree)
+        continue;
+
+      TString name;
+      name.Form("line%d", iL);
+
+      Formulas f = {new TTreeFormulaManager, 0, 0, 0};
+      f.x = new TTreeFormula(name + "_x", lines[iL].xExpr, tree);
+      f.manager->Add(f.x);
+      allFormulas.push_back(f.x);
+      if (lines[iL].yExpr != "") {
+        f.y = new TTreeFormula(name + "_y", lines[iL].yExpr, tree);
+        f.manager->Add(f.y);
+        allFormulas.push_back(f.y);
+      }
+      if (lines[iL].cut != "") {
+        f.cut = new TTreeFormula(name + "_cut", lines[iL].cut, tree);
+        f.manager->Add(f.cut);
+        allFormulas.push_back(f.cut);
+      }
+      f.manager->Sync();
+
+      treeLines.push_back(&lines[iL]);
+      formulas.push_back(f);
+    }
+
+    Int_t treeNumber = -1;
+    Long64_t nEntries = tree->GetEntries();
+
+    for (Long64_t iEntry = 0; iEntry < nEntries; iEntry++) {
+      if (tree->LoadTree(iEntry) < 0)
+        break;
+
+      if (tree->GetTreeNumber() != treeNumber) {
+        treeNumber = tree->GetTreeNumber();
+        for (UInt_t iF = 0; iF < allFormulas.size(); iF++)
+          allFormulas[iF]->UpdateFormulaLeaves();
+      }
+
+      for (UInt_t iL = 0; iL < treeLines.size(); iL++) {
+        Formulas &f = formulas[iL];
+        TH1 *hist = treeLines[iL]->hist;
+
+        Int_t nData = f.manager->GetNdata();
+        if (nData <= 0)
+          continue;
+
+        // instance 0 has to be evaluated first
+        Double_t weight = 1.;
+        if (f.cut != NULL)
+          weight = f.cut->EvalInstance(0);
+        Double_t xValue = f.x->EvalInstance(0);
+        Double_t yValue = 0.;
+        if (f.y != NULL)
+          yValue = f.y->EvalInstance(0);
+
+        for (Int_t iD = 0; iD < nData; iD++) {
+          if (iD != 0) {
+            if (f.cut != NULL && f.cut->GetMultiplicity())
+              weight = f.cut->EvalInstance(iD);
+            if (f.x->GetMultiplicity())
+              xValue = f.x->EvalInstance(iD);
+            if (f.y != NULL && f.y->GetMultiplicity())
+              yValue = f.y->EvalInstance(iD);
+          }
+
+          if (weight == 0.)
+            continue;
+
+          if (f.y == NULL)
+            hist->Fill(xValue, weight);
+          else if (hist->InheritsFrom(TProfile::Class()))
+            static_cast<TProfile*>(hist)->Fill(xValue, yValue, weight);
+          else
+            static_cast<TH2*>(hist)->Fill(xValue, yValue, weight);
+        }
+      }
+    }
+
+    // the manager is deleted together with the last of its formulas
+    for (UInt_t iL = 0; iL < formulas.size(); iL++) {
+      delete formulas[iL].x;
+      delete formulas[iL].y;
+      delete formulas[iL].cut;
+    }
+  }
+}
@@ -5,6 +5,7 @@
 
 #include "TTree.h"
 #include "TString.h"
+#include "TH1.h"
 
 class PlotBase
 {
@@ -40,6 +41,18 @@ class PlotBase
   void                   SetLegendBorderSize      ( Int_t size )                                  { fLegendBorderSize = size;    }
   
  protected:
+
+  // One histogram filled as in TTree::Draw(YExpr:XExpr>>hist,Cut). YExpr is empty for 1D histograms.
+  struct FillLine {
+    TTree*   tree;
+    TString  cut;
+    TString  xExpr;
+    TString  yExpr;
+    TH1*     hist;
+  };
+
+  void                   FillLines                ( std::vector<FillLine> const& lines );   // Lines sharing a tree are filled
+                                                                                             //   in one loop over its entries
   
   UInt_t                     fPlotCounter;        // This is used so that making scratch plots does not overlap
   
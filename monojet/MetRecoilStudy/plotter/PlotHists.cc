@@ -40,6 +40,7 @@ PlotHists::MakeHists(Int_t NumXBins, Double_t *XBins)
   TH1D *tempHist;
 
   std::vector<TH1D*> theHists;
+  std::vector<FillLine> lines;
 
   for (UInt_t i0 = 0; i0 < NumPlots; i0++) {
 
@@ -56,10 +57,16 @@ PlotHists::MakeHists(Int_t NumXBins, Double_t *XBins)
     tempHist = new TH1D(tempName,tempName,NumXBins,XBins);
     if (fIncludeErrorBars)
       tempHist->Sumw2();
-    inTree->Draw(inExpr+">>"+tempName,inCut);
+
+    FillLine line = {inTree, inCut, inExpr, "", tempHist};
+    lines.push_back(line);
 
     theHists.push_back(tempHist);
   }
+
+  // All lines sharing a tree are filled in a single pass
+  FillLines(lines);
+
   return theHists;
 }
 
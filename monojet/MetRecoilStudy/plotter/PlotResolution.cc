@@ -1,8 +1,10 @@
 #include <iostream>
+#include <algorithm>
 #include "TF1.h"
 #include "TH2D.h"
 #include "TProfile.h"
 #include "TLegend.h"
+#include "TProcessExecutor.h"
 
 #include "PlotResolution.h"
 
@@ -12,7 +14,8 @@ ClassImp(PlotResolution)
 PlotResolution::PlotResolution() :
   fInExprX(""),
   fDumpingFits(false),
-  fNumFitDumps(0)
+  fNumFitDumps(0),
+  fNumFitWorkers(1)
 {
   fParams.resize(0);
   fParamLows.resize(0);
@@ -87,6 +90,57 @@ PlotResolution::GetRatioToPoint(std::vector<TGraphErrors*> InGraphs, Double_t Ra
   return GetRatioToLine(InGraphs,tempRatioGraph);
 }
 
+//--------------------------------------------------------------------
+TVectorD*
+PlotResolution::FitBin(TH2D *hist, Int_t bin, TF1 *fitLoose, TF1 *fitFunc,
+                       TF1 *subFit1, TF1 *subFit2, TString dumpTitle, TString dumpName)
+{
+  TString histName = hist->GetName();
+  Double_t MinY = hist->GetYaxis()->GetXmin();
+  Double_t MaxY = hist->GetYaxis()->GetXmax();
+
+  TCanvas *tempCanvas = new TCanvas();
+  tempCanvas->SetTitle(dumpTitle);
+  fitLoose->SetParameter(0,10);
+  fitLoose->SetParameter(1,0);
+  fitLoose->SetParameter(2,30);
+  hist->ProjectionY(histName+"_py_loose",bin,bin)->Fit(fitLoose,"MLEQ","",MinY,MaxY);
+  fitFunc->SetParameter(0,fitLoose->GetParameter(1));
+  fitFunc->SetParameter(1,fitLoose->GetParameter(2));
+  fitFunc->SetParameter(2,fitLoose->GetParameter(2) * 2);
+  fitFunc->SetParameter(3,0.8);
+  fitFunc->SetParameter(4,fitLoose->GetParameter(0) * fitLoose->GetParameter(2));
+  hist->ProjectionY(histName+"_py",bin,bin)->Fit(fitFunc,"MLEQ","",MinY,MaxY);
+  if (dumpName != "") {
+    fitLoose->Draw("SAME");
+    subFit1->SetParameter(0,fitFunc->GetParameter(4) * fitFunc->GetParameter(3) / fitFunc->GetParameter(1));
+    subFit1->SetParameter(1,fitFunc->GetParameter(0));
+    subFit1->SetParameter(2,fitFunc->GetParameter(1));
+    subFit1->Draw("SAME");
+    subFit2->SetParameter(0,fitFunc->GetParameter(4) * (1 - fitFunc->GetParameter(3)) / fitFunc->GetParameter(2));
+    subFit2->SetParameter(1,fitFunc->GetParameter(0));
+    subFit2->SetParameter(2,fitFunc->GetParameter(2));
+    subFit2->Draw("SAME");
+    tempCanvas->SaveAs(dumpName+".png");
+    tempCanvas->SaveAs(dumpName+".pdf");
+    tempCanvas->SaveAs(dumpName+".C");
+  }
+
+  delete tempCanvas;
+
+  TVectorD *result = new TVectorD(16);
+  for (Int_t iParam = 0; iParam < 3; iParam++) {
+    (*result)[iParam] = fitLoose->GetParameter(iParam);
+    (*result)[3 + iParam] = fitLoose->GetParError(iParam);
+  }
+  for (Int_t iParam = 0; iParam < 5; iParam++) {
+    (*result)[6 + iParam] = fitFunc->GetParameter(iParam);
+    (*result)[11 + iParam] = fitFunc->GetParError(iParam);
+  }
+
+  return result;
+}
+
 //--------------------------------------------------------------------
 void
 PlotResolution::MakeFitGraphs(Int_t NumXBins, Double_t *XBins,
@@ -115,8 +169,10 @@ PlotResolution::MakeFitGraphs(Int_t NumXBins, Double_t *XBins,
   TString inCut = fDefaultCut;
   TString inExpr = fDefaultExpr;
 
-  TH2D *tempHist;
-  TProfile *tempProfile;
+  std::vector<TH2D*> tempHists;
+  std::vector<TProfile*> tempProfiles;
+  std::vector<TString> inExprs;
+  std::vector<FillLine> lines;
 
   TGraphErrors *tempGraph[6];
   for (Int_t init = 0; init < 6; init++)
@@ -145,9 +201,8 @@ PlotResolution::MakeFitGraphs(Int_t NumXBins, Double_t *XBins,
 
   std::cout <<  NumPlots << " lines will be made." << std::endl;
 
+  // Book the histograms of all lines first, so that each tree is read only once
   for (UInt_t i0 = 0; i0 < NumPlots; i0++) {
-    std::cout << NumPlots - i0 << " more to go." << std::endl;
-
     if (fInTrees.size() != 0)
       inTree = fInTrees[i0];
     if (fInCuts.size()  != 0)
@@ -160,101 +215,122 @@ PlotResolution::MakeFitGraphs(Int_t NumXBins, Double_t *XBins,
     TString tempName;
     tempName.Form("Hist_%d",fPlotCounter);
     fPlotCounter++;
-    tempHist = new TH2D(tempName,tempName,NumXBins,XBins,NumYBins,MinY,MaxY);
+    TH2D *tempHist = new TH2D(tempName,tempName,NumXBins,XBins,NumYBins,MinY,MaxY);
     tempHist->Sumw2();
-    tempProfile = new TProfile(tempName+"prof",tempName+"prof",NumXBins,XBins);
-    inTree->Draw(inExpr+":"+fInExprX+">>"+tempName,inCut);
-    inTree->Draw(fInExprX+":"+fInExprX+">>"+tempName+"prof",inCut);
-    TString dumpTitle = fLegendEntries[i0] + ";" + inExpr + ";Num Events";
+    TProfile *tempProfile = new TProfile(tempName+"prof",tempName+"prof",NumXBins,XBins);
+    tempHist->SetTitle(fLegendEntries[i0] + ";" + fInExprX + ";" + inExpr + ";Num Events");
+
+    FillLine histLine = {inTree, inCut, fInExprX, inExpr, tempHist};
+    lines.push_back(histLine);
+    FillLine profLine = {inTree, inCut, fInExprX, fInExprX, tempProfile};
+    lines.push_back(profLine);
+
+    tempHists.push_back(tempHist);
+    tempProfiles.push_back(tempProfile);
+    inExprs.push_back(inExpr);
+  }
+
+  FillLines(lines);
+
+  // The fits of the x bins are independent and run in separate processes
+  ROOT::TProcessExecutor *pool = 0;
+  if (fNumFitWorkers > 1)
+    pool = new ROOT::TProcessExecutor(std::min(fNumFitWorkers, UInt_t(NumXBins)));
+
+  for (UInt_t i0 = 0; i0 < NumPlots; i0++) {
+    std::cout << NumPlots - i0 << " more to go." << std::endl;
+
+    TH2D *tempHist = tempHists[i0];
+    TProfile *tempProfile = tempProfiles[i0];
+
+    TString dumpTitle = fLegendEntries[i0] + ";" + inExprs[i0] + ";Num Events";
     std::cout << dumpTitle << std::endl;
     fitLoose->SetTitle(dumpTitle);
     fitFunc->SetTitle(dumpTitle);
     subFit1->SetTitle(dumpTitle);
     subFit2->SetTitle(dumpTitle);
-    tempHist->SetTitle(fLegendEntries[i0] + ";" + fInExprX + ";" + inExpr + ";Num Events");
     for (Int_t init = 0; init < 6; init++)
       tempGraph[init] = new TGraphErrors(NumXBins);
 
-    for (Int_t i1 = 0; i1 < NumXBins; i1++) {
-      TCanvas *tempCanvas = new TCanvas();
-      tempCanvas->SetTitle(dumpTitle);
-      fitLoose->SetParameter(0,10);
-      fitLoose->SetParameter(1,0);
-      fitLoose->SetParameter(2,30);
-      tempHist->ProjectionY(tempName+"_py_loose",i1+1,i1+1)->Fit(fitLoose,"MLEQ","",MinY,MaxY);
-      fitFunc->SetParameter(0,fitLoose->GetParameter(1));
-      fitFunc->SetParameter(1,fitLoose->GetParameter(2));
-      fitFunc->SetParameter(2,fitLoose->GetParameter(2) * 2);
-      fitFunc->SetParameter(3,0.8);
-      fitFunc->SetParameter(4,fitLoose->GetParameter(0) * fitLoose->GetParameter(2));
-      tempHist->ProjectionY(tempName+"_py",i1+1,i1+1)->Fit(fitFunc,"MLEQ","",MinY,MaxY);
+    auto fitBin = [&](Int_t i1) {
+      TString dumpName = "";
       if (fDumpingFits) {
-        TString dumpName;
         Int_t lower = XBins[i1];
         Int_t upper = XBins[i1 + 1];
-        dumpName.Form("DumpFit_%04d_%dTo%d",fNumFitDumps,lower,upper);
-        fitLoose->Draw("SAME");
-	subFit1->SetParameter(0,fitFunc->GetParameter(4) * fitFunc->GetParameter(3) / fitFunc->GetParameter(1));
-	subFit1->SetParameter(1,fitFunc->GetParameter(0));
-	subFit1->SetParameter(2,fitFunc->GetParameter(1));
-	subFit1->Draw("SAME");
-	subFit2->SetParameter(0,fitFunc->GetParameter(4) * (1 - fitFunc->GetParameter(3)) / fitFunc->GetParameter(2));
-	subFit2->SetParameter(1,fitFunc->GetParameter(0));
-	subFit2->SetParameter(2,fitFunc->GetParameter(2));
-	subFit2->Draw("SAME");
-        tempCanvas->SaveAs(dumpName+".png");
-        tempCanvas->SaveAs(dumpName+".pdf");
-        tempCanvas->SaveAs(dumpName+".C");
-        fNumFitDumps++;
+        dumpName.Form("DumpFit_%04d_%dTo%d",fNumFitDumps + i1,lower,upper);
       }
+      return FitBin(tempHist,i1+1,fitLoose,fitFunc,subFit1,subFit2,dumpTitle,dumpName);
+    };
+
+    std::vector<TVectorD*> results;
+    if (pool)
+      results = pool->Map(fitBin, ROOT::TSeqI(NumXBins));
+    else {
+      for (Int_t i1 = 0; i1 < NumXBins; i1++)
+        results.push_back(fitBin(i1));
+    }
+
+    if (fDumpingFits)
+      fNumFitDumps += NumXBins;
+
+    for (Int_t i1 = 0; i1 < NumXBins; i1++) {
+      TVectorD &result = *results[i1];
+      // loose fit parameters and errors
+      Double_t *looseParam = result.GetMatrixArray();
+      Double_t *looseError = looseParam + 3;
+      // full fit parameters and errors
+      Double_t *funcParam = looseParam + 6;
+      Double_t *funcError = looseParam + 11;
 
       Double_t xValue = tempProfile->GetBinContent(i1+1);
       Double_t xError = tempProfile->GetBinError(i1+1);
 
-      tempGraph[0]->SetPoint(i1,xValue,fitFunc->GetParameter(0));
+      tempGraph[0]->SetPoint(i1,xValue,funcParam[0]);
       if (fIncludeErrorBars)
-	tempGraph[0]->SetPointError(i1,xError,fitFunc->GetParError(0));
+	tempGraph[0]->SetPointError(i1,xError,funcError[0]);
 
       Int_t sigWanted = 0;
-      if (fitFunc->GetParameter(1) < fitFunc->GetParameter(2))
+      if (funcParam[1] < funcParam[2])
 	sigWanted = 1;
       else
 	sigWanted = 2;
-      tempGraph[1]->SetPoint(i1,xValue,fitFunc->GetParameter(sigWanted));
+      tempGraph[1]->SetPoint(i1,xValue,funcParam[sigWanted]);
       if (fIncludeErrorBars)
-	tempGraph[1]->SetPointError(i1,xError,fitFunc->GetParError(sigWanted));
+	tempGraph[1]->SetPointError(i1,xError,funcError[sigWanted]);
 
-      if (fitFunc->GetParameter(1) > fitFunc->GetParameter(2))
+      if (funcParam[1] > funcParam[2])
 	sigWanted = 1;
       else
 	sigWanted = 2;
-      tempGraph[2]->SetPoint(i1,xValue,fitFunc->GetParameter(sigWanted));
+      tempGraph[2]->SetPoint(i1,xValue,funcParam[sigWanted]);
       if (fIncludeErrorBars)
-	tempGraph[2]->SetPointError(i1,xError,fitFunc->GetParError(sigWanted));
+	tempGraph[2]->SetPointError(i1,xError,funcError[sigWanted]);
 
-      Float_t weight1 = fitFunc->GetParameter(3);
+      Float_t weight1 = funcParam[3];
       Float_t weight2 = 1 - weight1;
-      Float_t weightErr = fitFunc->GetParError(3);
+      Float_t weightErr = funcError[3];
       
-      tempGraph[3]->SetPoint(i1,xValue,(weight1 * fitFunc->GetParameter(1) + weight2 * fitFunc->GetParameter(2)));
+      tempGraph[3]->SetPoint(i1,xValue,(weight1 * funcParam[1] + weight2 * funcParam[2]));
       if (fIncludeErrorBars)
-	tempGraph[3]->SetPointError(i1,xError,sqrt(pow(weight1 * fitFunc->GetParError(1),2) + pow(weight2 * fitFunc->GetParError(2),2) + 
-                                                   pow(weightErr * (fitFunc->GetParameter(1) - fitFunc->GetParameter(2)),2)));
+	tempGraph[3]->SetPointError(i1,xError,sqrt(pow(weight1 * funcError[1],2) + pow(weight2 * funcError[2],2) + 
+                                                   pow(weightErr * (funcParam[1] - funcParam[2]),2)));
       
-      tempGraph[4]->SetPoint(i1,xValue,fitLoose->GetParameter(1));
+      tempGraph[4]->SetPoint(i1,xValue,looseParam[1]);
       if (fIncludeErrorBars)
-	tempGraph[4]->SetPointError(i1,xError,fitLoose->GetParError(1));
+	tempGraph[4]->SetPointError(i1,xError,looseError[1]);
       
-      tempGraph[5]->SetPoint(i1,xValue,fitLoose->GetParameter(2));
+      tempGraph[5]->SetPoint(i1,xValue,looseParam[2]);
       if (fIncludeErrorBars)
-	tempGraph[5]->SetPointError(i1,xError,fitLoose->GetParError(2));
-      
-      delete tempCanvas;
+	tempGraph[5]->SetPointError(i1,xError,looseError[2]);
+
+      delete results[i1];
     }
     for (Int_t iPlot = 0; iPlot < 6; iPlot++)
       fFits[iPlot].push_back(tempGraph[iPlot]);
     delete tempHist;
   }
+
+  delete pool;
 }
 
 //--------------------------------------------------------------------
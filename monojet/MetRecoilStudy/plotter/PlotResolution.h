@@ -3,6 +3,9 @@
 
 #include "TGraphErrors.h"
 #include "TCanvas.h"
+#include "TVectorD.h"
+#include "TH2D.h"
+#include "TF1.h"
 
 #include "PlotBase.h"
 
@@ -41,9 +44,14 @@ class PlotResolution : public PlotBase
                                                          Double_t YMin, Double_t YMax, Bool_t logY = false);
   
   void                         SetDumpingFits          ( Bool_t dump )                                  { fDumpingFits = dump;         }
+  void                         SetNumFitWorkers        ( UInt_t num )                                   { fNumFitWorkers = num;        }
   
  private:
 
+  // Fits one x bin. Returns the loose fit parameters and errors followed by those of the full fit.
+  TVectorD*                    FitBin                  ( TH2D *hist, Int_t bin, TF1 *fitLoose, TF1 *fitFunc,
+                                                         TF1 *subFit1, TF1 *subFit2, TString dumpTitle, TString dumpName );
+
   std::vector<TGraphErrors*> fFits[6];
   
   std::vector<Int_t>         fParams;             // This is vector used for setting parameter limits for fits
@@ -55,6 +63,7 @@ class PlotResolution : public PlotBase
   
   Bool_t                     fDumpingFits;        // Bool used to dump .png files if you want to check fits
   Int_t                      fNumFitDumps;        // int to keep track of different number of fits
+  UInt_t                     fNumFitWorkers;      // Number of processes running the fits of the x bins
   
   ClassDef(PlotResolution,1)
 };
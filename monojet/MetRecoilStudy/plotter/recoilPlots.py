@@ -33,6 +33,7 @@ plotter = ROOT.PlotResolution()
 #####################################
 
 plotter.SetDumpingFits(True)
+plotter.SetNumFitWorkers(8)
 
 fitBin = 150.0
 
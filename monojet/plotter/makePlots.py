@@ -1,6 +1,6 @@
 #! /usr/bin/python
 import sys, os, string, re, time, datetime
-from multiprocessing import Process
+from multiprocessing import Process, Pool
 from array import *
 
 from config import *
@@ -29,6 +29,7 @@ vec2 = TLorentzVector()
 setTDRStyle()
 
 gROOT.LoadMacro("functions.C+");
+gROOT.LoadMacro(os.path.dirname(os.path.realpath(__file__)) + "/../../common/MultiDraw.cc+")
 
 metcut = 200.
 
@@ -37,6 +38,133 @@ print "Starting Plotting Be Patient!"
 lumi = 2109.
 lumi_str = 2.1
 
+# number of processes filling the histograms; each reads the tree of one physics process
+NWORKERS = 4
+
+#Incase you want to apply event by event re-weighting
+
+w = "((0.0*(npv>-0.5&&npv<=0.5)+3.30418257204*(npv>0.5&&npv<=1.5)+2.59691269521*(npv>1.5&&npv<=2.5)+2.44251087681*(npv>2.5&&npv<=3.5)+2.42846225153*(npv>3.5&&npv<=4.5)+2.40062512591*(npv>4.5&&npv<=5.5)+2.30279811595*(npv>5.5&&npv<=6.5)+2.12054720297*(npv>6.5&&npv<=7.5)+1.9104708827*(npv>7.5&&npv<=8.5)+1.67904936047*(npv>8.5&&npv<=9.5)+1.43348925382*(npv>9.5&&npv<=10.5)+1.17893952713*(npv>10.5&&npv<=11.5)+0.940505177881*(npv>11.5&&npv<=12.5)+0.740901867872*(npv>12.5&&npv<=13.5)+0.56877478036*(npv>13.5&&npv<=14.5)+0.433148655714*(npv>14.5&&npv<=15.5)+0.325343558476*(npv>15.5&&npv<=16.5)+0.241688459349*(npv>16.5&&npv<=17.5)+0.180491032782*(npv>17.5&&npv<=18.5)+0.136993937378*(npv>18.5&&npv<=19.5)+0.104859480066*(npv>19.5&&npv<=20.5)+0.0768271030309*(npv>20.5&&npv<=21.5)+0.0563426184938*(npv>21.5&&npv<=22.5)+0.0454037058117*(npv>22.5&&npv<=23.5)+0.0359945616383*(npv>23.5&&npv<=24.5)+0.0286879205085*(npv>24.5&&npv<=25.5)+0.0208185595478*(npv>25.5&&npv<=26.5)+0.0170977379612*(npv>26.5&&npv<=27.5)+0.0122446391898*(npv>27.5&&npv<=28.5)+0.0148028308301*(npv>28.5&&npv<=29.5)+0.0120527550003*(npv>29.5&&npv<=30.5)+0.00402643194054*(npv>30.5&&npv<=31.5)+0.00981143754301*(npv>31.5&&npv<=32.5)+0.0*(npv>32.5&&npv<=33.5)+0.0155664899019*(npv>33.5&&npv<=34.5)+0.0*(npv>34.5&&npv<=35.5)+0.0*(npv>35.5&&npv<=36.5)+0.0*(npv>36.5&&npv<=37.5)+0.0*(npv>37.5&&npv<=38.5)+0.0*(npv>38.5&&npv<=39.5)))"
+
+anlo1_over_alo = "(1.24087232993*(genBos_pt>100.0&&genBos_pt<=150.0)+1.55807026252*(genBos_pt>150.0&&genBos_pt<=200.0)+1.51043242876*(genBos_pt>200.0&&genBos_pt<=250.0)+1.47333461572*(genBos_pt>250.0&&genBos_pt<=300.0)+1.43497331471*(genBos_pt>300.0&&genBos_pt<=350.0)+1.37846354687*(genBos_pt>350.0&&genBos_pt<=400.0)+1.2920177717*(genBos_pt>400.0&&genBos_pt<=500.0)+1.31414429236*(genBos_pt>500.0&&genBos_pt<=600.0)+1.20453974747*(genBos_pt>600.0))"
+a_ewkcorr = "(0.998568444581*(genBos_pt>100.0&&genBos_pt<=150.0)+0.992098286517*(genBos_pt>150.0&&genBos_pt<=200.0)+0.986010290609*(genBos_pt>200.0&&genBos_pt<=250.0)+0.980265498435*(genBos_pt>250.0&&genBos_pt<=300.0)+0.974830448283*(genBos_pt>300.0&&genBos_pt<=350.0)+0.969676202351*(genBos_pt>350.0&&genBos_pt<=400.0)+0.962417128177*(genBos_pt>400.0&&genBos_pt<=500.0)+0.953511139209*(genBos_pt>500.0&&genBos_pt<=600.0)+0.934331895615*(genBos_pt>600.0))"
+
+w_ewkcorr = "(0.980859240872*(genBos_pt>100.0&&genBos_pt<=150.0)+0.962118764182*(genBos_pt>150.0&&genBos_pt<=200.0)+0.944428528597*(genBos_pt>200.0&&genBos_pt<=250.0)+0.927685912907*(genBos_pt>250.0&&genBos_pt<=300.0)+0.911802238928*(genBos_pt>300.0&&genBos_pt<=350.0)+0.896700388113*(genBos_pt>350.0&&genBos_pt<=400.0)+0.875368225896*(genBos_pt>400.0&&genBos_pt<=500.0)+0.849096933047*(genBos_pt>500.0&&genBos_pt<=600.0)+0.792158791839*(genBos_pt>600.0))"
+wnlo012_over_wlo = "(1.89123123702*(genBos_pt>100.0&&genBos_pt<=150.0)+1.70414182145*(genBos_pt>150.0&&genBos_pt<=200.0)+1.60726459197*(genBos_pt>200.0&&genBos_pt<=250.0)+1.57205818769*(genBos_pt>250.0&&genBos_pt<=300.0)+1.51688539716*(genBos_pt>300.0&&genBos_pt<=350.0)+1.41090079307*(genBos_pt>350.0&&genBos_pt<=400.0)+1.30757555038*(genBos_pt>400.0&&genBos_pt<=500.0)+1.32046236765*(genBos_pt>500.0&&genBos_pt<=600.0)+1.26852513234*(genBos_pt>600.0))"
+
+z_ewkcorr = "(0.984525344338*(genBos_pt>100.0&&genBos_pt<=150.0)+0.969078612189*(genBos_pt>150.0&&genBos_pt<=200.0)+0.954626582726*(genBos_pt>200.0&&genBos_pt<=250.0)+0.941059330021*(genBos_pt>250.0&&genBos_pt<=300.0)+0.92828367065*(genBos_pt>300.0&&genBos_pt<=350.0)+0.916219976557*(genBos_pt>350.0&&genBos_pt<=400.0)+0.89931198024*(genBos_pt>400.0&&genBos_pt<=500.0)+0.878692669663*(genBos_pt>500.0&&genBos_pt<=600.0)+0.834717745177*(genBos_pt>600.0))"
+znlo012_over_zlo = "(1.68500099066*(genBos_pt>100.0&&genBos_pt<=150.0)+1.55256109189*(genBos_pt>150.0&&genBos_pt<=200.0)+1.52259467479*(genBos_pt>200.0&&genBos_pt<=250.0)+1.52062313572*(genBos_pt>250.0&&genBos_pt<=300.0)+1.4322825541*(genBos_pt>300.0&&genBos_pt<=350.0)+1.45741443405*(genBos_pt>350.0&&genBos_pt<=400.0)+1.36849777989*(genBos_pt>400.0&&genBos_pt<=500.0)+1.3580214432*(genBos_pt>500.0&&genBos_pt<=600.0)+1.16484769869*(genBos_pt>600.0))"
+
+wm_postfit = "(1.0)"
+zm_postfit = "(1.0)"
+g_postfit  = "(1.0)"
+
+def make_hist(histName, var, bin, low, high):
+    if var == 'met':
+        #binLowE = [200,250,300,350,400,500,600,900,1500]
+        binLowE = [200,250,300,350,400,500,600,1000]
+#        binLowE = [250,300,350,400,500,600,1000]
+        hist = TH1F(histName,histName,len(binLowE)-1,array('d',binLowE))
+    else:
+        hist = TH1F(histName, histName, bin, low, high)
+
+    hist.Sumw2()
+    return hist
+
+def selection_and_weight(Type, channel):
+    """
+    Return (cut, weight) expressions used to fill the histograms of the process in the channel,
+    or None if the process is not filled.
+    """
+
+    cut_standard = build_selection(channel,metcut)
+
+    if channel is 'signal' or channel is 'Zmm' or channel is 'Wmn':
+        w_trig = '((met < 250)*0.97 + (met >=250 && met<350)* 0.987 + (met>=350)* 1.0 )'
+    else:
+        w_trig = '(1.0)'
+
+    if Type.startswith('signal_h_ggf') or Type.startswith('signal_dm_av_1_2'):
+        return cut_standard, "mcWeight*"+str(w)
+
+    if Type.startswith('data'):
+        if channel is 'signal' or channel is 'Zmm' or channel is 'Wmn':
+            return "(" + cut_standard + " && (triggerFired[0]==1 || triggerFired[1]==1 || triggerFired[2]==1) )", ""
+        else:
+            return cut_standard, ""
+
+    if Type is 'signal_dm' or Type is 'signal_dm_s' or Type is 'signal_dm_ps' or Type is 'signal_dm_v':
+        return None
+
+    if Type.startswith('GJets') :
+        return cut_standard, "mcWeight*0.98*"+str(g_postfit)+"*"+str(anlo1_over_alo)+"*"+str(a_ewkcorr)+"*" +str(w)+"*"+str(w_trig)
+
+    elif (Type.startswith('Zvv') or Type.startswith('Zll')) :
+        if channel is 'signal' :
+            return cut_standard, "mcWeight*"+str(zm_postfit)+"*"+str(z_ewkcorr)+"*"+str(znlo012_over_zlo)+"*"+str(w)+"*"+str(w_trig)
+        else:
+            #SF explicitly written for the leading tight lepton from the root files
+            return cut_standard, "mcWeight*(0.98 *(lep1Eta<2.1)+0.91*(lep1Eta>=2.1))*"+str(zm_postfit)+"*"+str(z_ewkcorr)+"*"+str(znlo012_over_zlo)+"*"+str(w)+"*"+str(w_trig)
+
+    elif Type.startswith('Wlv'):
+        return cut_standard, "mcWeight*"+str(wm_postfit)+"*"+str(wnlo012_over_wlo)+"*"+str(w_ewkcorr)+"*" +str(w)+"*"+str(w_trig)
+
+    else:
+        return cut_standard, "mcWeight*" +str(w)+"*"+str(w_trig)
+
+def fill_process(Type):
+    """
+    Fill the histograms of all (channel, variable) of the process in one pass over its tree.
+    The histograms are written to a temporary file. Returns (Type, file name, total number of events).
+    Module-level function to be used in a multiprocessing pool.
+    """
+
+    # this right now breaks the tchain logic! 
+    # if we have more than 1 file, this will break!!!!  
+
+    if Type is not 'data':
+        source = TFile(physics_processes[Type]['files'][0],"read")
+        total = source.Get("htotal").GetBinContent(1)
+        #total = h1[Type].GetEntries()
+        source.Close()
+    else:
+        total = 1.0
+
+    plotter = ROOT.MultiDraw()
+    plotter.setWeightBranch('')
+    for sample in physics_processes[Type]['files']:
+        plotter.addInputPath(sample)
+
+    hists = []
+    for channel in channel_list:
+        selection = selection_and_weight(Type, channel)
+
+        for v in variable_list:
+            name, var, bin, low, high = arguments[v][:5]
+            hist = make_hist(Type+'_'+name+'_'+channel, var, bin, low, high)
+            hist.SetDirectory(0)
+            hists.append(hist)
+
+            if selection is not None:
+                plotter.addPlot(hist, var, selection[0], True, False, selection[1])
+
+    print 'INFO filling', plotter.numObjs(), 'histograms for', Type, datetime.datetime.fromtimestamp( time.time())
+
+    if plotter.numObjs() != 0:
+        plotter.fillPlots()
+
+    fileName = '/tmp/mj_hists_' + str(os.getpid()) + '_' + Type + '.root'
+    output = TFile(fileName, "recreate")
+    for hist in hists:
+        output.cd()
+        hist.Write()
+    output.Close()
+
+    return Type, fileName, total
+
+# {Type: {histogram name: TH1F}} and {Type: total number of events}, filled before the plotting processes are forked
+filled = {}
+totals = {}
+
 def plot_stack(channel, name,var, bin, low, high, ylabel, xlabel, setLog = False):
 
     yield_dic = {}
@@ -49,8 +177,6 @@ def plot_stack(channel, name,var, bin, low, high, ylabel, xlabel, setLog = False
     else:
         added = TH1D('added', 'added',bin,low,high)
     added.Sumw2()
-    f  = {}
-    h1 = {}
 
     Variables = {}
     cut_standard= build_selection(channel,metcut)
@@ -73,89 +199,20 @@ def plot_stack(channel, name,var, bin, low, high, ylabel, xlabel, setLog = False
         yield_dic[physics_processes[Type]['datacard']] = 0
  
     for Type in reordered_physics_processes:
-        # Create the Histograms
+        # Histograms are filled in fill_process
         histName = Type+'_'+name+'_'+channel
+        Variables[Type] = filled[Type][histName]
 
-        if var is 'met':
-            #binLowE = [200,250,300,350,400,500,600,900,1500]
-            binLowE = [200,250,300,350,400,500,600,1000]
-#            binLowE = [250,300,350,400,500,600,1000]
-            Variables[Type] = TH1F(histName,histName,len(binLowE)-1,array('d',binLowE))
-        else:
-            Variables[Type] = TH1F(histName, histName, bin, low, high)
-
-        Variables[Type].Sumw2()
-        #print "\n"
-
-        # this right now breaks the tchain logic! 
-        # if we have more than 1 file, this will break!!!!  
-
-        if Type is not 'data':
-            f[Type] = ROOT.TFile(physics_processes[Type]['files'][0],"read")
-            h1[Type] = f[Type].Get("htotal")
-            total = h1[Type].GetBinContent(1)
-            #total = h1[Type].GetEntries()
-            f[Type].Close()
-        else:
-            total = 1.0
-
-        input_tree   = makeTrees(Type,"events",channel)
-        n_entries = input_tree.GetEntries()
-
-        #Incase you want to apply event by event re-weighting
-
-        w = "((0.0*(npv>-0.5&&npv<=0.5)+3.30418257204*(npv>0.5&&npv<=1.5)+2.59691269521*(npv>1.5&&npv<=2.5)+2.44251087681*(npv>2.5&&npv<=3.5)+2.42846225153*(npv>3.5&&npv<=4.5)+2.40062512591*(npv>4.5&&npv<=5.5)+2.30279811595*(npv>5.5&&npv<=6.5)+2.12054720297*(npv>6.5&&npv<=7.5)+1.9104708827*(npv>7.5&&npv<=8.5)+1.67904936047*(npv>8.5&&npv<=9.5)+1.43348925382*(npv>9.5&&npv<=10.5)+1.17893952713*(npv>10.5&&npv<=11.5)+0.940505177881*(npv>11.5&&npv<=12.5)+0.740901867872*(npv>12.5&&npv<=13.5)+0.56877478036*(npv>13.5&&npv<=14.5)+0.433148655714*(npv>14.5&&npv<=15.5)+0.325343558476*(npv>15.5&&npv<=16.5)+0.241688459349*(npv>16.5&&npv<=17.5)+0.180491032782*(npv>17.5&&npv<=18.5)+0.136993937378*(npv>18.5&&npv<=19.5)+0.104859480066*(npv>19.5&&npv<=20.5)+0.0768271030309*(npv>20.5&&npv<=21.5)+0.0563426184938*(npv>21.5&&npv<=22.5)+0.0454037058117*(npv>22.5&&npv<=23.5)+0.0359945616383*(npv>23.5&&npv<=24.5)+0.0286879205085*(npv>24.5&&npv<=25.5)+0.0208185595478*(npv>25.5&&npv<=26.5)+0.0170977379612*(npv>26.5&&npv<=27.5)+0.0122446391898*(npv>27.5&&npv<=28.5)+0.0148028308301*(npv>28.5&&npv<=29.5)+0.0120527550003*(npv>29.5&&npv<=30.5)+0.00402643194054*(npv>30.5&&npv<=31.5)+0.00981143754301*(npv>31.5&&npv<=32.5)+0.0*(npv>32.5&&npv<=33.5)+0.0155664899019*(npv>33.5&&npv<=34.5)+0.0*(npv>34.5&&npv<=35.5)+0.0*(npv>35.5&&npv<=36.5)+0.0*(npv>36.5&&npv<=37.5)+0.0*(npv>37.5&&npv<=38.5)+0.0*(npv>38.5&&npv<=39.5)))"
-
-        if channel is 'signal' or channel is 'Zmm' or channel is 'Wmn':
-            w_trig = '((met < 250)*0.97 + (met >=250 && met<350)* 0.987 + (met>=350)* 1.0 )'
-        else:
-            w_trig = '(1.0)'
-            
-        anlo1_over_alo = "(1.24087232993*(genBos_pt>100.0&&genBos_pt<=150.0)+1.55807026252*(genBos_pt>150.0&&genBos_pt<=200.0)+1.51043242876*(genBos_pt>200.0&&genBos_pt<=250.0)+1.47333461572*(genBos_pt>250.0&&genBos_pt<=300.0)+1.43497331471*(genBos_pt>300.0&&genBos_pt<=350.0)+1.37846354687*(genBos_pt>350.0&&genBos_pt<=400.0)+1.2920177717*(genBos_pt>400.0&&genBos_pt<=500.0)+1.31414429236*(genBos_pt>500.0&&genBos_pt<=600.0)+1.20453974747*(genBos_pt>600.0))"
-        a_ewkcorr = "(0.998568444581*(genBos_pt>100.0&&genBos_pt<=150.0)+0.992098286517*(genBos_pt>150.0&&genBos_pt<=200.0)+0.986010290609*(genBos_pt>200.0&&genBos_pt<=250.0)+0.980265498435*(genBos_pt>250.0&&genBos_pt<=300.0)+0.974830448283*(genBos_pt>300.0&&genBos_pt<=350.0)+0.969676202351*(genBos_pt>350.0&&genBos_pt<=400.0)+0.962417128177*(genBos_pt>400.0&&genBos_pt<=500.0)+0.953511139209*(genBos_pt>500.0&&genBos_pt<=600.0)+0.934331895615*(genBos_pt>600.0))"
-
-        w_ewkcorr = "(0.980859240872*(genBos_pt>100.0&&genBos_pt<=150.0)+0.962118764182*(genBos_pt>150.0&&genBos_pt<=200.0)+0.944428528597*(genBos_pt>200.0&&genBos_pt<=250.0)+0.927685912907*(genBos_pt>250.0&&genBos_pt<=300.0)+0.911802238928*(genBos_pt>300.0&&genBos_pt<=350.0)+0.896700388113*(genBos_pt>350.0&&genBos_pt<=400.0)+0.875368225896*(genBos_pt>400.0&&genBos_pt<=500.0)+0.849096933047*(genBos_pt>500.0&&genBos_pt<=600.0)+0.792158791839*(genBos_pt>600.0))"
-        wnlo012_over_wlo = "(1.89123123702*(genBos_pt>100.0&&genBos_pt<=150.0)+1.70414182145*(genBos_pt>150.0&&genBos_pt<=200.0)+1.60726459197*(genBos_pt>200.0&&genBos_pt<=250.0)+1.57205818769*(genBos_pt>250.0&&genBos_pt<=300.0)+1.51688539716*(genBos_pt>300.0&&genBos_pt<=350.0)+1.41090079307*(genBos_pt>350.0&&genBos_pt<=400.0)+1.30757555038*(genBos_pt>400.0&&genBos_pt<=500.0)+1.32046236765*(genBos_pt>500.0&&genBos_pt<=600.0)+1.26852513234*(genBos_pt>600.0))"
-
-        z_ewkcorr = "(0.984525344338*(genBos_pt>100.0&&genBos_pt<=150.0)+0.969078612189*(genBos_pt>150.0&&genBos_pt<=200.0)+0.954626582726*(genBos_pt>200.0&&genBos_pt<=250.0)+0.941059330021*(genBos_pt>250.0&&genBos_pt<=300.0)+0.92828367065*(genBos_pt>300.0&&genBos_pt<=350.0)+0.916219976557*(genBos_pt>350.0&&genBos_pt<=400.0)+0.89931198024*(genBos_pt>400.0&&genBos_pt<=500.0)+0.878692669663*(genBos_pt>500.0&&genBos_pt<=600.0)+0.834717745177*(genBos_pt>600.0))"
-        znlo012_over_zlo = "(1.68500099066*(genBos_pt>100.0&&genBos_pt<=150.0)+1.55256109189*(genBos_pt>150.0&&genBos_pt<=200.0)+1.52259467479*(genBos_pt>200.0&&genBos_pt<=250.0)+1.52062313572*(genBos_pt>250.0&&genBos_pt<=300.0)+1.4322825541*(genBos_pt>300.0&&genBos_pt<=350.0)+1.45741443405*(genBos_pt>350.0&&genBos_pt<=400.0)+1.36849777989*(genBos_pt>400.0&&genBos_pt<=500.0)+1.3580214432*(genBos_pt>500.0&&genBos_pt<=600.0)+1.16484769869*(genBos_pt>600.0))"
-        
-        wm_postfit = "(1.0)"
-        zm_postfit = "(1.0)"
-        g_postfit  = "(1.0)"
-            
         # this is the scale using the total number of effective events
         scale = 1.0;
-        scale = float(lumi)*physics_processes[Type]['xsec']/total
+        scale = float(lumi)*physics_processes[Type]['xsec']/totals[Type]
         
         #print '\n'
-#        print "type: ", Type,  "scale", scale, "lumi", lumi, physics_processes[Type]['xsec'], total
+#        print "type: ", Type,  "scale", scale, "lumi", lumi, physics_processes[Type]['xsec'], totals[Type]
 
         if Type is not 'data' and Type is not 'signal_dm' and Type is not 'signal_dm_s' and Type is not 'signal_dm_ps' and Type is not 'signal_dm_v' and Type is not 'signal_dm_av_1_2':
             Variables[Type].SetFillColor(physics_processes[Type]['color'])
             Variables[Type].SetLineColor(physics_processes[Type]['color'])
-
-            if Type.startswith('GJets') :
-                makeTrees(Type,'events',channel).Draw(var + " >> " + histName,"(" + cut_standard + ")*mcWeight*0.98*"+str(g_postfit)+"*"+str(anlo1_over_alo)+"*"+str(a_ewkcorr)+"*" +str(w)+"*"+str(w_trig),"goff")
-
-            elif (Type.startswith('Zvv') or Type.startswith('Zll')) :
-                if channel is 'signal' :
-                    makeTrees(Type,'events',channel).Draw(var + " >> " + histName,"(" + cut_standard + ")*mcWeight*"+str(zm_postfit)+"*"+str(z_ewkcorr)+"*"+str(znlo012_over_zlo)+"*"+str(w)+"*"+str(w_trig),"goff")
-                else:
-                    #SF explicitly written for the leading tight lepton from the root files
-                    makeTrees(Type,'events',channel).Draw(var + " >> " + histName,"(" + cut_standard + ")*mcWeight*(0.98 *(lep1Eta<2.1)+0.91*(lep1Eta>=2.1))*"+str(zm_postfit)+"*"+str(z_ewkcorr)+"*"+str(znlo012_over_zlo)+"*"+str(w)+"*"+str(w_trig),"goff")
-
-
-            elif Type.startswith('Wlv'):
-                if channel is 'signal' :
-                    makeTrees(Type,'events',channel).Draw(var + " >> " + histName,"(" + cut_standard + ")*mcWeight*"+str(wm_postfit)+"*"+str(wnlo012_over_wlo)+"*"+str(w_ewkcorr)+"*" +str(w)+"*"+str(w_trig),"goff")
-                else:                
-                    makeTrees(Type,'events',channel).Draw(var + " >> " + histName,"(" + cut_standard + ")*mcWeight*"+str(wm_postfit)+"*"+str(wnlo012_over_wlo)+"*"+str(w_ewkcorr)+"*" +str(w)+"*"+str(w_trig),"goff")
-            
-            else:
-                makeTrees(Type,'events',channel).Draw(var + " >> " + histName,"(" + cut_standard + ") *mcWeight*" +str(w)+"*"+str(w_trig),"goff")
-                
-
             Variables[Type].Scale(scale,"width")
             stack.Add(Variables[Type],"hist")
             added.Add(Variables[Type])
@@ -164,22 +221,15 @@ def plot_stack(channel, name,var, bin, low, high, ylabel, xlabel, setLog = False
             Variables[Type].SetLineColor(1)
             Variables[Type].SetLineWidth(3)
             Variables[Type].SetLineStyle(1)
-            makeTrees(Type,"events",channel).Draw(var + " >> " + histName,"(" + cut_standard + ")*mcWeight*"+str(w),"goff")
-            Variables[Type].Scale(scale,"width")
 
         if Type.startswith('signal_dm_av_1_2'):
             Variables[Type].SetLineColor(1)
             Variables[Type].SetLineWidth(3)
             Variables[Type].SetLineStyle(8)
-            makeTrees(Type,"events",channel).Draw(var + " >> " + histName,"(" + cut_standard + ")*mcWeight*"+str(w),"goff")
             Variables[Type].Scale(scale,"width")
             
         if Type.startswith('data'):
             Variables[Type].SetMarkerStyle(20)
-            if channel is 'signal' or channel is 'Zmm' or channel is 'Wmn':
-                makeTrees(Type,"events",channel).Draw(var + " >> " + histName, "(" + cut_standard + " && (triggerFired[0]==1 || triggerFired[1]==1 || triggerFired[2]==1) )", "goff")
-            else:
-                makeTrees(Type,"events",channel).Draw(var + " >> " + histName, "(" + cut_standard +" )", "goff") 
             Variables[Type].Scale(1,"width")
 
         yield_dic[physics_processes[Type]['datacard']] += round(Variables[Type].Integral("width"),3)
@@ -270,8 +320,6 @@ def plot_stack(channel, name,var, bin, low, high, ylabel, xlabel, setLog = False
 
     del Variables
     del var
-    del f
-    del h1
     c4.IsA().Destructor( c4 )
     stack.IsA().Destructor( stack )
 
@@ -330,6 +378,23 @@ arguments['fatjet1tau21'] = ['fatjet1tau21','fatjet1tau21',20,0.0,1.0,'Events/bi
 
 start_time = time.time()
 
+# each input tree is read once; all (channel, variable) histograms of a process are filled in the same pass
+pool = Pool(min(NWORKERS, len(ordered_physics_processes)))
+for Type, fileName, total in pool.map(fill_process, ordered_physics_processes, chunksize = 1):
+    filled[Type] = {}
+    source = TFile(fileName, "read")
+    for key in source.GetListOfKeys():
+        hist = key.ReadObj()
+        hist.SetDirectory(0)
+        filled[Type][hist.GetName()] = hist
+    source.Close()
+    os.remove(fileName)
+
+    totals[Type] = total
+
+pool.close()
+pool.join()
+
 processes     = []
 
 for channel in channel_list:
@@ -9,6 +9,8 @@ localSkimDir = '/local/' + os.environ['USER'] + '/monophoton/skim'
 
 # where the various output plots and text files
 histDir = '/data/t3home000/' + os.environ['USER'] + '/monophoton'
+# filled histograms reused by plot.py
+histCacheDir = histDir + '/histcache'
 
 # panda library
 libobjs = 'libPandaTreeObjects.so'
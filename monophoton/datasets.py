@@ -5,9 +5,18 @@ import os
 import math
 import fnmatch
 import subprocess
+import multiprocessing
+import sqlite3
 
 defaultList = os.path.dirname(os.path.realpath(__file__)) + '/data/datasets.csv'
 catalogDir = '/home/cmsprod/catalog/t2mit'
+# directory for the per-file event count caches (<book>/<dataset>/Counts). Empty string -> catalogDir
+countCacheDir = ''
+# number of processes used to read the event counts
+countWorkers = 4
+# SQLite index of the parsed catalogs. Empty string -> do not use the index
+# kept on the local disk: SQLite locking is unreliable on NFS homes shared by batch jobs
+catalogIndexPath = '/tmp/' + os.environ['USER'] + '/monophoton/catalog.db'
 
 def expandBrace(pattern):
     """Expand a string with a brace-enclosed substitution pattern."""
@@ -62,6 +71,152 @@ def strDiff(base, target):
 
     return (begin, end, b, t)
 
+def countFile(args):
+    """
+    Read the event counts of one file. Returns (path, (nevents, sumw, sumw2)), with None in place of the counts
+    if the file cannot be read. Module-level function to be used in a multiprocessing pool.
+    """
+
+    path, data = args
+
+    import ROOT
+
+    source = ROOT.TFile.Open(path)
+    if not source:
+        return path, None
+
+    try:
+        counter = source.Get('eventcounter')
+        nevents = counter.GetBinContent(1)
+        if data:
+            sumw = 0.
+            sumw2 = 0.
+        else:
+            hsumw = source.Get('hSumW')
+            sumw = hsumw.GetBinContent(1)
+            sumw2 = math.pow(hsumw.GetBinError(1), 2.)
+
+        counts = (nevents, sumw, sumw2)
+
+    except:
+        print path, 'corrupt'
+        counts = None
+
+    source.Close()
+
+    return path, counts
+
+class CatalogIndex(object):
+    """
+    SQLite store of the parsed Filesets and Files catalogs of datasets. An entry is keyed by the catalog directory
+    of the dataset and is valid while the sizes and mtimes of the two catalog files are unchanged.
+    """
+
+    def __init__(self, path):
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            # already exists (possibly created by a concurrent job)
+            if not os.path.isdir(os.path.dirname(path)):
+                raise
+
+        self._conn = sqlite3.connect(path, timeout = 60.)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS `datasets` (`id` INTEGER PRIMARY KEY, `catalog` TEXT UNIQUE, `stamp` TEXT, `directory` TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS `filesets` (`dataset_id` INTEGER, `fileset` TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS `files` (`dataset_id` INTEGER, `fileset` TEXT, `basename` TEXT)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS `filesets_dataset` ON `filesets` (`dataset_id`)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS `files_dataset` ON `files` (`dataset_id`)')
+        self._conn.commit()
+
+    def get(self, catalog, stamp):
+        """
+        Return (directory, [fileset], [(fileset, basename)]) or None if the entry does not exist or is outdated.
+        """
+
+        row = self._conn.execute('SELECT `id`, `stamp`, `directory` FROM `datasets` WHERE `catalog` = ?', (catalog,)).fetchone()
+        if row is None or row[1] != stamp:
+            return None
+
+        dataset_id, _, directory = row
+
+        filesets = [r[0] for r in self._conn.execute('SELECT `fileset` FROM `filesets` WHERE `dataset_id` = ? ORDER BY `rowid`', (dataset_id,))]
+        files = self._conn.execute('SELECT `fileset`, `basename` FROM `files` WHERE `dataset_id` = ? ORDER BY `rowid`', (dataset_id,)).fetchall()
+
+        return directory, filesets, files
+
+    def put(self, catalog, stamp, directory, filesets, files):
+        row = self._conn.execute('SELECT `id` FROM `datasets` WHERE `catalog` = ?', (catalog,)).fetchone()
+        if row is not None:
+            self._conn.execute('DELETE FROM `filesets` WHERE `dataset_id` = ?', row)
+            self._conn.execute('DELETE FROM `files` WHERE `dataset_id` = ?', row)
+            self._conn.execute('DELETE FROM `datasets` WHERE `id` = ?', row)
+
+        dataset_id = self._conn.execute('INSERT INTO `datasets` (`catalog`, `stamp`, `directory`) VALUES (?, ?, ?)', (catalog, stamp, directory)).lastrowid
+        self._conn.executemany('INSERT INTO `filesets` VALUES (?, ?)', [(dataset_id, fileset) for fileset in filesets])
+        self._conn.executemany('INSERT INTO `files` VALUES (?, ?, ?)', [(dataset_id, fileset, basename) for fileset, basename in files])
+        self._conn.commit()
+
+_catalogIndex = None
+
+def readCatalog(book, dataset):
+    """
+    Return (directory, [fileset], [(fileset, basename)]) of the dataset, from the catalog index if it is up to date.
+    """
+
+    global _catalogIndex
+
+    catalog = catalogDir + '/' + book + '/' + dataset
+
+    if _catalogIndex is None and catalogIndexPath:
+        try:
+            _catalogIndex = CatalogIndex(catalogIndexPath)
+        except (sqlite3.Error, OSError):
+            print 'Cannot open catalog index', catalogIndexPath
+            _catalogIndex = False
+
+    stamp = ''
+    if _catalogIndex:
+        try:
+            stamp = ' '.join('%d %r' % (stat.st_size, stat.st_mtime) for stat in [os.stat(catalog + '/Filesets'), os.stat(catalog + '/Files')])
+        except OSError:
+            # missing catalog - let open() below raise
+            pass
+
+    if stamp:
+        try:
+            cached = _catalogIndex.get(catalog, stamp)
+        except sqlite3.Error:
+            cached = None
+
+        if cached is not None:
+            return cached
+
+    directory = None
+    filesets = []
+    files = []
+
+    with open(catalog + '/Filesets') as filesetList:
+        for line in filesetList:
+            fileset, xrdpath = line.split()[:2]
+            filesets.append(fileset)
+
+            if directory is None:
+                directory = xrdpath.replace('root://xrootd.cmsaf.mit.edu/', '/mnt/hadoop/cms').replace('root://t3serv006.mit.edu/', '/mnt/hadoop')
+
+    with open(catalog + '/Files') as fileList:
+        for line in fileList:
+            fileset, fname = line.split()[:2]
+            files.append((fileset, fname))
+
+    if stamp:
+        try:
+            _catalogIndex.put(catalog, stamp, directory, filesets, files)
+        except sqlite3.Error:
+            # e.g. locked by another process - the index will be updated next time
+            pass
+
+    return directory, filesets, files
+
 def braceContract(strings):
     """Reverse operation of expandBrace."""
 
@@ -188,9 +343,69 @@ class SampleDef(object):
         if self._sumw2 > 0.:
             return
 
-        import ROOT
+        self._readCatalogs()
+
+        counts = {} # {path: (nevents, sumw, sumw2)}
+        caches = {} # {dataset: {basename: (size, mtime, nevents, sumw, sumw2)}}
+        toRead = []
 
-        self.download()
+        for dataset in self.datasetNames:
+            cache = caches[dataset] = self._readCountCache(dataset)
+
+            for fileset, basenames in self._basenames[dataset].items():
+                for basename in basenames:
+                    path = self._directories[dataset] + '/' + basename
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        toRead.append(path)
+                        continue
+
+                    try:
+                        size, mtime, nevents, sumw, sumw2 = cache[basename]
+                    except KeyError:
+                        toRead.append(path)
+                        continue
+
+                    if (size, mtime) == (stat.st_size, int(stat.st_mtime)):
+                        counts[path] = (nevents, sumw, sumw2)
+                    else:
+                        toRead.append(path)
+
+        if len(toRead) != 0:
+            if not all(os.path.exists(path) for path in toRead):
+                self.download()
+
+            args = [(path, self.data) for path in toRead]
+            if countWorkers > 1 and len(toRead) > 1:
+                pool = multiprocessing.Pool(min(countWorkers, len(toRead)))
+                try:
+                    results = pool.map(countFile, args)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                results = map(countFile, args)
+
+            for path, fcounts in results:
+                if fcounts is not None:
+                    counts[path] = fcounts
+
+            for dataset in self.datasetNames:
+                directory = self._directories[dataset]
+                cache = caches[dataset]
+                updated = False
+
+                for path in toRead:
+                    if not path.startswith(directory + '/') or path not in counts:
+                        continue
+
+                    stat = os.stat(path)
+                    cache[path[len(directory) + 1:]] = (stat.st_size, int(stat.st_mtime)) + counts[path]
+                    updated = True
+
+                if updated:
+                    self._writeCountCache(dataset, cache)
 
         self.nevents = 0
         self.sumw = 0.
@@ -200,53 +415,83 @@ class SampleDef(object):
             for fileset, basenames in self._basenames[dataset].items():
                 for basename in basenames:
                     path = self._directories[dataset] + '/' + basename
-                    source = ROOT.TFile.Open(path)
-                    if not source:
-                        error = True
-                        continue
-
                     try:
-                        counter = source.Get('eventcounter')
-                        self.nevents += counter.GetBinContent(1)
-                        if not self.data:
-                            sumw = source.Get('hSumW')
-                            self.sumw += sumw.GetBinContent(1)
-                            self._sumw2 += math.pow(sumw.GetBinError(1), 2.)
-
-                    except:
-                        print path, 'corrupt'
+                        nevents, sumw, sumw2 = counts[path]
+                    except KeyError:
                         error = True
+                        continue
 
-                    source.Close()
+                    self.nevents += nevents
+                    if not self.data:
+                        self.sumw += sumw
+                        self._sumw2 += sumw2
 
         if error:
             raise RuntimeError('Corrupt input')
 
+    def _countCachePath(self, dataset):
+        if countCacheDir:
+            return countCacheDir + '/' + self.book + '/' + dataset + '/Counts'
+        else:
+            return catalogDir + '/' + self.book + '/' + dataset + '/Counts'
+
+    def _readCountCache(self, dataset):
+        """
+        Read the Counts file of the dataset. Each line is "basename size mtime nevents sumw sumw2".
+        """
+
+        cache = {}
+
+        try:
+            with open(self._countCachePath(dataset)) as source:
+                for line in source:
+                    words = line.split()
+                    if len(words) != 6:
+                        continue
+
+                    cache[words[0]] = (int(words[1]), int(words[2]), float(words[3]), float(words[4]), float(words[5]))
+        except IOError:
+            pass
+
+        return cache
+
+    def _writeCountCache(self, dataset, cache):
+        path = self._countCachePath(dataset)
+        tmpPath = path + '.%d' % os.getpid()
+
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+
+            with open(tmpPath, 'w') as out:
+                for basename in sorted(cache.keys()):
+                    size, mtime, nevents, sumw, sumw2 = cache[basename]
+                    out.write('%s %d %d %s %s %s\n' % (basename, size, mtime, repr(nevents), repr(sumw), repr(sumw2)))
+
+            os.rename(tmpPath, path)
+
+        except (IOError, OSError):
+            print 'Cannot write event count cache', path
+
     def _readCatalogs(self):
         # Loop over dataset names of the sample
         for dsuffix, dataset in zip(self.datasetSuffices, self.datasetNames):
             if dataset in self._basenames:
                 continue
 
+            directory, filesets, files = readCatalog(self.book, dataset)
+
             self._basenames[dataset] = {}
 
-            with open(catalogDir + '/' + self.book + '/' + dataset + '/Filesets') as filesetList:
-                for line in filesetList:
-                    fileset, xrdpath = line.split()[:2]
-                    fileset += dsuffix
+            for fileset in filesets:
+                self._basenames[dataset][fileset + dsuffix] = []
 
-                    self._basenames[dataset][fileset] = []
+            if directory is not None and dataset not in self._directories:
+                self._directories[dataset] = directory
+                self._downloadable[dataset] = directory.startswith('/mnt/hadoop/cms/store/user/paus')
 
-                    if dataset not in self._directories:
-                        self._directories[dataset] = xrdpath.replace('root://xrootd.cmsaf.mit.edu/', '/mnt/hadoop/cms').replace('root://t3serv006.mit.edu/', '/mnt/hadoop')
-                        self._downloadable[dataset] = self._directories[dataset].startswith('/mnt/hadoop/cms/store/user/paus')
-    
-            with open(catalogDir + '/' + self.book + '/' + dataset + '/Files') as fileList:
-                for line in fileList:
-                    fileset, fname = line.split()[:2]
-                    fileset += dsuffix
-    
-                    self._basenames[dataset][fileset].append(fname)
+            for fileset, fname in files:
+                self._basenames[dataset][fileset + dsuffix].append(fname)
     
     def recomputeWeight(self):
         self._sumw2 = 0.
@@ -307,6 +552,10 @@ class SampleDef(object):
 class SampleDefList(object):
     def __init__(self, samples = [], listpath = ''):
         self.samples = list(samples)
+        self._byName = {} # {name: sample}, first definition of each name
+        for sample in self.samples:
+            self._byName.setdefault(sample.name, sample)
+
         self._commentLines = {} # {path: [(dataset before, comment)]} to reproduce comment lines from the source
         self._sample_source = {} # {path: set(sample name)}
 
@@ -374,7 +623,9 @@ class SampleDefList(object):
                 else:
                     kwd.update({'crosssection': float(crosssection), 'sumw': float(sumw)})
 
-                self.samples.append(SampleDef(name, **kwd))
+                sample = SampleDef(name, **kwd)
+                self.samples.append(sample)
+                self._byName.setdefault(name, sample)
 
     def save(self, listpath):
         commentLines = self._commentLines[listpath]
@@ -409,6 +660,12 @@ class SampleDefList(object):
         return [s.name for s in self.samples]
 
     def get(self, name):
+        try:
+            return self._byName[name]
+        except KeyError:
+            pass
+
+        # samples appended to self.samples directly
         try:
             return next(s for s in self.samples if s.name == name)
         except StopIteration:
@@ -437,7 +694,8 @@ class SampleDefList(object):
                 names.extend(expanded[1:]) # add to the end of list
             
             if '*' in name:
-                matching = [s for s in self.samples if fnmatch.fnmatch(s.name, name)]
+                pattern = re.compile(fnmatch.translate(name))
+                matching = [s for s in self.samples if pattern.match(s.name)]
             else:
                 matching = [self.get(name)]
 
@@ -466,12 +724,18 @@ add INFO: Add a new dataset.'''
     argParser.add_argument('command', nargs = '+', help = commandHelp)
     argParser.add_argument('--catalog', '-c', metavar = 'PATH', dest = 'catalog', default = catalogDir, help = 'Source file catalog.')
     argParser.add_argument('--list-path', '-s', metavar = 'PATH', dest = 'listPath', default = defaultList, help = 'CSV file to load data from.')
+    argParser.add_argument('--count-cache', '-C', metavar = 'PATH', dest = 'countCache', default = '', help = 'Directory for event count caches (default: catalog directory).')
+    argParser.add_argument('--num-workers', '-j', metavar = 'N', dest = 'nworkers', type = int, default = countWorkers, help = 'Number of processes to read the event counts with.')
+    argParser.add_argument('--catalog-index', '-I', metavar = 'PATH', dest = 'catalogIndex', default = catalogIndexPath, help = 'SQLite index of the parsed catalogs. Empty string to disable.')
     argParser.add_argument('--save', '-o', metavar = 'PATH', dest = 'outPath', nargs = '?', const = '', help = 'Save updated content to CSV file (no argument: save to original CSV).')
 
     args = argParser.parse_args()
     sys.argv = []
 
     catalogDir = args.catalog
+    countCacheDir = args.countCache
+    countWorkers = args.nworkers
+    catalogIndexPath = args.catalogIndex
 
     import ROOT
 
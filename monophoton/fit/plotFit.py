@@ -17,6 +17,7 @@ if commondir not in sys.path:
 from datasets import allsamples
 from plotstyle import RatioCanvas
 import workspace_config as wc
+from histsource import getSource
 
 config = sys.argv[1]
 pdir = sys.argv[2]
@@ -132,10 +133,9 @@ for key in postfitDir.GetListOfKeys():
     if 'total' in region:
         continue
 
-    prefitFile = ROOT.TFile.Open(wc.config.sourcename.format(region = region))
-    prefitDir = prefitFile.Get(parameters.distribution)
+    prefitSource = getSource(wc.config.sourcename.format(region = region))
 
-    prefitTotal = prefitDir.Get('bkgtotal_syst')
+    prefitTotal = prefitSource.get(parameters.distribution + '/bkgtotal_syst')
     prefitTotal.Scale(1., 'width')
     prefitUnc = prefitTotal.Clone('prefitUnc')
     prefitRatio = ROOT.TGraphAsymmErrors(prefitTotal.GetNbinsX())
@@ -9,9 +9,14 @@ thisdir = os.path.dirname(os.path.realpath(__file__))
 basedir = os.path.dirname(thisdir)
 sys.path.append(basedir)
 
-from workspace import fetchHistograms
+commondir = os.path.dirname(basedir) + '/common'
+if commondir not in sys.path:
+    sys.path.append(commondir)
+
+from histsource import fetchHistograms
 from plotstyle import SimpleCanvas, RatioCanvas
 import fit.parameters as parameters
+import workspace_config as wc
 
 import ROOT as r
 
@@ -26,7 +31,7 @@ subtractBackground = True
 rlimits = (0.001, 0.5)
 systList = [('EWK', 1.0), ('vgPDF', 1.0), ('vgQCDscale', 0.8)]
 
-fetchHistograms(parameters, sourcePlots, totals, hstore)
+fetchHistograms(wc.config, sourcePlots, totals, hstore)
 
 rcanvas = RatioCanvas(name = 'datamc', lumi = 36400)
 rcanvas.legend.setPosition(0.5, 0.7, 0.7, 0.9)
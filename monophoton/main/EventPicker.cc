@@ -1,16 +1,22 @@
 #include "PandaTree/Objects/interface/Event.h"
 
+#include "EventIndex.h"
+
 #include "TChain.h"
 #include "TString.h"
 #include "TFile.h"
 #include "TTree.h"
 #include "TKey.h"
 
+#include <map>
+
 class EventPicker {
 public:
   EventPicker() {}
   ~EventPicker() {}
   void addPath(char const* _path) { paths_.emplace_back(_path); }
+  //! Event indices built by EventIndex::build. If any is given, events are looked up instead of scanning the paths.
+  void addIndex(char const* _path) { indexPaths_.emplace_back(_path); }
   void addEvent(unsigned r, unsigned l, unsigned e) { eventIds_.emplace_back(r, l, e); }
   void setPrintEvery(unsigned i) { printEvery_ = i; }
   void setPrintLevel(unsigned l) { printLevel_ = l; }
@@ -27,7 +33,11 @@ public:
   };
 
 private:
+  void runIndexed_(char const* outputDir);
+  void writeEvent_(char const* outputDir, EventId const&, panda::Event&, TFile& source);
+
   std::vector<TString> paths_{};
+  std::vector<TString> indexPaths_{};
   std::vector<EventId> eventIds_{};
   unsigned printEvery_{10000};
   unsigned printLevel_{0};
@@ -36,8 +46,12 @@ private:
 void
 EventPicker::run(char const* _outputDir, long _nEntries/* = -1*/)
 {
+  if (indexPaths_.size() != 0) {
+    runIndexed_(_outputDir);
+    return;
+  }
+
   panda::Event event;
-  panda::Run run;
 
   TChain idInput("events");
   TChain fullInput("events");
@@ -51,9 +65,6 @@ EventPicker::run(char const* _outputDir, long _nEntries/* = -1*/)
   event.setAddress(idInput, {"runNumber", "lumiNumber", "eventNumber"});
   event.setAddress(fullInput);
 
-  int treeNumber(-1);
-  TTree* runTree(0);
-
   long iEntry(0);
   while (iEntry != _nEntries && event.getEntry(idInput, iEntry++) > 0) {
     if (iEntry % printEvery_ == 1 && printLevel_ > 0)
@@ -68,43 +79,116 @@ EventPicker::run(char const* _outputDir, long _nEntries/* = -1*/)
 
         event.getEntry(fullInput, iEntry - 1);
 
-        if (treeNumber != fullInput.GetTreeNumber()) {
-          treeNumber = fullInput.GetTreeNumber();
-          run.runNumber = 0;
+        writeEvent_(_outputDir, id, event, *fullInput.GetCurrentFile());
 
-          runTree = static_cast<TTree*>(fullInput.GetCurrentFile()->Get("runs"));
-          run.setAddress(*runTree);
-        }
+        eventIds_.erase(idItr);
+        break;
+      }
+    }
+  }
+}
 
-        run.findEntry(*runTree, id.runNumber);
+void
+EventPicker::runIndexed_(char const* _outputDir)
+{
+  // file path -> [(event id, entry)]
+  std::map<TString, std::vector<std::pair<EventId, long>>> locations;
+
+  EventIndex index;
+  for (auto& indexPath : indexPaths_) {
+    if (!index.open(indexPath)) {
+      std::cerr << "Cannot open index " << indexPath << std::endl;
+      continue;
+    }
 
-        auto* outputFile(TFile::Open(TString::Format("%s/%d_%d_%d.root", _outputDir, id.runNumber, id.lumiNumber, id.eventNumber), "recreate"));
-        auto* outputEvents(new TTree("events", "events"));
-        auto* outputRuns(new TTree("runs", "runs"));
+    for (auto idItr(eventIds_.begin()); idItr != eventIds_.end();) {
+      auto& id(*idItr);
+      if (index.find(id.runNumber, id.lumiNumber, id.eventNumber)) {
+        locations[index.getFoundFile()].emplace_back(id, index.getFoundEntry());
+        idItr = eventIds_.erase(idItr);
+      }
+      else
+        ++idItr;
+    }
 
-        event.book(*outputEvents);
-        event.run.book(*outputRuns);
-        event.fill(*outputEvents);
-        event.run.fill(*outputRuns);
+    if (eventIds_.empty())
+      break;
+  }
 
-        outputFile->cd();
-        outputEvents->Write();
-        outputRuns->Write();
+  // remaining events are in none of the indices
+  if (eventIds_.size() != 0) {
+    std::cerr << eventIds_.size() << " requested events were not found in the indices:" << std::endl;
+    for (auto& id : eventIds_)
+      std::cerr << " " << id.runNumber << ":" << id.lumiNumber << ":" << id.eventNumber << std::endl;
+  }
 
-        for (auto* key : *fullInput.GetCurrentFile()->GetListOfKeys()) {
-          if (std::strcmp(key->GetName(), "events") == 0 || std::strcmp(key->GetName(), "runs") == 0)
-            continue;
+  panda::Event event;
 
-          outputFile->cd();
-          auto* obj(static_cast<TKey*>(key)->ReadObj());
-          obj->Write();
-        }
-        
-        delete outputFile;
-        
-        eventIds_.erase(idItr);
-        break;
+  for (auto& fileLocs : locations) {
+    auto* source(TFile::Open(fileLocs.first));
+    if (!source || source->IsZombie()) {
+      std::cerr << "Cannot open " << fileLocs.first << std::endl;
+      delete source;
+      continue;
+    }
+
+    auto* tree(static_cast<TTree*>(source->Get("events")));
+    event.setAddress(*tree);
+
+    for (auto& loc : fileLocs.second) {
+      auto& id(loc.first);
+
+      event.getEntry(*tree, loc.second);
+
+      // the index keys on the lower 32 bits of the event number
+      if (event.runNumber != id.runNumber || event.lumiNumber != id.lumiNumber || event.eventNumber != id.eventNumber) {
+        std::cerr << "Event " << id.runNumber << ":" << id.lumiNumber << ":" << id.eventNumber << " not found: index points to ";
+        std::cerr << event.runNumber << ":" << event.lumiNumber << ":" << event.eventNumber << " in " << fileLocs.first << std::endl;
+        continue;
       }
+
+      if (printLevel_ > 0)
+        std::cout << "Found event " << id.runNumber << ":" << id.lumiNumber << ":" << id.eventNumber << std::endl;
+
+      writeEvent_(_outputDir, id, event, *source);
     }
+
+    delete source;
+  }
+}
+
+void
+EventPicker::writeEvent_(char const* _outputDir, EventId const& _id, panda::Event& _event, TFile& _source)
+{
+  panda::Run run;
+
+  auto* runTree(static_cast<TTree*>(_source.Get("runs")));
+  run.setAddress(*runTree);
+  run.findEntry(*runTree, _id.runNumber);
+  // run goes out of scope; the source file can still be read by the caller
+  runTree->ResetBranchAddresses();
+
+  auto* outputFile(TFile::Open(TString::Format("%s/%d_%d_%d.root", _outputDir, _id.runNumber, _id.lumiNumber, _id.eventNumber), "recreate"));
+  auto* outputEvents(new TTree("events", "events"));
+  auto* outputRuns(new TTree("runs", "runs"));
+
+  _event.book(*outputEvents);
+  _event.run.book(*outputRuns);
+  _event.fill(*outputEvents);
+  _event.run.fill(*outputRuns);
+
+  outputFile->cd();
+  outputEvents->Write();
+  outputRuns->Write();
+
+  for (auto* key : *_source.GetListOfKeys()) {
+    if (std::strcmp(key->GetName(), "events") == 0 || std::strcmp(key->GetName(), "runs") == 0)
+      continue;
+
+    outputFile->cd();
+    auto* obj(static_cast<TKey*>(key)->ReadObj());
+    obj->Write();
   }
+
+  delete outputFile;
 }
@@ -4,6 +4,11 @@ from argparse import ArgumentParser
 import os
 import sys
 import re
+import shlex
+import hashlib
+import sqlite3
+import array
+import multiprocessing
 from subprocess import Popen, PIPE
 import shutil
 from pprint import pprint
@@ -13,6 +18,7 @@ thisdir = os.path.dirname(os.path.realpath(__file__))
 basedir = os.path.dirname(thisdir)
 sys.path.append(basedir)
 from plotstyle import *
+import ROOT
 from datasets import allsamples
 import config
 
@@ -21,6 +27,9 @@ parser.add_argument('-m', '--models', metavar = 'MODEL', action = 'store', defau
 parser.add_argument('-R', '--root-file', metavar = 'PATH', action = 'store', dest = 'rootFile', help = 'Histogram ROOT file.')
 parser.add_argument('--variable', '-v', metavar = 'VARNAME', action = 'store', dest = 'variable', default = 'phoPtHighMet', help = 'Discriminating variable.')
 parser.add_argument('--shape', '-s', action = 'store_true', dest = 'shape', default = False, help = 'Turn on shape analysis.')
+parser.add_argument('--jobs', '-j', metavar = 'N', dest = 'njobs', type = int, default = 4, help = 'Number of datacards and limits computed concurrently.')
+parser.add_argument('--limit-tool', '-t', metavar = 'CMD', dest = 'limitTool', default = 'combine', help = 'Limit tool command. Called as CMD -M Asymptotic -m 120 -n _MODEL CARD in the CombinedLimit directory and expected to write the combine-style limit tree to higgsCombine_MODEL.Asymptotic.mH120.root.')
+parser.add_argument('--cache', '-c', metavar = 'PATH', dest = 'cache', default = '', help = 'SQLite file caching the limits by datacard content. Default (card directory)/limits.db. Pass "none" to disable.')
 
 opts = parser.parse_args()
 
@@ -35,16 +44,32 @@ for m in mandatories:
 ### Function to Run Higgs Tool and Get Expected Limit for a DataCard
 ###======================================================================================
 
-def RunHiggsTool(DataCardPath,LimitToolDir):
+def RunHiggsTool(DataCardPath,LimitToolDir,name):
     TextPath = DataCardPath
-    HiggsTool = Popen(['combine','-M','Asymptotic',TextPath],
-                      stdout=PIPE,stderr=PIPE,cwd=LimitToolDir)    
-    """ For debugging, will cause grep step to crash
+
+    obs = (-1., -1., -1.)
+    exp = [-1., -1., -1.]
+
+    # concurrent runs share the working directory; the name keeps the output files apart
+    OutputPath = os.path.join(LimitToolDir, 'higgsCombine_' + name + '.Asymptotic.mH120.root')
+
+    try:
+        HiggsTool = Popen(shlex.split(opts.limitTool) + ['-M','Asymptotic','-m','120','-n','_' + name,TextPath],
+                          stdout=PIPE,stderr=PIPE,cwd=LimitToolDir)    
+    except OSError as err:
+        print 'Failed to run', opts.limitTool, 'for', TextPath + ':', err
+        return (obs, tuple(exp))
+
     (hout, herr) = HiggsTool.communicate()
+    """ For debugging
     print hout, '\n'
     print herr, '\n'
     """
 
+    if HiggsTool.returncode != 0:
+        print opts.limitTool, 'exited with code', HiggsTool.returncode, 'for', TextPath
+        return (obs, tuple(exp))
+
     rscale = 1.
     with open(TextPath) as datacard:
         lines = datacard.read().strip().split('\n')
@@ -52,34 +77,179 @@ def RunHiggsTool(DataCardPath,LimitToolDir):
         if matches:
             rscale = float(matches.group(1))
 
-    find = Popen(['egrep','Observed|Expected'],stdin=HiggsTool.stdout,stdout=PIPE,stderr=PIPE)
-    """ for debugging, will cause next step to crash
-    (fout, ferr) = find.communicate()
-    print fout, '\n'
-    print ferr, '\n'
+    source = ROOT.TFile.Open(OutputPath)
+    if not source or source.IsZombie():
+        print 'No output', OutputPath, 'for', TextPath
+        return (obs, tuple(exp))
+
+    tree = source.Get('limit')
+    if tree:
+        for iEntry in range(tree.GetEntries()):
+            tree.GetEntry(iEntry)
+            limit = tree.limit
+            quantile = tree.quantileExpected
+
+            if quantile < 0.:
+                obs = ( limit * rscale, limit/1.2 * rscale, limit/0.8 * rscale )
+            elif abs(quantile - 0.5) < 1.e-3:
+                exp[0] = limit * rscale
+            elif abs(quantile - 0.16) < 1.e-2:
+                exp[1] = limit * rscale
+            elif abs(quantile - 0.84) < 1.e-2:
+                exp[2] = limit * rscale
+
+    source.Close()
+    os.unlink(OutputPath)
+
+    return (obs, tuple(exp))
+
+
+###======================================================================================
+### Limit cache keyed by the datacard content
+###======================================================================================
+
+def shapeHistograms(cardText):
+    """
+    List of (file, histogram name) referenced by the shapes lines of the datacard, for every (bin, process)
+    of the card and every shape systematic variation.
+    """
+
+    shapes = []
+    binProcs = []
+    observed = []
+    systs = []
+
+    binLines = []
+    for line in cardText.split('\n'):
+        words = line.split()
+        if len(words) == 0 or words[0].startswith('#'):
+            continue
+
+        if words[0] == 'shapes' and len(words) >= 5:
+            shapes.append(words[1:])
+        elif words[0] == 'bin':
+            binLines.append(words[1:])
+        elif words[0] == 'process' and len(binLines) != 0 and len(binProcs) == 0:
+            try:
+                float(words[1])
+            except ValueError:
+                binProcs = zip(binLines[-1], words[1:])
+        elif len(words) > 1 and words[1].startswith('shape'):
+            systs.append(words[0])
+
+    if len(binLines) != 0:
+        observed = [(b, 'data_obs') for b in binLines[0]]
+
+    histograms = []
+    for bname, proc in observed + binProcs:
+        for shape in shapes:
+            sproc, schannel, fname, pattern = shape[:4]
+            if sproc not in ('*', proc) or schannel not in ('*', bname):
+                continue
+
+            histograms.append((fname, pattern.replace('$PROCESS', proc).replace('$CHANNEL', bname)))
+
+            if len(shape) > 4 and proc != 'data_obs':
+                for syst in systs:
+                    for direction in ['Up', 'Down']:
+                        hname = shape[4].replace('$PROCESS', proc).replace('$CHANNEL', bname).replace('$SYSTEMATIC', syst + direction)
+                        histograms.append((fname, hname))
+
+            # first matching shapes line is used
+            break
+
+    return histograms
+
+# {path: TFile} opened for hashing
+hashSources = {}
+
+def limitKey(cardPath, LimitToolDir):
+    """
+    sha1 of the limit tool command, the datacard text, and the contents of the histograms referenced by the card.
     """
 
-    lines = [line for line in find.stdout]
-    # print lines
+    with open(cardPath) as card:
+        cardText = card.read()
 
-    obs = (-1., -1., -1.)
-    exp = (-1., -1., -1.)
+    digest = hashlib.sha1()
+    digest.update(opts.limitTool + '\n')
+    digest.update(cardText)
+
+    for fname, hname in shapeHistograms(cardText):
+        digest.update(fname + ':' + hname + '\n')
+
+        # shape file paths are relative to the directory where the tool runs
+        if not os.path.isabs(fname):
+            fname = os.path.join(LimitToolDir, fname)
+
+        try:
+            source = hashSources[fname]
+        except KeyError:
+            source = ROOT.TFile.Open(fname)
+            hashSources[fname] = source
+
+        hist = None
+        if source and not source.IsZombie():
+            hist = source.Get(hname)
+
+        if not hist:
+            digest.update('missing\n')
+            continue
+
+        contents = array.array('d', [hist.GetBinContent(i) for i in range(hist.GetNcells())])
+        errors = array.array('d', [hist.GetBinError(i) for i in range(hist.GetNcells())])
+        digest.update(contents.tostring())
+        digest.update(errors.tostring())
+
+    return digest.hexdigest()
+
+class LimitCache(object):
+    """
+    Limits (obs, exp) keyed by limitKey.
+    """
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, timeout = 60.)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS `limits` (`key` TEXT PRIMARY KEY, `model` TEXT, `obs` REAL, `obsUp` REAL, `obsDown` REAL, `exp` REAL, `expDown` REAL, `expUp` REAL)')
+        self._conn.commit()
+
+    def get(self, key):
+        row = self._conn.execute('SELECT `obs`, `obsUp`, `obsDown`, `exp`, `expDown`, `expUp` FROM `limits` WHERE `key` = ?', (key,)).fetchone()
+        if row is None:
+            return None
+
+        return (tuple(row[:3]), tuple(row[3:]))
+
+    def put(self, key, model, obs, exp):
+        self._conn.execute('INSERT OR REPLACE INTO `limits` VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (key, model) + tuple(obs) + tuple(exp))
+        self._conn.commit()
+
+
+###======================================================================================
+### Pool workers
+###======================================================================================
 
-    for line in lines:
-        # print line
-        tmp = line.split()
-        # print tmp
-        if tmp:
-            if 'Observed' in tmp[0]:
-                obs = ( float(tmp[4]) * rscale, float(tmp[4])/1.2 * rscale, float(tmp[4])/0.8 * rscale )
-            elif "50.0%" in tmp[0]:
-                exp[0] = float(tmp[4]) * rscale
-            elif "16.0%" in tmp[0]:
-                exp[1] = float(tmp[4]) * rscale
-            elif "84.0%" in tmp[0]:
-                exp[2] = float(tmp[4]) * rscale
+def MakeDataCard(model):
+    '''./datacard.py dma-500-1 limitsfile.root -o test.txt -O -v phoPtHighMet'''
+    cardPath = os.path.join(cardDir, model+'_'+opts.variable+'.txt')
+    # print cardPath
+    argList = ['./datacard.py', model, opts.rootFile, '-v', opts.variable, '-o', cardPath]
+    if opts.shape:
+        argList.append('-s')
+    proc = Popen(argList, stdout=PIPE, stderr=PIPE)
+    
+    (out, err) = proc.communicate()
+    # print out, '\n'
+    # print err, '\n'
 
-    return (obs, exp)
+    return model, cardPath
+
+def ComputeLimit(job):
+    model, cardPath = job
+    (obs, exp) = RunHiggsTool(cardPath,LimitToolDir,model)
+    # (obs, exp) = (1.0, 1.0)
+
+    return model, obs, exp
 
 
 ###======================================================================================
@@ -116,29 +286,61 @@ shutil.copy(opts.rootFile, rootFilePath)
 
 print datetime.datetime.now(), '\n'
 
-limits = {} # "dmv-500-150" : ( Obs, Exp )
-print "%-16s %15s %15s %15s %15s" % ('model', 'Observed (r)', 'Expected (r)', 'Observed (1/fb)', 'Expected (1/fb)')
-for iM, model in enumerate(modelList):
+points = []
+for model in modelList:
     try:
         allsamples[model]
     except:
         print 'Skipping', model
         continue
 
-    '''./datacard.py dma-500-1 limitsfile.root -o test.txt -O -v phoPtHighMet'''
-    cardPath = os.path.join(cardDir, model+'_'+opts.variable+'.txt')
-    # print cardPath
-    argList = ['./datacard.py', model, opts.rootFile, '-v', opts.variable, '-o', cardPath]
-    if opts.shape:
-        argList.append('-s')
-    MakeDataCard = Popen(argList, stdout=PIPE, stderr=PIPE)
-    
-    (out, err) = MakeDataCard.communicate()
-    # print out, '\n'
-    # print err, '\n'
-        
-    (obs, exp) = RunHiggsTool(cardPath,LimitToolDir)
-    # (obs, exp) = (1.0, 1.0)
+    points.append(model)
+
+# forked before the cache connection is opened
+pool = multiprocessing.Pool(max(opts.njobs, 1))
+
+if opts.cache == '':
+    cache = LimitCache(os.path.join(cardDir, 'limits.db'))
+elif opts.cache == 'none':
+    cache = None
+else:
+    cache = LimitCache(opts.cache)
+
+# datacards are written concurrently; limits are computed only for cards whose content changed
+cardPaths = dict(pool.map(MakeDataCard, points, chunksize = 1))
+
+results = {} # "dmv-500-150" : ( obs, exp )
+keys = {}
+jobs = []
+for model in points:
+    if cache is not None:
+        keys[model] = limitKey(cardPaths[model], LimitToolDir)
+        cached = cache.get(keys[model])
+        if cached is not None:
+            results[model] = cached
+            continue
+
+    jobs.append((model, cardPaths[model]))
+
+for source in hashSources.values():
+    if source:
+        source.Close()
+
+print len(points) - len(jobs), 'limits taken from cache,', len(jobs), 'to compute.\n'
+
+for model, obs, exp in pool.imap_unordered(ComputeLimit, jobs):
+    results[model] = (obs, exp)
+    # failures (-1) are retried in the next run
+    if cache is not None and obs[0] >= 0. and exp[0] >= 0.:
+        cache.put(keys[model], model, obs, exp)
+
+pool.close()
+pool.join()
+
+limits = {} # "dmv-500-150" : ( Obs, Exp )
+print "%-16s %15s %15s %15s %15s" % ('model', 'Observed (r)', 'Expected (r)', 'Observed (1/fb)', 'Expected (1/fb)')
+for model in points:
+    (obs, exp) = results[model]
 
     obsNom = obs[0]
     expNom = exp[0]
@@ -11,14 +11,17 @@
 #include "TROOT.h"
 #include "TDirectory.h"
 #include "TTreeFormula.h"
+#include "TEntryList.h"
 
 #include "GoodLumiFilter.h"
+#include "ReadCache.h"
 
 #include <vector>
 #include <iostream>
 #include <fstream>
 #include <stdexcept>
 #include <chrono>
+#include <cstring>
 typedef std::chrono::steady_clock SClock;
 
 unsigned TIMEOUT(300);
@@ -31,6 +34,8 @@ public:
   void addPath(char const* _path) { paths_.emplace_back(_path); }
   void clearPaths() { paths_.clear(); }
   void addSelector(EventSelectorBase* _sel) { selectors_.push_back(_sel); }
+  unsigned numSelectors() const { return selectors_.size(); }
+  EventSelectorBase* getSelector(unsigned i) const { return selectors_.at(i); }
   void setOwnSelectors(bool b) { ownSelectors_ = b; }
   void setGoodLumiFilter(GoodLumiFilter* _filt) { goodLumiFilter_ = _filt; }
   void setSkipMissingFiles(bool b) { skipMissingFiles_ = b; }
@@ -39,6 +44,16 @@ public:
   void prepareEvent(panda::Event const&, panda::EventMonophoton&, panda::GenParticleCollection const* = 0);
   void setPrintLevel(unsigned l) { printLevel_ = l; }
   void setCompatibilityMode(bool r) { compatibilityMode_ = r; }
+  // Evaluate the preskim over the whole range first and read only the passing entries of the full event
+  void setTwoPass(bool b) { twoPass_ = b; }
+  // Input read cache size in bytes (0 = ROOT default)
+  void setCacheSize(long s) { cacheSize_ = s; }
+  // Cache learning entries (-1 = ROOT default, 0 = register the branches to read directly)
+  void setCacheLearnEntries(int n) { cacheLearnEntries_ = n; }
+  void setPrintReadStats(bool b) { printReadStats_ = b; }
+  // Run identical leading operators of the selectors once per event. Off by default until the output is
+  // verified to be identical to unshared skims.
+  void setShareOperators(bool b) { shareOperators_ = b; }
 
 private:
   std::vector<TString> paths_{};
@@ -49,6 +64,11 @@ private:
   unsigned printEvery_{10000};
   unsigned printLevel_{0};
   bool compatibilityMode_{false};
+  bool twoPass_{false};
+  long cacheSize_{0};
+  int cacheLearnEntries_{-1};
+  bool printReadStats_{false};
+  bool shareOperators_{false};
 };
 
 Skimmer::~Skimmer()
@@ -168,6 +188,37 @@ Skimmer::run(char const* _outputDir, char const* _sampleName, bool isData, long
 
   TString commonSelection(selectors_[0]->getPreskim());
 
+  if (shareOperators_) {
+    // only plain EventSelectors run all operators exactly once per event
+    std::vector<EventSelector*> plain;
+    for (auto* sel : selectors_) {
+      if (std::strcmp(sel->className(), "EventSelector") == 0)
+        plain.push_back(static_cast<EventSelector*>(sel));
+    }
+
+    for (unsigned iS(1); iS < plain.size(); ++iS) {
+      // set up in a previous run
+      if (plain[iS]->getNShared() != 0)
+        continue;
+
+      EventSelector* source(0);
+      unsigned nCommon(0);
+      for (unsigned iT(0); iT != iS; ++iT) {
+        unsigned n(plain[iS]->nCommonOperators(*plain[iT]));
+        if (n > nCommon) {
+          source = plain[iT];
+          nCommon = n;
+        }
+      }
+
+      if (source) {
+        plain[iS]->shareOperators(*source, nCommon);
+        if (printLevel_ > 0)
+          *stream << "Selector " << plain[iS]->name() << " shares " << nCommon << " operators with " << source->name() << std::endl;
+      }
+    }
+  }
+
   for (auto* sel : selectors_) {
     sel->setPrintLevel(printLevel_, stream);
 
@@ -216,38 +267,106 @@ Skimmer::run(char const* _outputDir, char const* _sampleName, bool isData, long
   event.taus.data.matchedGenContainer_ = &genParticles;
   event.photons.data.matchedGenContainer_ = &genParticles;
 
+  if (preselection && preInput.LoadTree(_firstEntry) >= 0)
+    setupReadCache(preInput, cacheSize_, cacheLearnEntries_, getFormulaBranches(*preselection));
+
+  if (!twoPass_ && mainInput.LoadTree(_firstEntry) >= 0)
+    setupReadCache(mainInput, cacheSize_, cacheLearnEntries_, getActiveBranches(mainInput));
+
+  if (!isData && genInput.LoadTree(_firstEntry) >= 0)
+    setupReadCache(genInput, cacheSize_, cacheLearnEntries_, getActiveBranches(genInput));
+
+  ReadStats preStats("preselection input");
+  ReadStats mainStats("main input");
+  ReadStats genStats("gen input");
+
   auto now(SClock::now());
   auto start(now);
 
+  // evaluates the preselection on the current entry of preInput
+  auto passPreselection([preselection, &preInput, &preTreeNumber]()->bool {
+      if (preTreeNumber != preInput.GetTreeNumber()) {
+        preTreeNumber = preInput.GetTreeNumber();
+        preselection->UpdateFormulaLeaves();
+      }
+
+      int nD(preselection->GetNdata());
+      for (int iD(0); iD != nD; ++iD) {
+        if (preselection->EvalInstance(iD) != 0.)
+          return true;
+      }
+      return false;
+    });
+
+  long nEntries(_nEntries);
+
+  TEntryList* preselected(0);
+  if (preselection && twoPass_) {
+    // First pass: only the preskim branches are read through the formula
+    *stream << "Scanning the input with the baseline selection" << std::endl;
+
+    preselected = new TEntryList("preselected", "preselected", &preInput);
+
+    long iEntry(0);
+    while (iEntry++ != _nEntries) {
+      long entry(_firstEntry + iEntry - 1);
+      if (preInput.LoadTree(entry) < 0)
+        break;
+
+      if (passPreselection())
+        preselected->Enter(entry, &preInput);
+
+      if (printReadStats_)
+        preStats.update(preInput);
+    }
+
+    nEntries = preselected->GetN();
+
+    if (printLevel_ > 0) {
+      now = SClock::now();
+      *stream << " " << nEntries << "/" << (iEntry - 1) << " entries passed the baseline selection (took " << std::chrono::duration_cast<std::chrono::milliseconds>(now - start).count() / 1000. << " s)" << std::endl;
+    }
+
+    // Second pass reads only the listed entries. The cache holds the active branches from the start
+    // and skips baskets that contain no selected entry.
+    mainInput.SetEntryList(preselected);
+    if (nEntries > 0 && mainInput.LoadTree(mainInput.GetEntryNumber(0)) >= 0)
+      setupReadCache(mainInput, cacheSize_, 0, getActiveBranches(mainInput));
+  }
+
   long iEntry(0);
-  while (iEntry++ != _nEntries) {
+  while (iEntry++ != nEntries) {
     if ((iEntry - 1) % printEvery_ == 0 && printLevel_ > 0) {
       auto past = now;
       now = SClock::now();
       *stream << " " << iEntry << " (took " << std::chrono::duration_cast<std::chrono::milliseconds>(now - past).count() / 1000. << " s)" << std::endl;
     }
 
-    if (preselection) {
-      if (preInput.LoadTree(_firstEntry + iEntry - 1) < 0)
+    long entry(0);
+    if (preselected) {
+      entry = mainInput.GetEntryNumber(iEntry - 1);
+      if (entry < 0)
         break;
+    }
+    else {
+      entry = _firstEntry + iEntry - 1;
 
-      if (preTreeNumber != preInput.GetTreeNumber()) {
-        preTreeNumber = preInput.GetTreeNumber();
-        preselection->UpdateFormulaLeaves();
-      }
-
-      int nD(preselection->GetNdata());
-      int iD(0);
-      for (; iD != nD; ++iD) {
-        if (preselection->EvalInstance(iD) != 0.)
+      if (preselection) {
+        if (preInput.LoadTree(entry) < 0)
           break;
+
+        bool pass(passPreselection());
+
+        if (printReadStats_)
+          preStats.update(preInput);
+
+        if (!pass)
+          continue;
       }
-      if (iD == nD)
-        continue;
     }
 
     try {
-      if (event.getEntry(mainInput, _firstEntry + iEntry - 1) <= 0)
+      if (event.getEntry(mainInput, entry) <= 0)
         break;
     }
     catch (std::exception& _ex) {
@@ -255,6 +374,9 @@ Skimmer::run(char const* _outputDir, char const* _sampleName, bool isData, long
       throw;
     }
 
+    if (printReadStats_)
+      mainStats.update(mainInput);
+
     if (goodLumiFilter_ && !goodLumiFilter_->isGoodLumi(event.runNumber, event.lumiNumber))
       continue;
 
@@ -265,7 +387,11 @@ Skimmer::run(char const* _outputDir, char const* _sampleName, bool isData, long
     }
 
     if (!event.isData) {
-      genParticles.getEntry(genInput, _firstEntry + iEntry - 1);
+      genParticles.getEntry(genInput, entry);
+
+      if (printReadStats_)
+        genStats.update(genInput);
+
       prepareEvent(event, skimmedEvent, &genParticles);
     }
     else
@@ -303,9 +429,22 @@ Skimmer::run(char const* _outputDir, char const* _sampleName, bool isData, long
 
   delete preselection;
 
+  if (preselected) {
+    mainInput.SetEntryList(0);
+    delete preselected;
+  }
+
   for (auto* sel : selectors_)
     sel->finalize();
 
+  if (printReadStats_) {
+    if (commonSelection != "")
+      preStats.print(*stream);
+    mainStats.print(*stream);
+    if (!isData)
+      genStats.print(*stream);
+  }
+
   if (printLevel_ > 0 && printLevel_ <= INFO) {
     debugFile.close();
   }
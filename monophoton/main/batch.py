@@ -1,13 +1,183 @@
 import os
 import sys
 import time
+import shlex
+import threading
 import subprocess
+import multiprocessing
+import multiprocessing.pool
+
+EXECUTORS = ['condor', 'local']
+
+def makeSubmitter(executable, executor = 'condor'):
+    """
+    Return a job submitter for the executor. Both submitters take job_args, job_names, pre_args and aux_input
+    and run the executable once per job argument.
+    """
+
+    if executor == 'condor':
+        ## load condor-run
+        if '/home/yiiyama/lib' not in sys.path:
+            sys.path.append('/home/yiiyama/lib')
+        from condor_run import CondorRun
+
+        return CondorRun(executable)
+
+    elif executor == 'local':
+        return LocalRun(executable)
+
+    else:
+        raise RuntimeError('Unknown executor ' + executor)
+
+
+class LocalRun(object):
+    """
+    Runs the jobs of a submission as subprocesses on the current machine, with at most nprocs jobs at a time.
+    Each job runs in its own directory under logdir (default $LOCALRUN_LOGDIR or /tmp/$USER), where the aux_input
+    files are linked, and writes its output to (job name).log there. Failed jobs (nonzero exit code) are retried up to max_retries times.
+    Completed jobs are reported to on_done(job name, exit code) (called from the pool thread).
+    """
+
+    def __init__(self, executable):
+        self.executable = executable
+
+        self.job_args = []
+        self.job_names = []
+        self.pre_args = ''
+        self.aux_input = []
+
+        self.logdir = os.environ.get('LOCALRUN_LOGDIR', '/tmp/' + os.environ.get('USER', 'nobody'))
+        self.nprocs = multiprocessing.cpu_count()
+        self.max_retries = 2
+        self.on_done = None
+
+        # condor-run attributes that have no meaning locally
+        self.requirements = ''
+        self.hold_on_fail = False
+        self.min_memory = 1
+
+        self._pool = None
+        self._lock = threading.Lock()
+        self._nsubmitted = 0
+        self._ndone = 0
+        self._failed = []
+        self._finished = threading.Condition(self._lock)
+
+    def submit(self, name = 'localrun'):
+        """
+        Queue the current job_args and return immediately. Call wait() to block until all jobs are done.
+        Returns the number of jobs queued so far, in place of the condor cluster id.
+        """
+
+        if self._pool is None:
+            self._pool = multiprocessing.pool.ThreadPool(self.nprocs)
+
+        if len(self.job_names) == len(self.job_args):
+            names = list(self.job_names)
+        else:
+            names = ['%d' % (self._nsubmitted + i) for i in range(len(self.job_args))]
+
+        workdir = self.logdir + '/' + name
+
+        for jobName, jobArgs in zip(names, self.job_args):
+            command = self._command(jobArgs)
+
+            with self._lock:
+                self._nsubmitted += 1
+
+            self._pool.apply_async(self._run, (command, workdir + '/' + jobName, jobName), callback = self._done)
+
+        return self._nsubmitted
+
+    def wait(self):
+        """
+        Block until all queued jobs finish. Returns the list of names of the jobs that failed after all retries.
+        """
+
+        with self._lock:
+            while self._ndone < self._nsubmitted:
+                # timeout keeps the wait interruptible
+                self._finished.wait(60.)
+
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+        return list(self._failed)
+
+    def _command(self, jobArgs):
+        if self.executable.endswith('.py'):
+            command = [sys.executable, self.executable]
+        else:
+            command = [self.executable]
+
+        return command + shlex.split(self.pre_args) + shlex.split(jobArgs)
+
+    def _run(self, command, jobdir, jobName):
+        # an exception here would never reach the callback and leave wait() hanging
+        try:
+            return self._execute(command, jobdir, jobName)
+        except Exception as err:
+            sys.stderr.write('Job %s: %s\n' % (jobName, str(err)))
+            return jobName, -1
+
+    def _execute(self, command, jobdir, jobName):
+        try:
+            if not os.path.isdir(jobdir):
+                os.makedirs(jobdir)
+        except OSError:
+            # concurrent creation of the parent directory
+            if not os.path.isdir(jobdir):
+                raise
+
+        for path in self.aux_input:
+            link = jobdir + '/' + os.path.basename(path)
+            if not os.path.lexists(link):
+                os.symlink(os.path.realpath(path), link)
+
+        for attempt in range(self.max_retries + 1):
+            with open(jobdir + '/' + jobName + '.log', 'a') as log:
+                log.write('[%s] attempt %d: %s\n' % (time.strftime('%Y-%m-%d %H:%M:%S'), attempt, ' '.join(command)))
+                log.flush()
+                try:
+                    returncode = subprocess.call(command, stdout = log, stderr = subprocess.STDOUT, cwd = jobdir)
+                except OSError as err:
+                    log.write(str(err) + '\n')
+                    returncode = -1
+
+            if returncode == 0:
+                break
+
+        return jobName, returncode
+
+    def _done(self, result):
+        jobName, returncode = result
+
+        with self._lock:
+            self._ndone += 1
+            if returncode != 0:
+                self._failed.append(jobName)
+
+            self._finished.notify_all()
+
+        if self.on_done is not None:
+            self.on_done(jobName, returncode)
+
 
 class BatchManager(object):
-    def __init__(self, name):
+    def __init__(self, name, executor = 'condor'):
         self.name = name
+        self.executor = executor
+
+    def _makeSubmitter(self, executable):
+        return makeSubmitter(executable, self.executor)
 
     def _submit(self, submitter, task, argTemplate, noWait = False, autoResubmit = False):
+        if isinstance(submitter, LocalRun):
+            self._runLocal(submitter, noWait)
+            return
+
         submitter.logdir = '/local/' + os.environ['USER']
         submitter.hold_on_fail = True
 #        submitter.group = 'group_t3mit.urgent'
@@ -18,6 +188,35 @@ class BatchManager(object):
         if not noWait:
             self._waitForCompletion(task, clusterId, argTemplate, autoResubmit)
 
+    def _runLocal(self, submitter, noWait):
+        if noWait:
+            print 'Local executor always waits for the jobs to complete.'
+
+        njobs = len(submitter.job_args)
+        # plain list so that the callback can update the counter
+        ndone = [0]
+
+        def onDone(jobName, returncode):
+            ndone[0] += 1
+            if returncode != 0:
+                sys.stdout.write('\n')
+                print 'Job %s failed with exit code %d' % (jobName, returncode)
+
+            sys.stdout.write('\r %d/%d jobs done.' % (ndone[0], njobs))
+            sys.stdout.flush()
+
+        submitter.on_done = onDone
+
+        print 'Running %d jobs with %d local processes.' % (njobs, submitter.nprocs)
+
+        submitter.submit(name = self.name)
+        failed = submitter.wait()
+
+        sys.stdout.write('\n')
+
+        if len(failed) != 0:
+            print '%d jobs failed. Logs are in %s/%s.' % (len(failed), submitter.logdir, self.name)
+
     def _waitForCompletion(self, jobType, clusterId, argTemplate, autoResubmit):
         print 'Waiting for all jobs to complete.'
 
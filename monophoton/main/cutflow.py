@@ -7,6 +7,7 @@ from argparse import ArgumentParser
 
 thisdir = os.path.dirname(os.path.realpath(__file__))
 basedir = os.path.dirname(thisdir)
+monoxdir = os.path.dirname(basedir)
 sys.path.append(basedir)
 from datasets import allsamples
 import config
@@ -33,6 +34,7 @@ data = False
 ntotal = 0
 
 sampleNames = []
+skimPaths = []
 
 tree = ROOT.TChain('cutflow')
 for sample in allsamples.getmany(args.snames):
@@ -63,6 +65,7 @@ for sample in allsamples.getmany(args.snames):
 
     print filePath
     tree.Add(filePath)
+    skimPaths.append(filePath)
 
 if args.cutflow is None:
     if data:
@@ -123,6 +126,42 @@ else:
         cuts = tuple(cutstr.split(','))
         cutflow.append(cuts)
 
+def findEntries(eventIds):
+    """
+    Look up the chain entry numbers of the events using (run, lumi, event) indices stored next to the skim files.
+    Missing or outdated indices are (re)built. Returns None if an index is not available for some skim file.
+    """
+
+    ROOT.gROOT.LoadMacro(monoxdir + '/common/EventIndex.h+')
+
+    # computes the tree offsets
+    tree.GetEntries()
+    offsets = tree.GetTreeOffset()
+
+    entries = []
+    for itree, skimPath in enumerate(skimPaths):
+        indexPath = skimPath + '.evidx'
+
+        if not os.path.exists(indexPath) or os.stat(indexPath).st_mtime < os.stat(skimPath).st_mtime:
+            vpaths = ROOT.std.vector('TString')()
+            vpaths.push_back(skimPath)
+            if not ROOT.EventIndex.build(vpaths, indexPath, 'cutflow'):
+                return None
+
+        index = ROOT.EventIndex()
+        if not index.open(indexPath):
+            return None
+
+        for eventId in eventIds:
+            if index.find(*eventId):
+                entries.append(offsets[itree] + index.getFoundEntry())
+
+        index.close()
+
+    entries.sort()
+
+    return entries
+
 if args.eventList:
     run = array.array('I', [0])
     lumi = array.array('I', [0])
@@ -214,22 +253,27 @@ elif args.eventIds is not None:
             tree.SetBranchAddress(cut, bit)
             results[cut] = bit
 
-    sels = []
-    for eventId in eventIds:
-        sels.append('(runNumber == %d && lumiNumber == %d && eventNumber == %d)' % eventId)
+    entries = findEntries(eventIds)
 
-    tree.Draw('>>elist', ' || '.join(sels), 'entrylist')
-    elist = ROOT.gDirectory.Get('elist')
+    if entries is None:
+        # no usable index; scan the full chain
+        sels = []
+        for eventId in eventIds:
+            sels.append('(runNumber == %d && lumiNumber == %d && eventNumber == %d)' % eventId)
+    
+        tree.Draw('>>elist', ' || '.join(sels), 'entrylist')
+        elist = ROOT.gDirectory.Get('elist')
+
+        tree.SetEntryList(elist)
+        entries = [tree.GetEntryNumber(iL) for iL in range(elist.GetN())]
 
-    if elist.GetN() == 0:
+    if len(entries) == 0:
         print 'No event found:', eventIds
         sys.exit(1)
 
     outputLines = []
 
-    tree.SetEntryList(elist)
-    for iL in range(elist.GetN()):
-        iEntry = tree.GetEntryNumber(iL)
+    for iEntry in entries:
         tree.GetEntry(iEntry)
 
         outputLines.append('=== %d:%d:%d ===' % (run[0], lumi[0], event[0]))
@@ -10,10 +10,14 @@
 #include "TH1.h"
 #include "TF1.h"
 #include "TGraph.h"
+#include "TMath.h"
+#include "TVector2.h"
 
 #include <iostream>
 #include <functional>
 #include <fstream>
+#include <algorithm>
+#include <cmath>
 
 #include "fastjet/internal/base.hh"
 #include "fastjet/PseudoJet.hh"
@@ -21,6 +25,87 @@
 #include "fastjet/Selector.hh"
 #include "fastjet/GhostedAreaSpec.hh"
 
+//--------------------------------------------------------------------
+// EtaPhiGrid
+//--------------------------------------------------------------------
+
+EtaPhiGrid::EtaPhiGrid(double _cellSize/* = 0.2*/, double _maxEta/* = 5.*/) :
+  maxEta_(_maxEta),
+  nEta_(std::max(1, int(std::ceil(2. * _maxEta / _cellSize)))),
+  nPhi_(std::max(1, int(2. * TMath::Pi() / _cellSize))),
+  etaWidth_(2. * _maxEta / nEta_),
+  phiWidth_(2. * TMath::Pi() / nPhi_),
+  cells_(nEta_ * nPhi_)
+{
+}
+
+void
+EtaPhiGrid::clear()
+{
+  for (unsigned iC : filled_)
+    cells_[iC].clear();
+  filled_.clear();
+  size_ = 0;
+}
+
+int
+EtaPhiGrid::etaBin_(double _eta) const
+{
+  // particles beyond maxEta go to the edge cells
+  int bin(std::floor((_eta + maxEta_) / etaWidth_));
+  return std::min(std::max(bin, 0), nEta_ - 1);
+}
+
+int
+EtaPhiGrid::phiBin_(double _phi) const
+{
+  int bin(std::floor((TVector2::Phi_mpi_pi(_phi) + TMath::Pi()) / phiWidth_));
+  return std::min(std::max(bin, 0), nPhi_ - 1);
+}
+
+void
+EtaPhiGrid::add(double _eta, double _phi)
+{
+  unsigned iC(etaBin_(_eta) * nPhi_ + phiBin_(_phi));
+  if (cells_[iC].empty())
+    filled_.push_back(iC);
+
+  cells_[iC].push_back(size_++);
+}
+
+void
+EtaPhiGrid::findNear(double _eta, double _phi, double _dR, std::vector<unsigned>& _indices) const
+{
+  _indices.clear();
+
+  if (size_ == 0)
+    return;
+
+  int phiSpan(std::ceil(_dR / phiWidth_));
+
+  int etaMin(std::max(etaBin_(_eta - _dR), 0));
+  int etaMax(std::min(etaBin_(_eta + _dR), nEta_ - 1));
+
+  int iPhiC(phiBin_(_phi));
+  int phiBegin(iPhiC - phiSpan);
+  int phiEnd(iPhiC + phiSpan + 1);
+  if (phiEnd - phiBegin >= nPhi_) {
+    // cone wraps around the full circle
+    phiBegin = 0;
+    phiEnd = nPhi_;
+  }
+
+  for (int iEta(etaMin); iEta <= etaMax; ++iEta) {
+    for (int iPhi(phiBegin); iPhi != phiEnd; ++iPhi) {
+      auto& cell(cells_[iEta * nPhi_ + (iPhi + nPhi_) % nPhi_]);
+      _indices.insert(_indices.end(), cell.begin(), cell.end());
+    }
+  }
+
+  // preserve the original iteration order of the callers
+  std::sort(_indices.begin(), _indices.end());
+}
+
 //--------------------------------------------------------------------
 // Base
 //--------------------------------------------------------------------
@@ -34,6 +119,16 @@ Cut::expr() const
     return TString::Format("[%s]", name_.Data());
 }
 
+TString
+Cut::config() const
+{
+  TString conf(cutConfig());
+  if (conf.Length() == 0)
+    return conf;
+
+  return conf + TString::Format(" %d", ignoreDecision_);
+}
+
 bool
 Cut::exec(panda::EventMonophoton const& _event, panda::EventBase& _outEvent)
 {
@@ -381,6 +476,19 @@ PhotonSelection::initialize(panda::EventMonophoton&)
   }
 }
 
+TString
+PhotonSelection::cutConfig() const
+{
+  TString conf(TString::Format("PhotonSelection %s %f %f %d %d %d %d %d", name_.Data(), minPt_, maxPt_, idTune_, wp_, nPhotons_, includeLowPt_, useOriginalPt_));
+
+  for (auto& sel : selections_)
+    conf += TString::Format(" S%d%s", sel.first, sel.second.to_string().c_str());
+  for (auto& veto : vetoes_)
+    conf += TString::Format(" V%d%s", veto.first, veto.second.to_string().c_str());
+
+  return conf;
+}
+
 void
 PhotonSelection::registerCut(TTree& cutsTree)
 {
@@ -518,6 +626,8 @@ PhotonSelection::pass(panda::EventMonophoton const& _event, panda::EventMonophot
       chargedCands_.push_back(&cand);
   }
 
+  chargedGrid_.fill(chargedCands_);
+
   size_ = 0;
 
   bool vetoed(false);
@@ -639,7 +749,9 @@ PhotonSelection::selectPhoton(panda::XPhoton const& _photon, unsigned _idx)
   cutres[R9Unity] = (_photon.r9 < 1.0);
 
   cutres[ChargedPFVeto] = true;
-  for (auto* cand : chargedCands_) {
+  chargedGrid_.findNear(_photon.eta(), _photon.phi(), 0.1, nearCands_);
+  for (unsigned iC : nearCands_) {
+    auto* cand(chargedCands_[iC]);
     double dr(cand->dR(_photon));
     if (dr > 0.1)
       continue;
@@ -1932,13 +2044,15 @@ PFMatch::addBranches(TTree& _skimTree)
 void
 PFMatch::apply(panda::EventMonophoton const& _event, panda::EventMonophoton& _outEvent)
 {
-  std::vector<panda::PFCand const*> chargedCands;
+  chargedCands_.clear();
 
   for (auto& cand : _event.pfCandidates) {
     if (cand.q() != 0)
-      chargedCands.push_back(&cand);
+      chargedCands_.push_back(&cand);
   }
 
+  chargedGrid_.fill(chargedCands_);
+
   for (unsigned iPh(0); iPh != _outEvent.photons.size(); ++iPh) {
     auto& photon(_outEvent.photons[iPh]);
 
@@ -1946,7 +2060,9 @@ PFMatch::apply(panda::EventMonophoton const& _event, panda::EventMonophoton& _ou
     matchedDR_[iPh] = -1.;
     matchedRelPt_[iPh] = -1.;
 
-    for (auto* cand : chargedCands) {
+    chargedGrid_.findNear(photon.eta(), photon.phi(), dr_, nearCands_);
+    for (unsigned iC : nearCands_) {
+      auto* cand(chargedCands_[iC]);
       double dr(cand->dR(photon));
       double relPt(cand->pt() / photon.scRawPt);
       if (dr < dr_ && relPt > matchedRelPt_[iPh]) {
@@ -2144,6 +2260,12 @@ JetCleaning::initialize(panda::EventMonophoton&)
   }
 }
 
+TString
+JetCleaning::config() const
+{
+  return TString::Format("JetCleaning %s %s %f %d %d", name_.Data(), cleanAgainst_.to_string().c_str(), minPt_, useTightWP_, puidWP_);
+}
+
 void
 JetCleaning::addBranches(TTree& _skimTree)
 {
@@ -3704,19 +3826,19 @@ LeptonVertex::apply(panda::EventMonophoton const& _event, panda::EventMonophoton
   if (col->size() == 0)
     return;
 
-  std::vector<panda::PFCand const*> pfs;
-  pfs.reserve(16);
-  unsigned iPF(0);
+  pfs_.clear();
   for (auto& pf : _event.pfCandidates) {
     if (std::abs(pf.pdgId()) == pdgId)
-      pfs.push_back(&pf);
-
-    ++iPF;
+      pfs_.push_back(&pf);
   }
 
+  pfGrid_.fill(pfs_);
+
   panda::PFCand const* cand(0);
   for (auto& lepton : *col) {
-    for (auto* pf : pfs) {
+    pfGrid_.findNear(lepton.eta(), lepton.phi(), 0.1, nearCands_);
+    for (unsigned iC : nearCands_) {
+      auto* pf(pfs_[iC]);
       if (pf->dR2(lepton) < 0.01) {
         cand = pf;
         break;
@@ -3952,13 +4074,15 @@ TPLeptonPhoton::pass(panda::EventMonophoton const& _inEvent, panda::EventTP& _ou
     throw runtime_error("Incompatible event type in TPLeptonPhoton");
   }
 
-  std::vector<panda::PFCand const*> chargedCands;
+  chargedCands_.clear();
 
   for (auto& cand : _inEvent.pfCandidates) {
     if (cand.q() != 0)
-      chargedCands.push_back(&cand);
+      chargedCands_.push_back(&cand);
   }
 
+  chargedGrid_.fill(chargedCands_);
+
   for (auto& photon : _inEvent.photons) {
     if (!photon.isEB || photon.scRawPt < minProbePt_)
       continue;
@@ -3968,7 +4092,9 @@ TPLeptonPhoton::pass(panda::EventMonophoton const& _inEvent, panda::EventTP& _ou
 
     bool chargedPFMatch(false);
 
-    for (auto* cand : chargedCands) {
+    chargedGrid_.findNear(photon.eta(), photon.phi(), chargedPFDR_, nearCands_);
+    for (unsigned iC : nearCands_) {
+      auto* cand(chargedCands_[iC]);
       double dr(cand->dR(photon));
       if (dr > chargedPFDR_)
         continue;
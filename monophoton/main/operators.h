@@ -106,6 +106,47 @@ enum TPEventType {
 
 const UInt_t NMAX_PARTICLES = 128;
 
+//--------------------------------------------------------------------
+// Eta-phi bucket index for cone searches over large collections
+//--------------------------------------------------------------------
+
+class EtaPhiGrid {
+ public:
+  // cells narrower than the typical search cone keep the candidate lists short
+  EtaPhiGrid(double cellSize = 0.2, double maxEta = 5.);
+
+  void clear();
+  // particles are numbered in the order of addition
+  void add(double eta, double phi);
+  template<class P> void fill(std::vector<P const*> const&);
+  unsigned size() const { return size_; }
+
+  // indices (ascending) of the particles in the cells overlapping the cone; exact dR cut is up to the caller
+  void findNear(double eta, double phi, double dR, std::vector<unsigned>& indices) const;
+
+ private:
+  int etaBin_(double) const;
+  int phiBin_(double) const;
+
+  double maxEta_;
+  int nEta_;
+  int nPhi_;
+  double etaWidth_;
+  double phiWidth_;
+  std::vector<std::vector<unsigned>> cells_;
+  std::vector<unsigned> filled_{};
+  unsigned size_{0};
+};
+
+template<class P>
+void
+EtaPhiGrid::fill(std::vector<P const*> const& _particles)
+{
+  clear();
+  for (auto* p : _particles)
+    add(p->eta(), p->phi());
+}
+
 //--------------------------------------------------------------------
 // Base classes
 //--------------------------------------------------------------------
@@ -125,6 +166,10 @@ class Operator {
 
   virtual void registerCut(TTree&) {}
 
+  // Operators with the same non-empty config string are interchangeable and can be run once for several selectors.
+  // Only operators whose event state is not read by other operators should return one.
+  virtual TString config() const { return ""; }
+
   void setPrintLevel(unsigned l) { printLevel_ = l; }
   void setOutputStream(std::ostream& st) { stream_ = &st; }
 
@@ -146,8 +191,12 @@ class Cut : public Operator {
 
   void registerCut(TTree& cutsTree) override { cutsTree.Branch(name_, &result_, name_ + "/O"); }
 
+  TString config() const override;
+
  protected:
   virtual bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) = 0;
+  // config string of the cut without the decision flag
+  virtual TString cutConfig() const { return ""; }
 
  private:
   bool result_;
@@ -212,6 +261,7 @@ class HLTFilter : public Cut {
     
  protected:
   bool pass(panda::EventMonophoton const& _event, panda::EventMonophoton&) override;
+  TString cutConfig() const override { return "HLTFilter " + name_ + " " + pathNames_; }
 
   TString pathNames_{""};
   std::vector<UInt_t> tokens_;
@@ -243,6 +293,7 @@ class MetFilters : public Cut {
   void allowHalo() { halo_ = true; }
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
+  TString cutConfig() const override { return TString::Format("MetFilters %s %d", name_.Data(), halo_); }
 
   bool halo_{false};
 };
@@ -372,6 +423,7 @@ class PhotonSelection : public Cut {
 
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
+  TString cutConfig() const override;
   int selectPhoton(panda::XPhoton const&, unsigned idx);
 
   double minPt_{175.};
@@ -393,6 +445,8 @@ class PhotonSelection : public Cut {
   unsigned size_{0};
   bool nominalResult_{false};
   std::vector<panda::PFCand const*> chargedCands_;
+  EtaPhiGrid chargedGrid_{};
+  std::vector<unsigned> nearCands_{};
   bool chargedPFVeto_[NMAX_PARTICLES];
 };
 
@@ -401,6 +455,7 @@ class TauVeto : public Cut {
   TauVeto(char const* name = "TauVeto") : Cut(name) {}
  protected:
   bool pass(panda::EventMonophoton const&, panda::EventMonophoton&) override;
+  TString cutConfig() const override { return "TauVeto " + name_; }
 };
 
 class LeptonMt : public Cut {
@@ -867,6 +922,9 @@ class PFMatch : public Modifier {
   void apply(panda::EventMonophoton const& event, panda::EventMonophoton& outEvent) override;
 
   double dr_{0.1};
+  std::vector<panda::PFCand const*> chargedCands_{};
+  EtaPhiGrid chargedGrid_{};
+  std::vector<unsigned> nearCands_{};
   unsigned short matchedPtype_[NMAX_PARTICLES]{};
   float matchedDR_[NMAX_PARTICLES]{};
   float matchedRelPt_[NMAX_PARTICLES]{};
@@ -919,6 +977,7 @@ class JetCleaning : public Modifier {
   //  void setJetResolution(char const* sourcePath);
   void setMinPt(double min) { minPt_ = min; }
   void setPUIdWP(int i) { puidWP_ = i; }
+  TString config() const override;
 
   /* double ptScaled(unsigned iJ) const { return ptScaled_[iJ]; } */
   /* double ptScaledUp(unsigned iJ) const { return ptScaledUp_[iJ]; } */
@@ -965,6 +1024,7 @@ class CopyMet : public Modifier {
   CopyMet(char const* name = "CopyMet") : Modifier(name) {}
 
   void setUseGSFix(bool b) { useGSFix_ = b; }
+  TString config() const override { return TString::Format("CopyMet %s %d", name_.Data(), useGSFix_); }
  protected:
   void apply(panda::EventMonophoton const& event, panda::EventMonophoton& outEvent) override;
 
@@ -974,6 +1034,7 @@ class CopyMet : public Modifier {
 class CopySuperClusters : public Modifier {
  public:
   CopySuperClusters(char const* name = "CopySuperClusters") : Modifier(name) {}
+  TString config() const override { return "CopySuperClusters " + name_; }
  protected:
   void apply(panda::EventMonophoton const&, panda::EventMonophoton&) override;
 };
@@ -1349,6 +1410,9 @@ class LeptonVertex : public Modifier {
   void apply(panda::EventMonophoton const&, panda::EventMonophoton& _outEvent) override;
 
   LeptonFlavor flavor_;
+  std::vector<panda::PFCand const*> pfs_{};
+  EtaPhiGrid pfGrid_{};
+  std::vector<unsigned> nearCands_{};
   short ivtx_;
   short ivtxNoL_;
   float score_;
@@ -1429,6 +1493,9 @@ class TPLeptonPhoton : public TPCut {
   bool probeTriggerMatch_{false};
   double chargedPFDR_{0.1};
   double chargedPFRelPt_{0.6};
+  std::vector<panda::PFCand const*> chargedCands_{};
+  EtaPhiGrid chargedGrid_{};
+  std::vector<unsigned> nearCands_{};
 
   bool chargedPFVeto_[NMAX_PARTICLES];
   bool hasCollinearL_[NMAX_PARTICLES];
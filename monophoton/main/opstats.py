@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""
+Aggregate the per-operator statistics ("operators" tree written by EventSelectorBase::finalize)
+across skim outputs and print one table per selector, ranked by the total operator time.
+Operator times are nonzero only for skims run with the timers on (ssw2.py --timer).
+"""
+
+import os
+import sys
+import collections
+from argparse import ArgumentParser
+
+thisdir = os.path.dirname(os.path.realpath(__file__))
+basedir = os.path.dirname(thisdir)
+sys.path.append(basedir)
+import config
+
+argParser = ArgumentParser(description = 'Print operator statistics of skims')
+argParser.add_argument('paths', metavar = 'PATH', nargs = '*', help = 'Skim files or directories (searched recursively). Default is the fragment directories under the skim directory.')
+argParser.add_argument('--selectors', '-s', metavar = 'SELNAME', dest = 'selnames', nargs = '+', default = [], help = 'Selectors to report on.')
+argParser.add_argument('--sort', '-S', metavar = 'KEY', dest = 'sortKey', default = 'time', choices = ['time', 'maxTime', 'calls', 'passRate'], help = 'Column to rank the operators by.')
+argParser.add_argument('--limit', '-n', metavar = 'N', dest = 'limit', type = int, default = 0, help = 'Show only the top N operators per selector.')
+
+args = argParser.parse_args()
+sys.argv = []
+
+import ROOT
+ROOT.gROOT.SetBatch(True)
+
+def findSkims(paths):
+    """
+    Yield (selector name, path) for all skim files under paths.
+    Skim file names are <sample>[_<fileset>]_<selector>.root.
+    """
+
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, fnames in os.walk(path):
+                for fname in sorted(fnames):
+                    if fname.endswith('.root'):
+                        yield fname[:-5].split('_')[-1], os.path.join(dirpath, fname)
+        else:
+            yield os.path.basename(path)[:-5].split('_')[-1], path
+
+
+if len(args.paths) == 0:
+    # fragments only - merged files in skimDir duplicate the fragment content
+    args.paths = [os.path.join(config.skimDir, d) for d in os.listdir(config.skimDir) if os.path.isdir(os.path.join(config.skimDir, d))]
+
+# {selector: {operator: [calls, passes, time, maxTime, nfiles]}}
+stats = collections.defaultdict(collections.OrderedDict)
+
+for selname, path in findSkims(args.paths):
+    if len(args.selnames) != 0 and selname not in args.selnames:
+        continue
+
+    source = ROOT.TFile.Open(path)
+    if not source or source.IsZombie():
+        sys.stderr.write('Cannot open ' + path + '\n')
+        continue
+
+    tree = source.Get('operators')
+    if not tree:
+        # skim produced before the operator statistics were introduced
+        source.Close()
+        continue
+
+    for entry in tree:
+        opname = str(entry.name).rstrip('\0')
+        try:
+            opstats = stats[selname][opname]
+        except KeyError:
+            opstats = stats[selname][opname] = [0, 0, 0., 0., 0]
+
+        opstats[0] += entry.calls
+        opstats[1] += entry.passes
+        opstats[2] += entry.time
+        opstats[3] = max(opstats[3], entry.maxTime)
+        opstats[4] += 1
+
+    source.Close()
+
+def sortKey(item):
+    calls, passes, time, maxTime, _ = item[1]
+    if args.sortKey == 'time':
+        return time
+    elif args.sortKey == 'maxTime':
+        return maxTime
+    elif args.sortKey == 'calls':
+        return calls
+    else:
+        return -float(passes) / calls if calls else 0.
+
+for selname in sorted(stats.keys()):
+    operators = sorted(stats[selname].items(), key = sortKey, reverse = True)
+    if args.limit > 0:
+        operators = operators[:args.limit]
+
+    totalTime = sum(opstats[2] for opstats in stats[selname].values())
+
+    print 'Selector', selname
+    print '%-30s %14s %14s %9s %12s %7s %12s %12s' % ('operator', 'calls', 'passes', 'pass rate', 'time (s)', 'frac', 'us/call', 'max (s)')
+    for opname, (calls, passes, time, maxTime, nfiles) in operators:
+        passRate = float(passes) / calls if calls else 0.
+        frac = time / totalTime if totalTime > 0. else 0.
+        perCall = time / calls * 1.e+6 if calls else 0.
+
+        print '%-30s %14d %14d %9.4f %12.2f %7.3f %12.2f %12.4f' % (opname, calls, passes, passRate, time, frac, perCall, maxTime)
+
+    print
@@ -5,11 +5,7 @@ import os
 import re
 import tempfile
 
-from batch import BatchManager
-
-## load condor-run
-sys.path.append('/home/yiiyama/lib')
-from condor_run import CondorRun
+from batch import BatchManager, EXECUTORS
 
 logger = None
 
@@ -67,6 +63,57 @@ class PickEvent(object):
                     else:
                         self.eventIds.append((int(matches.group(1)), int(matches.group(2)), int(matches.group(3))))
 
+    def getInputPaths(self, fileset):
+        """
+        List of input file paths of a fileset.
+        """
+
+        paths = []
+        for path in self.sample.files([fileset]):
+            if PickEvent.config['readRemote']:
+                if not os.path.exists(path) or os.stat(path).st_size == 0:
+                    path = path.replace('/mnt/hadoop/cms', 'root://xrootd.cmsaf.mit.edu/')
+
+            paths.append(path)
+
+        return paths
+
+    def getIndex(self, fileset, paths):
+        """
+        Return the path to an up-to-date event index of the fileset, building one if requested.
+        Returns None if there is no usable index.
+        """
+
+        indexPath = '%s/%s/%s.evidx' % (PickEvent.config['indexDir'], self.sample.name, fileset)
+
+        if os.path.exists(indexPath):
+            index = ROOT.EventIndex()
+            if index.open(indexPath) and [index.getFile(i) for i in range(index.getNFiles())] == paths:
+                return indexPath
+
+            logger.info('Event index %s is out of date.', indexPath)
+
+        if not PickEvent.config['buildIndex']:
+            return None
+
+        try:
+            os.makedirs(os.path.dirname(indexPath))
+        except OSError:
+            if not os.path.isdir(os.path.dirname(indexPath)):
+                raise
+
+        logger.info('Building event index %s', indexPath)
+
+        vpaths = ROOT.std.vector('TString')()
+        for path in paths:
+            vpaths.push_back(path)
+
+        if not ROOT.EventIndex.build(vpaths, indexPath):
+            logger.error('Failed to build event index for %s %s', self.sample.name, fileset)
+            return None
+
+        return indexPath
+
     def executeSkim(self):
         """
         Execute the skim.
@@ -81,15 +128,24 @@ class PickEvent(object):
             for path in self.files:
                 skimmer.addPath(path)
         else:
+            indexPaths = []
             for fileset in self.filesets:
-                for path in self.sample.files([fileset]):
-                    if PickEvent.config['readRemote']:
-                        if not os.path.exists(path) or os.stat(path).st_size == 0:
-                            path = path.replace('/mnt/hadoop/cms', 'root://xrootd.cmsaf.mit.edu/')
-        
+                paths = self.getInputPaths(fileset)
+
+                indexPath = self.getIndex(fileset, paths)
+                if indexPath:
+                    indexPaths.append(indexPath)
+
+                for path in paths:
                     logger.debug('Add input: %s %s', fileset, path)
                     skimmer.addPath(path)
 
+            # index lookup only when every fileset is covered; otherwise scan everything
+            if len(indexPaths) == len(self.filesets):
+                for indexPath in indexPaths:
+                    logger.debug('Add index: %s', indexPath)
+                    skimmer.addIndex(indexPath)
+
         for eventId in self.eventIds:
             skimmer.addEvent(*eventId)
 
@@ -114,15 +170,16 @@ class PickEvent(object):
 
 
 class PickEventBatchManager(BatchManager):
-    def __init__(self, pickers, skipMissing, readRemote):
-        BatchManager.__init__(self, 'pickevent')
+    def __init__(self, pickers, skipMissing, readRemote, buildIndex, executor = 'condor'):
+        BatchManager.__init__(self, 'pickevent', executor)
 
         self.pickers = pickers # list of SlimSkimWeight objects to manage
         self.skipMissing = skipMissing
         self.readRemote = readRemote
+        self.buildIndex = buildIndex
 
     def submitSkim(self, noWait, autoResubmit = False):
-        submitter = CondorRun(os.path.realpath(__file__))
+        submitter = self._makeSubmitter(os.path.realpath(__file__))
 
         argTemplate = '%s -f %s'
     
@@ -132,6 +189,9 @@ class PickEventBatchManager(BatchManager):
         if self.readRemote:
             argTemplate += ' -R'
 
+        if self.buildIndex:
+            argTemplate += ' -X'
+
         for picker in self.pickers:
             eventList = tempfile.NamedTemporaryFile(delete = False)
             for eventId in picker.eventIds:
@@ -176,6 +236,7 @@ if __name__ == '__main__':
     argParser.add_argument('--filesets', '-f', metavar = 'ID', dest = 'filesets', nargs = '+', default = [], help = 'Fileset id to run on.')
     argParser.add_argument('--files', '-i', metavar = 'PATH', dest = 'files', nargs = '+', default = [], help = 'Directly run on files.')
     argParser.add_argument('--batch', '-B', action = 'store_true', dest = 'batch', help = 'Use condor-run to run.')
+    argParser.add_argument('--executor', '-b', metavar = 'NAME', dest = 'executor', choices = EXECUTORS, default = 'condor', help = '(With batch option) Job executor. "local" runs the batch jobs in a process pool on this machine.')
     argParser.add_argument('--nentries', '-N', metavar = 'N', dest = 'nentries', type = int, default = -1, help = 'Maximum number of entries.')
     argParser.add_argument('--no-wait', '-W', action = 'store_true', dest = 'noWait', help = '(With batch option) Don\'t wait for job completion.')
     argParser.add_argument('--print-every', '-e', metavar = 'NEVENTS', dest = 'printEvery', type = int, default = 10000, help = 'Print frequency.')
@@ -183,6 +244,7 @@ if __name__ == '__main__':
     argParser.add_argument('--read-remote', '-R', action = 'store_true', dest = 'readRemote', help = 'Read from root://xrootd.cmsaf.mit.edu if a local copy of the file does not exist.')
     argParser.add_argument('--resubmit', '-S', action = 'store_true', dest = 'autoResubmit', help = '(Without no-wait option) Automatically release held jobs.')
     argParser.add_argument('--skip-missing', '-K', action = 'store_true', dest = 'skipMissing', help = 'Skip missing files in skim.')
+    argParser.add_argument('--build-index', '-X', action = 'store_true', dest = 'buildIndex', help = 'Build (run, lumi, event) indices for filesets that do not have an up-to-date one. Filesets with an index are searched without a full scan.')
     argParser.add_argument('--uw-format', '-U', action = 'store_true', dest = 'uwFormat', help = 'Print event list in run:event:lumi format.')
     
     args = argParser.parse_args()
@@ -242,6 +304,7 @@ if __name__ == '__main__':
             PickEvent.config[key] = getattr(config, key)
 
     PickEvent.config['outDir'] = os.path.dirname(config.skimDir) + '/pickevent'
+    PickEvent.config['indexDir'] = os.path.dirname(config.skimDir) + '/eventindex'
 
     ## set up samples and selectors
     import datasets
@@ -256,6 +319,7 @@ if __name__ == '__main__':
     ## need to instantiate ROOT.panda (otherwise CLING segfaults)
     e = ROOT.panda.Event
 
+    ROOT.gSystem.AddIncludePath('-I' + monoxdir + '/common')
     ROOT.gROOT.LoadMacro(os.path.dirname(os.path.realpath(__file__)) + '/EventPicker.cc+')
 
     try:
@@ -293,11 +357,7 @@ if __name__ == '__main__':
         ## job submission only
         print 'Submitting jobs.'
 
-        ## load condor-run
-        sys.path.append('/home/yiiyama/lib')
-        from condor_run import CondorRun
-
-        batchManager = PickEventBatchManager(pickers, args.skipMissing, args.readRemote)
+        batchManager = PickEventBatchManager(pickers, args.skipMissing, args.readRemote, args.buildIndex, args.executor)
         batchManager.submitSkim(args.noWait, args.autoResubmit)
 
         if args.noWait:
@@ -6,13 +6,23 @@ import os
 import math
 import re
 import collections
+import multiprocessing
+import tempfile
+import shutil
+import hashlib
 
 import ROOT
 
-def makePlotter(sourceName, plotConfig, group, sample, lumi, printLevel):
-    global ROOT
-    plotter = ROOT.MultiDraw()
-    plotter.addInputPath(sourceName)
+# input read settings passed to MultiDraw (set from command line)
+multiDrawConfig = {'cacheSize': 0, 'cacheLearnEntries': -1, 'readStats': False}
+
+# HistCache instance (set from command line)
+histCache = None
+
+def plotterSettings(plotConfig, group, sample, lumi):
+    """
+    Return (base selection, full selection, constant weight, prescale) of the MultiDraw for the sample.
+    """
 
     cuts = []
     if plotConfig.baseline.strip():
@@ -23,25 +33,335 @@ def makePlotter(sourceName, plotConfig, group, sample, lumi, printLevel):
 
     baseSel = ' && '.join(cuts)
 
+    if sample.data:
+        weight = 1.
+    else:
+        weight = lumi
+
+    if group == plotConfig.obs:
+        prescale = plotConfig.prescales[sample]
+    else:
+        prescale = 1
+
+    return baseSel, plotConfig.fullSelection.strip(), weight, prescale
+
+
+def makePlotter(sourceName, plotConfig, group, sample, lumi, printLevel):
+    global ROOT
+    plotter = ROOT.MultiDraw()
+    plotter.addInputPath(sourceName)
+
+    baseSel, fullSel, weight, prescale = plotterSettings(plotConfig, group, sample, lumi)
+
     if printLevel > 0:
         print '      Baseline selection:', baseSel
-        print '      Full selection:', plotConfig.fullSelection.strip()
+        print '      Full selection:', fullSel
 
     plotter.setBaseSelection(baseSel)
-    plotter.setFullSelection(plotConfig.fullSelection.strip())
+    plotter.setFullSelection(fullSel)
 
     if not sample.data:
-        plotter.setConstantWeight(lumi)
+        plotter.setConstantWeight(weight)
 
     if group == plotConfig.obs:
-        plotter.setPrescale(plotConfig.prescales[sample])
+        plotter.setPrescale(prescale)
 
     plotter.setPrintLevel(printLevel)
 
+    plotter.setCacheSize(multiDrawConfig['cacheSize'] * 1024 * 1024)
+    plotter.setCacheLearnEntries(multiDrawConfig['cacheLearnEntries'])
+    plotter.setPrintReadStats(multiDrawConfig['readStats'])
+
     return plotter
-    
 
-def fillPlots(plotConfig, group, plotdefs, sourceDir, outFile, lumi = 0., postscale = 1., printLevel = 0, altSourceDir = ''):
+
+class HistCache(object):
+    """
+    On-disk store of filled histograms. Each histogram is saved in its own file named after the hash
+    of everything that determines its content. Least recently used files are removed when the total
+    size exceeds maxSize (bytes).
+    """
+
+    VERSION = 2
+    # histograms are filled by MultiDraw through TTreeFormula
+    BACKEND = 'TTreeFormula'
+
+    def __init__(self, cacheDir, maxSize):
+        self.cacheDir = cacheDir
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+
+        # any change to the filler code invalidates the cached histograms
+        multiDrawDir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))) + '/common'
+        digest = hashlib.sha1()
+        for fname in ['MultiDraw.h', 'MultiDraw.cc']:
+            with open(multiDrawDir + '/' + fname) as source:
+                digest.update(source.read())
+
+        self.fillerVersion = digest.hexdigest()
+
+        if not os.path.isdir(self.cacheDir):
+            os.makedirs(self.cacheDir)
+
+    def makeKey(self, *args):
+        return hashlib.sha1(repr((HistCache.VERSION, HistCache.BACKEND, self.fillerVersion) + args)).hexdigest()
+
+    def load(self, key, hist):
+        """
+        Add the cached content to hist. Returns False if there is no cache entry.
+        """
+
+        global ROOT
+
+        path = self._path(key)
+
+        if not os.path.exists(path):
+            self.misses += 1
+            return False
+
+        gd = ROOT.gDirectory
+        source = ROOT.TFile.Open(path)
+        cached = None
+        if source and not source.IsZombie():
+            cached = source.Get('hist')
+
+        if not cached:
+            if source:
+                source.Close()
+            gd.cd()
+            self.misses += 1
+            return False
+
+        hist.Add(cached)
+        source.Close()
+        gd.cd()
+
+        # mark as recently used
+        os.utime(path, None)
+
+        self.hits += 1
+        return True
+
+    def save(self, key, hist):
+        global ROOT
+
+        path = self._path(key)
+        tmpPath = path + '.%d' % os.getpid()
+
+        gd = ROOT.gDirectory
+        outFile = ROOT.TFile.Open(tmpPath, 'recreate')
+        clone = hist.Clone('hist')
+        clone.SetDirectory(outFile)
+        clone.Write()
+        outFile.Close()
+        gd.cd()
+
+        # rename is atomic - concurrent plot.py processes never read partial files
+        os.rename(tmpPath, path)
+
+    def prune(self):
+        entries = []
+        for fname in os.listdir(self.cacheDir):
+            if not fname.endswith('.root'):
+                continue
+
+            path = self.cacheDir + '/' + fname
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if total <= self.maxSize:
+                break
+
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+            total -= size
+
+    def _path(self, key):
+        return self.cacheDir + '/' + key + '.root'
+
+
+def histBinning(hist):
+    """
+    Tuple describing the type and the bin edges of the histogram.
+    """
+
+    binning = (hist.ClassName(),)
+    for axis in [hist.GetXaxis(), hist.GetYaxis(), hist.GetZaxis()][:hist.GetDimension()]:
+        binning += (tuple(axis.GetBinLowEdge(iX) for iX in range(1, axis.GetNbins() + 2)),)
+
+    return binning
+
+
+class Scan(object):
+    """
+    Set of plots filled in one pass over a skim file. Plots of all groups that read the same
+    file with the same MultiDraw settings are collected into one scan.
+    """
+
+    def __init__(self, sourceName, plotConfig, group, sample, lumi, printLevel):
+        self.sourceName = sourceName
+        self._plotterArgs = (sourceName, plotConfig, group, sample, lumi, printLevel)
+        self._settings = plotterSettings(plotConfig, group, sample, lumi)
+        self.plots = [] # [(hist, expr, cut, applyBaseline, applyFullSel, reweight, overflowMode)]
+        self.cacheKeys = []
+
+    def addPlot(self, hist, expr, cut, applyBaseline, applyFullSel, reweight, overflowMode):
+        """
+        Add a plot to be filled, unless its content is found in histCache.
+        """
+
+        key = None
+        if histCache is not None:
+            try:
+                stat = os.stat(self.sourceName)
+            except OSError:
+                pass
+            else:
+                source = (os.path.realpath(self.sourceName), stat.st_size, stat.st_mtime)
+                key = histCache.makeKey(source, self._settings, histBinning(hist), expr, cut, applyBaseline, applyFullSel, reweight, int(overflowMode))
+
+                if histCache.load(key, hist):
+                    return
+
+        self.plots.append((hist, expr, cut, applyBaseline, applyFullSel, reweight, overflowMode))
+        self.cacheKeys.append(key)
+
+    def saveToCache(self):
+        for plot, key in zip(self.plots, self.cacheKeys):
+            if key is not None:
+                histCache.save(key, plot[0])
+
+    def fill(self):
+        if len(self.plots) == 0:
+            return
+
+        print '   ', os.path.basename(self.sourceName), '(%d plots)' % len(self.plots)
+
+        plotter = makePlotter(*self._plotterArgs)
+        for plot in self.plots:
+            plotter.addPlot(*plot)
+
+        plotter.fillPlots()
+
+
+def getScan(scans, sourceName, plotConfig, group, sample, lumi, printLevel):
+    """
+    Return the scan of scans (an ordered dict) for the source and plotter settings, creating one if necessary.
+    """
+
+    key = (sourceName,) + plotterSettings(plotConfig, group, sample, lumi)
+
+    try:
+        return scans[key]
+    except KeyError:
+        scan = scans[key] = Scan(sourceName, plotConfig, group, sample, lumi, printLevel)
+        return scan
+
+
+# scans to be run in the worker processes (shared through fork)
+scanstore = []
+
+def runScan(iscan, outDir):
+    """
+    Run scanstore[iscan] in a worker process and save the filled histograms into a file under outDir.
+    """
+
+    global ROOT
+
+    scan = scanstore[iscan]
+    scan.fill()
+
+    path = outDir + '/scan%d.root' % iscan
+    outFile = ROOT.TFile.Open(path, 'recreate')
+    for ih, plot in enumerate(scan.plots):
+        hist = plot[0].Clone('h%d' % ih)
+        hist.SetDirectory(outFile)
+        hist.Write()
+
+    outFile.Close()
+
+    return iscan, path
+
+
+def runScans(scans, nworkers = 1):
+    """
+    Fill the plots of all scans and save the results to histCache.
+    """
+
+    scans = [scan for scan in scans if len(scan.plots) != 0]
+
+    if nworkers <= 1 or len(scans) <= 1:
+        for scan in scans:
+            scan.fill()
+
+    else:
+        runScansParallel(scans, nworkers)
+
+    if histCache is not None:
+        for scan in scans:
+            scan.saveToCache()
+
+        histCache.prune()
+
+
+def runScansParallel(scans, nworkers):
+    """
+    Distribute the scans over a process pool. The histograms filled in the workers are added back to
+    the originals in this process.
+    """
+
+    # start from the largest inputs so that the total time is bounded by the slowest scan
+    def inputSize(scan):
+        try:
+            return os.path.getsize(scan.sourceName)
+        except OSError:
+            return 0
+
+    scanstore[:] = sorted(scans, key = inputSize, reverse = True)
+
+    tmpDir = tempfile.mkdtemp(prefix = 'plot_')
+
+    pool = multiprocessing.Pool(min(nworkers, len(scanstore)))
+
+    try:
+        results = [pool.apply_async(runScan, (iscan, tmpDir)) for iscan in range(len(scanstore))]
+        pool.close()
+
+        for result in results:
+            iscan, path = result.get()
+
+            source = ROOT.TFile.Open(path)
+            for ih, plot in enumerate(scanstore[iscan].plots):
+                plot[0].Add(source.Get('h%d' % ih))
+
+            source.Close()
+            os.unlink(path)
+
+        pool.join()
+
+    finally:
+        pool.terminate()
+        shutil.rmtree(tmpDir, ignore_errors = True)
+        scanstore[:] = []
+
+
+def bookPlots(plotConfig, group, plotdefs, sourceDir, outFile, scans, lumi = 0., printLevel = 0, altSourceDir = ''):
+    """
+    Create the histograms of the group and register them to the scans. Returns the ordered dict
+    {(sample, plotdef, variation, direction): histogram}, which is passed to finalizePlots after runScans.
+    """
+
     if group.region:
         region = group.region
     else:
@@ -49,7 +369,6 @@ def fillPlots(plotConfig, group, plotdefs, sourceDir, outFile, lumi = 0., postsc
 
     histograms = collections.OrderedDict() # {(sample, plotdef, variation, direction): histogram}
 
-    # run the Plotter for each sample
     for sample in group.samples:
         sourceName = utils.getSkimPath(sample.name, region, sourceDir, altSourceDir)
 
@@ -61,8 +380,7 @@ def fillPlots(plotConfig, group, plotdefs, sourceDir, outFile, lumi = 0., postsc
             sys.stderr.write('File ' + sourceName + ' does not exist.\n')
             raise RuntimeError('InvalidSource')
 
-        plotter = makePlotter(sourceName, plotConfig, group, sample, lumi, printLevel)
-        varPlotters = {} # additional plotters for variations of sample type
+        scan = getScan(scans, sourceName, plotConfig, group, sample, lumi, printLevel)
 
         for plotdef in plotdefs:
             if not outFile.GetDirectory(plotdef.name):
@@ -97,7 +415,7 @@ def fillPlots(plotConfig, group, plotdefs, sourceDir, outFile, lumi = 0., postsc
                 overflowMode = ROOT.Plot.kNoOverflowBin
 
             # nominal distribution
-            plotter.addPlot(
+            scan.addPlot(
                 hist,
                 plotdef.formExpression(),
                 cut.strip(),
@@ -138,16 +456,12 @@ def fillPlots(plotConfig, group, plotdefs, sourceDir, outFile, lumi = 0., postsc
                         expr = plotdef.formExpression()
 
                     if variation.regions is not None:
-                        try:
-                            varPlotter = varPlotters[hist.GetName()]
-                        except KeyError:
-                            varSourceName = utils.getSkimPath(sample.name, variation.regions[iv], sourceDir, altSourceDir)
-                            varPlotter = makePlotter(varSourceName, plotConfig, group, sample, lumi, printLevel)
-                            varPlotters[hist.GetName()] = varPlotter
+                        varSourceName = utils.getSkimPath(sample.name, variation.regions[iv], sourceDir, altSourceDir)
+                        varScan = getScan(scans, varSourceName, plotConfig, group, sample, lumi, printLevel)
                     else:
-                        varPlotter = plotter
+                        varScan = scan
 
-                    varPlotter.addPlot(
+                    varScan.addPlot(
                         hist,
                         expr,
                         cut.strip(),
@@ -157,13 +471,14 @@ def fillPlots(plotConfig, group, plotdefs, sourceDir, outFile, lumi = 0., postsc
                         overflowMode
                     )
 
-        # setup complete. Fill all plots in one go
-        if plotter.numObjs() != 0:
-            plotter.fillPlots()
+    return histograms
+
 
-        for varname, varPlotter in varPlotters.items():
-            if varPlotter.numObjs() != 0:
-                varPlotter.fillPlots()
+def finalizePlots(plotConfig, group, plotdefs, histograms, outFile, postscale = 1.):
+    if group.region:
+        region = group.region
+    else:
+        region = plotConfig.name
 
     if group.norm >= 0.:
         normalization = sum(hist.GetBinContent(1) for (_, plotdef, variation, direction), hist in histograms.items() if plotdef.name == 'count' and variation is None)
@@ -561,6 +876,12 @@ if __name__ == '__main__':
     argParser.add_argument('--print-level', '-m', metavar = 'LEVEL', dest = 'printLevel', default = 0, help = 'Verbosity of the script.')
     argParser.add_argument('--replot', '-P', action = 'store_true', dest = 'replot', default = '', help = 'Do not fill histograms. Need --hist-file.')
     argParser.add_argument('--skim-dir', '-i', metavar = 'PATH', dest = 'skimDir', help = 'Input skim directory.')
+    argParser.add_argument('--cache-size', '-Z', metavar = 'MB', dest = 'cacheSize', type = int, default = 0, help = 'Input TTreeCache size in MB. 0 for ROOT default.')
+    argParser.add_argument('--cache-learn-entries', '-l', metavar = 'N', dest = 'cacheLearnEntries', type = int, default = -1, help = 'Number of cache learning entries. 0 to register the read branches directly. Negative for ROOT default.')
+    argParser.add_argument('--read-stats', '-O', action = 'store_true', dest = 'readStats', help = 'Print per-file input read statistics.')
+    argParser.add_argument('--num-workers', '-j', metavar = 'N', dest = 'nworkers', type = int, default = 1, help = 'Number of parallel processes to fill the histograms with.')
+    argParser.add_argument('--no-cache', '-N', action = 'store_true', dest = 'noCache', help = 'Do not read or write the histogram cache.')
+    argParser.add_argument('--hist-cache-size', '-C', metavar = 'MB', dest = 'histCacheSize', type = int, default = 10000, help = 'Size limit of the histogram cache. Least recently used histograms are removed beyond the limit.')
     
     args = argParser.parse_args()
     sys.argv = []
@@ -583,6 +904,13 @@ if __name__ == '__main__':
     ## PARSE COMMAND-LINE ARGUMENTS ##
     ##################################
 
+    multiDrawConfig['cacheSize'] = args.cacheSize
+    multiDrawConfig['cacheLearnEntries'] = args.cacheLearnEntries
+    multiDrawConfig['readStats'] = args.readStats
+
+    if not args.noCache and not args.replot:
+        histCache = HistCache(config.histCacheDir, args.histCacheSize * 1024 * 1024)
+
     if args.skimDir:
         localSkimDir = ''
     else:
@@ -721,10 +1049,24 @@ if __name__ == '__main__':
             # if args.asimov, we'll make the data_obs plot below
             groups.append(plotConfig.obs)
     
+        # collect the plots of all groups into scans over skim files first
+        scans = collections.OrderedDict()
+        booked = []
         for group in groups:
             print ' ', group.name
 
-            fillPlots(plotConfig, group, plotdefs, args.skimDir, histFile, lumi = effLumi, postscale = postscale, printLevel = args.printLevel, altSourceDir = localSkimDir)
+            histograms = bookPlots(plotConfig, group, plotdefs, args.skimDir, histFile, scans, lumi = effLumi, printLevel = args.printLevel, altSourceDir = localSkimDir)
+            booked.append((group, histograms))
+
+        if histCache is not None:
+            print 'Histogram cache: %d hits, %d misses' % (histCache.hits, histCache.misses)
+
+        print 'Running %d scans..' % len([scan for scan in scans.values() if len(scan.plots) != 0])
+
+        runScans(scans.values(), nworkers = args.nworkers)
+
+        for group, histograms in booked:
+            finalizePlots(plotConfig, group, plotdefs, histograms, histFile, postscale = postscale)
    
         # Save a background total histogram (for display purpose) for each plotdef
         for plotdef in plotdefs:
@@ -5,6 +5,7 @@
 #include "TSystem.h"
 
 #include <cstring>
+#include <algorithm>
 
 //--------------------------------------------------------------------
 // EventSelectorBase
@@ -68,6 +69,10 @@ EventSelectorBase::initialize(char const* _outputPath, panda::EventMonophoton& _
     *stream_ << "Initializing " << className() << "::" << name() << std::endl;
 
   auto* outputFile(new TFile(_outputPath, "recreate"));
+  if (compressionAlgorithm_ >= 0)
+    outputFile->SetCompressionAlgorithm(compressionAlgorithm_);
+  if (compressionLevel_ >= 0)
+    outputFile->SetCompressionLevel(compressionLevel_);
 
   skimOut_ = new TTree("events", "Events");
   cutsOut_ = new TTree("cutflow", "cutflow");
@@ -90,18 +95,26 @@ EventSelectorBase::initialize(char const* _outputPath, panda::EventMonophoton& _
     *stream_ << std::endl;
   }
 
-  for (auto* op : operators_) {
+  for (unsigned iO(0); iO != operators_.size(); ++iO) {
+    auto* op(operators_[iO]);
     op->addInputBranch(_blist);
     op->addBranches(*skimOut_);
-    op->initialize(_inEvent);
+    // shared operators are initialized by their owner
+    if (iO >= nShared_)
+      op->initialize(_inEvent);
     op->registerCut(*cutsOut_);
   }
 
+  // after all branches are booked
+  if (basketSize_ > 0)
+    skimOut_->SetBasketSize("*", basketSize_);
+  if (autoFlush_ != 0)
+    skimOut_->SetAutoFlush(autoFlush_);
+
   if (printLevel_ > 0)
     *stream_ << std::endl;
 
-  if (useTimers_)
-    timers_.resize(operators_.size());
+  opStats_.assign(operators_.size(), OperatorStats());
 }
 
 void
@@ -111,6 +124,7 @@ EventSelectorBase::finalize()
     return;
 
   auto* outputFile(skimOut_->GetCurrentFile());
+  TString outputPath(outputFile->GetName());
   outputFile->cd();
   skimOut_->Write();
   cutsOut_->Write();
@@ -118,6 +132,13 @@ EventSelectorBase::finalize()
   // save additional output if there are any
   addOutput_(outputFile);
 
+  // addOutput_ may have replaced the output file
+  if (!outputFile)
+    outputFile = TFile::Open(outputPath, "update");
+
+  outputFile->cd();
+  writeOperatorStats_();
+
   delete outputFile;
   skimOut_ = 0;
   cutsOut_ = 0;
@@ -127,11 +148,82 @@ EventSelectorBase::finalize()
     for (unsigned iO(0); iO != operators_.size(); ++iO) {
       stream_->flags(std::ios_base::fixed);
       stream_->width(5);
-      *stream_ << " " << (std::chrono::duration_cast<std::chrono::nanoseconds>(timers_[iO]).count() * 1.e-9) << " " << operators_[iO]->name() << std::endl;
+      *stream_ << " " << (std::chrono::duration_cast<std::chrono::nanoseconds>(opStats_[iO].time).count() * 1.e-9) << " " << operators_[iO]->name() << std::endl;
     }
   }
 }
 
+bool
+EventSelectorBase::execOperator_(unsigned _iO, panda::EventMonophoton const& _event, panda::EventBase& _outEvent)
+{
+  auto& stats(opStats_[_iO]);
+  ++stats.calls;
+
+  bool pass(false);
+
+  if (useTimers_) {
+    auto start(Clock::now());
+
+    pass = operators_[_iO]->exec(_event, _outEvent);
+
+    auto elapsed(Clock::now() - start);
+    stats.time += elapsed;
+    if (elapsed > stats.maxTime)
+      stats.maxTime = elapsed;
+  }
+  else
+    pass = operators_[_iO]->exec(_event, _outEvent);
+
+  if (pass)
+    ++stats.passes;
+
+  return pass;
+}
+
+void
+EventSelectorBase::writeOperatorStats_()
+{
+  char opName[256];
+  unsigned index(0);
+  ULong64_t calls(0);
+  ULong64_t passes(0);
+  double time(0.);
+  double maxTime(0.);
+
+  auto* statsOut(new TTree("operators", "Operator statistics"));
+  statsOut->Branch("name", opName, "name/C");
+  statsOut->Branch("index", &index, "index/i");
+  statsOut->Branch("calls", &calls, "calls/l");
+  statsOut->Branch("passes", &passes, "passes/l");
+  statsOut->Branch("time", &time, "time/D");
+  statsOut->Branch("maxTime", &maxTime, "maxTime/D");
+
+  for (index = 0; index != operators_.size(); ++index) {
+    auto& stats(opStats_[index]);
+
+    std::strncpy(opName, operators_[index]->name(), sizeof(opName) - 1);
+    opName[sizeof(opName) - 1] = '\0';
+
+    calls = stats.calls;
+    passes = stats.passes;
+    time = std::chrono::duration_cast<std::chrono::nanoseconds>(stats.time).count() * 1.e-9;
+    maxTime = std::chrono::duration_cast<std::chrono::nanoseconds>(stats.maxTime).count() * 1.e-9;
+
+    statsOut->Fill();
+  }
+
+  statsOut->Write();
+  delete statsOut;
+}
+
+void
+EventSelectorBase::pruneBranches_(panda::utils::BranchList& _blist) const
+{
+  // vetoes appended last take precedence over the earlier entries
+  for (auto& name : prunedBranches_)
+    _blist.emplace_back(("!" + name).Data());
+}
+
 //--------------------------------------------------------------------
 // EventSelector
 //--------------------------------------------------------------------
@@ -147,12 +239,14 @@ EventSelector::setupSkim_(panda::EventMonophoton& _inEvent, bool _isMC)
   else
     blist += {"metFilters"};
 
+  pruneBranches_(blist);
   _inEvent.book(*skimOut_, blist);
 
   blist = {"weight", "jets", "photons", "electrons", "muons", "taus", "superClusters", "t1Met"};
   if (_isMC)
     blist += {"genJets"}; // filled only if AddGenJets operator is run
 
+  pruneBranches_(blist);
   outEvent_.book(*skimOut_, blist);
 }
 
@@ -165,9 +259,93 @@ EventSelector::prepareFill_(panda::EventMonophoton& _inEvent)
   _inEvent.genParticles.prepareFill(*skimOut_);
 }
 
+EventSelector::~EventSelector()
+{
+  // hand the own operators back for deletion; shared ones belong to the source
+  for (unsigned iO(0); iO != replaced_.size(); ++iO)
+    operators_[iO] = replaced_[iO];
+
+  for (auto* snapshot : snapshots_)
+    delete snapshot;
+}
+
+unsigned
+EventSelector::nCommonOperators(EventSelector const& _other) const
+{
+  unsigned nOps(std::min(operators_.size(), _other.operators_.size()));
+
+  unsigned iO(0);
+  for (; iO != nOps; ++iO) {
+    TString config(operators_[iO]->config());
+    if (config.Length() == 0 || config != _other.operators_[iO]->config())
+      break;
+  }
+
+  return iO;
+}
+
+void
+EventSelector::shareOperators(EventSelector& _source, unsigned _nOps)
+{
+  // already sharing - the same Skimmer runs once per fileset
+  if (shareSource_)
+    return;
+
+  if (_nOps == 0 || _nOps > operators_.size() || _nOps > _source.operators_.size())
+    return;
+
+  for (unsigned iO(0); iO != _nOps; ++iO) {
+    replaced_.push_back(operators_[iO]);
+    operators_[iO] = _source.operators_[iO];
+  }
+
+  shareSource_ = &_source;
+  nShared_ = _nOps;
+
+  for (auto* snapshot : _source.snapshots_) {
+    if (snapshot->nOps == _nOps)
+      return;
+  }
+
+  _source.snapshots_.push_back(new Snapshot);
+  _source.snapshots_.back()->nOps = _nOps;
+}
+
+void
+EventSelector::takeSnapshots_(unsigned _nDone)
+{
+  for (auto* snapshot : snapshots_) {
+    if (snapshot->nOps != _nDone)
+      continue;
+
+    snapshot->event = nEvents_;
+    snapshot->results.assign(opResults_.begin(), opResults_.begin() + _nDone);
+    copyOutput_(outEvent_, snapshot->outEvent);
+  }
+}
+
+/*static*/
+void
+EventSelector::copyOutput_(panda::EventMonophoton const& _source, panda::EventMonophoton& _target)
+{
+  // same list as the output branches booked in setupSkim_
+  _target.weight = _source.weight;
+  _target.jets = _source.jets;
+  _target.photons = _source.photons;
+  _target.electrons = _source.electrons;
+  _target.muons = _source.muons;
+  _target.taus = _source.taus;
+  _target.superClusters = _source.superClusters;
+  _target.t1Met = _source.t1Met;
+  _target.genJets = _source.genJets;
+}
+
 void
 EventSelector::selectEvent(panda::EventMonophoton& _event)
 {
+  // counts the calls, not the selected events; all selectors see the same sequence
+  ++nEvents_;
+
   if (blindPrescale_ > 1 && _event.runNumber >= blindMinRun_ && _event.eventNumber % blindPrescale_ != 0)
     return;
 
@@ -175,20 +353,43 @@ EventSelector::selectEvent(panda::EventMonophoton& _event)
   inWeight_ = _event.weight;
   outEvent_.weight = _event.weight;
 
-  Clock::time_point start;
+  opResults_.resize(operators_.size());
 
   bool pass(true);
-  for (unsigned iO(0); iO != operators_.size(); ++iO) {
-    auto& op(*operators_[iO]);
-    
-    if (useTimers_)
-      start = Clock::now();
+  unsigned iO(0);
+
+  if (shareSource_) {
+    Snapshot const* snapshot(0);
+    for (auto* s : shareSource_->snapshots_) {
+      if (s->nOps == nShared_ && s->event == nEvents_)
+        snapshot = s;
+    }
+
+    // source may have skipped the event (e.g. blinding); then the shared operators are run here
+    if (snapshot) {
+      copyOutput_(snapshot->outEvent, outEvent_);
+
+      for (; iO != nShared_; ++iO) {
+        auto& stats(opStats_[iO]);
+        ++stats.calls;
+        opResults_[iO] = snapshot->results[iO];
+        if (opResults_[iO])
+          ++stats.passes;
+        else
+          pass = false;
+      }
+
+      takeSnapshots_(iO);
+    }
+  }
 
-    if (!op.exec(_event, outEvent_))
+  for (; iO != operators_.size(); ++iO) {
+    opResults_[iO] = execOperator_(iO, _event, outEvent_);
+    if (!opResults_[iO])
       pass = false;
 
-    if (useTimers_)
-      timers_[iO] += Clock::now() - start;
+    if (snapshots_.size() != 0)
+      takeSnapshots_(iO + 1);
   }
 
   if (pass) {
@@ -225,23 +426,12 @@ ZeeEventSelector::selectEvent(panda::EventMonophoton& _event)
   inWeight_ = _event.weight;
   outEvent_.weight = _event.weight;
 
-  Clock::time_point start;
+  unsigned iLS(leptonSelection_ - operators_.begin());
 
   bool passUpToLS(true);
-  unsigned iO(0);
-  for (auto itr(operators_.begin()); itr != leptonSelection_; ++itr) {
-    auto& op(**itr);
-    
-    if (useTimers_)
-      start = Clock::now();
-
-    if (!op.exec(_event, outEvent_))
+  for (unsigned iO(0); iO != iLS; ++iO) {
+    if (!execOperator_(iO, _event, outEvent_))
       passUpToLS = false;
-
-    if (useTimers_)
-      timers_[iO] += Clock::now() - start;
-
-    ++iO;
   }
 
   if (passUpToLS && outEvent_.photons.size() > 1) {
@@ -255,20 +445,9 @@ ZeeEventSelector::selectEvent(panda::EventMonophoton& _event)
 
       bool pass(true);
 
-      unsigned iOPair(iO);
-      for (auto itr(leptonSelection_); itr != operators_.end(); ++itr) {
-        auto& op(**itr);
-
-        if (useTimers_)
-          start = Clock::now();
-
-        if (!op.exec(_event, outEvent_))
+      for (unsigned iO(iLS); iO != operators_.size(); ++iO) {
+        if (!execOperator_(iO, _event, outEvent_))
           pass = false;
-
-        if (useTimers_)
-          timers_[iOPair] += Clock::now() - start;
-
-        ++iOPair;
       }
 
       if (pass) {
@@ -285,19 +464,9 @@ ZeeEventSelector::selectEvent(panda::EventMonophoton& _event)
 
     bool pass(passUpToLS);
 
-    for (auto itr(leptonSelection_); itr != operators_.end(); ++itr) {
-      auto& op(**itr);
-
-      if (useTimers_)
-        start = Clock::now();
-
-      if (!op.exec(_event, outEvent_))
+    for (unsigned iO(iLS); iO != operators_.size(); ++iO) {
+      if (!execOperator_(iO, _event, outEvent_))
         pass = false;
-
-      if (useTimers_)
-        timers_[iO] += Clock::now() - start;
-
-      ++iO;
     }
 
     if (pass) {
@@ -447,6 +616,7 @@ TagAndProbeSelector::setupSkim_(panda::EventMonophoton& _inEvent, bool _isMC)
   if (_isMC)
     blist += {"npvTrue"};
 
+  pruneBranches_(blist);
   _inEvent.book(*skimOut_, blist);
 
   // looseTags will be added by the TPMuonPhoton operator
@@ -454,6 +624,7 @@ TagAndProbeSelector::setupSkim_(panda::EventMonophoton& _inEvent, bool _isMC)
   if (outType_ == kTPEEG || outType_ == kTPMMG)
     blist += {"looseTags"};
 
+  pruneBranches_(blist);
   outEvent_->book(*skimOut_, blist);
 }
 
@@ -474,20 +645,10 @@ TagAndProbeSelector::selectEvent(panda::EventMonophoton& _event)
 
   outEvent_->sample = sampleId_;
 
-  Clock::time_point start;
-
   bool pass(true);
   for (unsigned iO(0); iO != operators_.size(); ++iO) {
-    auto& op(*operators_[iO]);
-
-    if (useTimers_)
-      start = Clock::now();
-
-    if (!op.exec(_event, *outEvent_))
+    if (!execOperator_(iO, _event, *outEvent_))
       pass = false;
-
-    if (useTimers_)
-      timers_[iO] += Clock::now() - start;
   }
 
   if (pass)
@@ -42,24 +42,59 @@ public:
   void setUseTimers(bool b) { useTimers_ = b; }
   void setPrintLevel(unsigned l, std::ostream* st = 0) { printLevel_ = l; if (st) stream_ = st; }
 
+  //! Output file layout. Negative / zero values keep the ROOT defaults.
+  /*!
+   * algorithm follows ROOT::ECompressionAlgorithm (1: zlib, 2: lzma, 4: lz4). autoFlush > 0 is a cluster size in
+   * entries, < 0 in bytes. Pruned branches are not booked in the skim even if they are on the default list.
+   */
+  void setCompression(int algorithm, int level) { compressionAlgorithm_ = algorithm; compressionLevel_ = level; }
+  void setBasketSize(int s) { basketSize_ = s; }
+  void setAutoFlush(Long64_t n) { autoFlush_ = n; }
+  void addPrunedBranch(char const* b) { prunedBranches_.emplace_back(b); }
+
+  //! Per-operator counters. Times are recorded only when timers are on.
+  struct OperatorStats {
+    unsigned long calls{0};
+    unsigned long passes{0};
+    Clock::duration time{0};
+    Clock::duration maxTime{0};
+  };
+
+  OperatorStats const& getOperatorStats(unsigned iO) const { return opStats_.at(iO); }
+
 protected:
   virtual void setupSkim_(panda::EventMonophoton& inEvent, bool isMC) {}
   virtual void addOutput_(TFile*& outputFile) {}
 
+  //! Execute operators_[iO] and update its counters
+  bool execOperator_(unsigned iO, panda::EventMonophoton const&, panda::EventBase&);
+  //! Write the operator counters as a tree "operators" in the current directory
+  void writeOperatorStats_();
+  //! Veto the pruned branches in the booking list
+  void pruneBranches_(panda::utils::BranchList&) const;
+
   TString name_;
   TTree* skimOut_{0};
   TTree* cutsOut_{0};
 
   std::vector<Operator*> operators_;
   bool ownOperators_{true};
+  // number of leading operators owned and initialized by another selector
+  unsigned nShared_{0};
 
   double inWeight_{1.};
 
   bool useTimers_{false};
-  std::vector<Clock::duration> timers_;
+  std::vector<OperatorStats> opStats_;
 
   TString preskim_{""};
 
+  int compressionAlgorithm_{-1};
+  int compressionLevel_{-1};
+  int basketSize_{0};
+  Long64_t autoFlush_{0};
+  std::vector<TString> prunedBranches_{};
+
   unsigned printLevel_{0};
   std::ostream* stream_{&std::cout};
 };
@@ -67,7 +102,7 @@ protected:
 class EventSelector : public EventSelectorBase {
 public:
   EventSelector(char const* name) : EventSelectorBase(name) {}
-  ~EventSelector() {}
+  ~EventSelector();
 
   void selectEvent(panda::EventMonophoton&) override;
 
@@ -75,14 +110,42 @@ public:
 
   void setPartialBlinding(unsigned prescale, unsigned minRun = 0) { blindPrescale_ = prescale; blindMinRun_ = minRun; }
 
+  //! Number of leading operators identical (same non-empty Operator::config) to those of the other selector
+  unsigned nCommonOperators(EventSelector const&) const;
+  //! Use the first nOps operators of source instead of the own ones. Must be called before initialize. No-op if already sharing.
+  /*!
+   * The source selector must process each event before this one. The shared operators run once per event,
+   * and this selector takes over the output event content and the cut results of the source.
+   */
+  void shareOperators(EventSelector& source, unsigned nOps);
+  unsigned getNShared() const { return nShared_; }
+
  protected:
   void setupSkim_(panda::EventMonophoton& event, bool isMC) override;
   void prepareFill_(panda::EventMonophoton&);
 
+  //! State of the output event after the first nOps operators, taken for the selectors sharing them
+  struct Snapshot {
+    unsigned nOps{0};
+    unsigned long event{0};
+    std::vector<bool> results{};
+    panda::EventMonophoton outEvent{};
+  };
+
+  void takeSnapshots_(unsigned nDone);
+  static void copyOutput_(panda::EventMonophoton const& source, panda::EventMonophoton& target);
+
   panda::EventMonophoton outEvent_;
 
   unsigned blindPrescale_{1};
   unsigned blindMinRun_{0};
+
+  unsigned long nEvents_{0};
+  std::vector<bool> opResults_{};
+
+  EventSelector* shareSource_{0};
+  std::vector<Operator*> replaced_{};
+  std::vector<Snapshot*> snapshots_{};
 };
 
 class ZeeEventSelector : public EventSelector {
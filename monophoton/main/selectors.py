@@ -2985,6 +2985,31 @@ def genBosonPtTruncator(minimum = 0., maximum = -1.):
 
     return addGenBosonPtCut
 
+def outputLayout(algorithm = '', level = -1, basketSize = 0, autoFlush = 0, prune = []):
+    """
+    Output file layout modifier. algorithm is one of zlib, lzma, and lz4. autoFlush > 0 is the cluster size in entries,
+    < 0 in bytes. Branches in prune are not written out.
+    """
+
+    algorithms = {'zlib': 1, 'lzma': 2, 'lz4': 4}
+
+    # older ROOT versions silently write with the global default for an unknown algorithm
+    if algorithm == 'lz4' and ROOT.gROOT.GetVersionInt() < 61000:
+        raise RuntimeError('LZ4 compression requires ROOT 6.10 or later')
+
+    def setLayout(sample, selector):
+        if algorithm:
+            selector.setCompression(algorithms[algorithm], level)
+        else:
+            selector.setCompression(-1, level)
+
+        selector.setBasketSize(basketSize)
+        selector.setAutoFlush(autoFlush)
+        for bname in prune:
+            selector.addPrunedBranch(bname)
+
+    return setLayout
+
 
 if needHelp:
     sys.argv.append('--help')
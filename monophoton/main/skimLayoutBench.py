@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""
+Rewrite a skim file with different output layouts (compression, basket size, auto-flush, pruned branches) and
+report the cost of writing against the read throughput of a plotting-like MultiDraw pass over the result.
+Use to check the layout settings in skimconfig.py.
+Layouts are given as ALGORITHM:LEVEL[:BASKETSIZE[:AUTOFLUSH]], e.g. lz4:4:65536:-30000000.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from argparse import ArgumentParser
+
+thisdir = os.path.dirname(os.path.realpath(__file__))
+basedir = os.path.dirname(thisdir)
+sys.path.append(basedir)
+
+argParser = ArgumentParser(description = 'Benchmark skim output layouts')
+argParser.add_argument('path', metavar = 'PATH', help = 'Skim file to rewrite.')
+argParser.add_argument('--layouts', '-l', metavar = 'LAYOUT', dest = 'layouts', nargs = '+', default = ['zlib:1', 'lzma:4', 'lz4:4', 'lz4:4:65536'], help = 'Layouts to compare.')
+argParser.add_argument('--prune', '-p', metavar = 'BRANCH', dest = 'prune', nargs = '+', default = [], help = 'Also compare each layout with these branches dropped.')
+argParser.add_argument('--expr', '-e', metavar = 'EXPR', dest = 'exprs', nargs = '+', default = ['t1Met.pt', 'photons.scRawPt[0]', 'TMath::Abs(TVector2::Phi_mpi_pi(photons.phi_[0] - t1Met.phi))', 'Sum$(jets.pt_ > 30.)'], help = 'Expressions to plot in the read test.')
+argParser.add_argument('--cut', '-c', metavar = 'CUT', dest = 'cut', default = 'photons.size > 0', help = 'Selection applied in the read test.')
+argParser.add_argument('--num-entries', '-n', metavar = 'N', dest = 'nentries', type = int, default = -1, help = 'Number of entries to copy.')
+argParser.add_argument('--repeat', '-r', metavar = 'N', dest = 'repeat', type = int, default = 3, help = 'Number of read passes per layout. The fastest pass is reported.')
+argParser.add_argument('--tmp-dir', '-t', metavar = 'PATH', dest = 'tmpDir', default = '', help = 'Directory for the rewritten files (default: system temporary directory).')
+
+args = argParser.parse_args()
+sys.argv = []
+
+import ROOT
+ROOT.gROOT.SetBatch(True)
+
+ROOT.gROOT.LoadMacro(basedir + '/../common/MultiDraw.cc+')
+
+ALGORITHMS = {'zlib': 1, 'lzma': 2, 'lz4': 4}
+
+def parseLayout(spec):
+    words = spec.split(':')
+    algorithm = ALGORITHMS[words[0]]
+    level = int(words[1])
+    basketSize = int(words[2]) if len(words) > 2 else 0
+    autoFlush = int(words[3]) if len(words) > 3 else 0
+
+    return algorithm, level, basketSize, autoFlush
+
+def rewrite(sourcePath, outPath, layout, prune):
+    """
+    Copy the events tree into outPath with the layout. Returns (CPU seconds, wall seconds) of the copy.
+    """
+
+    algorithm, level, basketSize, autoFlush = parseLayout(layout)
+
+    source = ROOT.TFile.Open(sourcePath)
+    tree = source.Get('events')
+
+    tree.SetBranchStatus('*', True)
+    for bname in prune:
+        tree.SetBranchStatus(bname + '*', False)
+
+    outFile = ROOT.TFile.Open(outPath, 'recreate')
+    outFile.SetCompressionSettings(algorithm * 100 + level)
+
+    # disabled branches are not cloned
+    outTree = tree.CloneTree(0)
+    if basketSize > 0:
+        outTree.SetBasketSize('*', basketSize)
+    if autoFlush != 0:
+        outTree.SetAutoFlush(autoFlush)
+
+    clock = ROOT.TStopwatch()
+    clock.Start()
+
+    outTree.CopyEntries(tree, args.nentries)
+    outFile.cd()
+    outTree.Write()
+    outFile.Close()
+
+    clock.Stop()
+    source.Close()
+
+    return clock.CpuTime(), clock.RealTime()
+
+def readPass(path):
+    """
+    Fill one histogram per expression in a single pass. Returns the wall seconds.
+    """
+
+    plotter = ROOT.MultiDraw()
+    plotter.addInputPath(path)
+    plotter.setWeightBranch('')
+    plotter.setBaseSelection(args.cut)
+
+    hists = []
+    for iE, expr in enumerate(args.exprs):
+        hist = ROOT.TH1D('h%d' % iE, '', 100, 0., 1000.)
+        hist.SetDirectory(0)
+        plotter.addPlot(hist, expr)
+        hists.append(hist)
+
+    start = time.time()
+    plotter.fillPlots()
+    elapsed = time.time() - start
+
+    return elapsed
+
+
+tmpDir = tempfile.mkdtemp(dir = args.tmpDir if args.tmpDir else None)
+
+candidates = [(layout, []) for layout in args.layouts]
+if len(args.prune) != 0:
+    candidates += [(layout, args.prune) for layout in args.layouts]
+
+results = []
+
+try:
+    for iC, (layout, prune) in enumerate(candidates):
+        outPath = tmpDir + '/layout%d.root' % iC
+
+        cpuTime, wallTime = rewrite(args.path, outPath, layout, prune)
+        size = os.path.getsize(outPath)
+
+        outFile = ROOT.TFile.Open(outPath)
+        nread = outFile.Get('events').GetEntries()
+        outFile.Close()
+
+        readTime = -1.
+        for _ in range(args.repeat):
+            elapsed = readPass(outPath)
+            if readTime < 0. or elapsed < readTime:
+                readTime = elapsed
+
+        if prune:
+            label = layout + ' -' + ','.join(prune)
+        else:
+            label = layout
+
+        results.append((label, cpuTime, wallTime, size, readTime, nread))
+
+        os.unlink(outPath)
+
+finally:
+    shutil.rmtree(tmpDir)
+
+print '%-40s %10s %10s %10s %10s %12s %10s' % ('layout', 'write CPU', 'write wall', 'size (MB)', 'read (s)', 'entries/s', 'MB/s')
+for label, cpuTime, wallTime, size, readTime, nread in results:
+    sizeMB = size / 1024. / 1024.
+    if readTime > 0.:
+        rate = nread / readTime
+        throughput = sizeMB / readTime
+    else:
+        rate = 0.
+        throughput = 0.
+
+    print '%-40s %10.2f %10.2f %10.1f %10.2f %12.0f %10.1f' % (label, cpuTime, wallTime, sizeMB, readTime, rate, throughput)
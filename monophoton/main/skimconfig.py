@@ -120,6 +120,12 @@ allSelectors_byPattern = [
     ('hbb-nlo-125', mc_sig)
 ]
 
+# {region: output layout} for regions that opt in to a non-default layout, e.g.
+# s.outputLayout(algorithm = 'zlib', level = 4, basketSize = 64 * 1024, prune = ['pfCandidates']).
+# Other regions keep the ROOT defaults. Add a region only together with the skimLayoutBench.py results
+# supporting it; lz4 requires a newer ROOT than the one in the current CMSSW release.
+regionLayouts = {}
+
 allSelectors = {}
 for pat, sels in allSelectors_byPattern:
     samples = allsamples.getmany(pat)
@@ -131,10 +137,15 @@ for pat, sels in allSelectors_byPattern:
         for sel in sels:
             # sel has to be either a selector function name or a tuple of form (region, selector[, modifiers])
             if type(sel) is str:
-                sampleSelectors[sel] = getattr(s, sel)
-            elif len(sel) == 2:
-                sampleSelectors[sel[0]] = sel[1]
+                sel = (sel, getattr(s, sel))
+
+            selgen = sel[1:]
+            if sel[0] in regionLayouts:
+                selgen += (regionLayouts[sel[0]],)
+
+            if len(selgen) == 1:
+                sampleSelectors[sel[0]] = selgen[0]
             else:
-                sampleSelectors[sel[0]] = sel[1:]
+                sampleSelectors[sel[0]] = selgen
             
         allSelectors[sample] = sampleSelectors
@@ -4,17 +4,65 @@ import sys
 import os
 import subprocess
 import collections
+import multiprocessing
+import json
+import fcntl
 
-from batch import BatchManager
-
-## load condor-run
-sys.path.append('/home/yiiyama/lib')
-from condor_run import CondorRun
+from batch import BatchManager, EXECUTORS
 
 logger = None
 
 padd = os.environ['CMSSW_BASE'] + '/bin/' + os.environ['SCRAM_ARCH'] + '/padd'
 
+class SkimManifest(object):
+    """
+    Record for one (sample, selector) of the input files (path, size, mtime) of each fileset that has been
+    skimmed, and of the filesets that are merged into the sample output.
+    Updates are done under a file lock, as skim jobs of the same sample run concurrently.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.skimmed = {} # {fileset: [[path, size, mtime]]}
+        self.merged = {} # {fileset: [[path, size, mtime]]}
+
+        self._read()
+
+    def _read(self):
+        try:
+            with open(self.path) as source:
+                content = json.load(source)
+        except (IOError, ValueError):
+            return
+
+        self.skimmed = content['skimmed']
+        self.merged = content['merged']
+
+    def _write(self):
+        tmpPath = self.path + '.%d' % os.getpid()
+        with open(tmpPath, 'w') as out:
+            json.dump({'skimmed': self.skimmed, 'merged': self.merged}, out, indent = 1, sort_keys = True)
+
+        os.rename(tmpPath, self.path)
+
+    def update(self, skimmed = {}, merged = {}):
+        """
+        Re-read the manifest, add the given records, and write it back.
+        """
+
+        with open(self.path + '.lock', 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            except IOError:
+                # file system without lock support
+                logger.warning('Could not lock %s.', self.path)
+
+            self._read()
+            self.skimmed.update(skimmed)
+            self.merged.update(merged)
+            self._write()
+
+
 class SkimSlimWeight(object):
 
     config = {}
@@ -52,6 +100,24 @@ class SkimSlimWeight(object):
             else:
                 return self.sample.name
 
+    def getManifest(self, rname):
+        return SkimManifest(SkimSlimWeight.config['skimDir'] + '/' + self.sample.name + '_' + rname + '.manifest')
+
+    def getInputRecord(self, fileset):
+        """
+        List of [path, size, mtime] of the input files of the fileset.
+        """
+
+        record = []
+        for path in sorted(self.sample.files([fileset])):
+            try:
+                stat = os.stat(path)
+                record.append([path, stat.st_size, int(stat.st_mtime)])
+            except OSError:
+                record.append([path, 0, 0])
+
+        return record
+
     def setupSkim(self):
         """
         Set up the skimmer, clean up the destination, request T2->T3 downloads if necessary.
@@ -79,6 +145,22 @@ class SkimSlimWeight(object):
             # check for missing local copies and issue a smartcache download request
             self.sample.download()
 
+        if SkimSlimWeight.config['incremental'] and not self.manual:
+            # skip filesets whose inputs have not changed since their last skim
+            manifests = dict((rname, self.getManifest(rname)) for rname in self.selectors)
+
+            for fileset in list(self.filesets):
+                record = self.getInputRecord(fileset)
+                outNameBase = self.getOutNameBase(fileset)
+
+                for rname, manifest in manifests.items():
+                    outPath = self.outDir + '/' + outNameBase + '_' + rname + '.root'
+                    if manifest.skimmed.get(fileset) != record or not os.path.exists(outPath):
+                        break
+                else:
+                    logger.info('Fileset %s of %s is up to date. Skipping skim.', fileset, self.sample.name)
+                    self.filesets.remove(fileset)
+
         if SkimSlimWeight.config['skipExisting']:
             logger.info('Checking for existing files.')
         else:
@@ -107,9 +189,9 @@ class SkimSlimWeight(object):
     
         return True
 
-    def executeSkim(self):
+    def makeSkimmer(self):
         """
-        Execute the skim.
+        Create a Skimmer and add freshly constructed selectors to it.
         """
 
         skimmer = ROOT.Skimmer()
@@ -117,6 +199,11 @@ class SkimSlimWeight(object):
         skimmer.setPrintEvery(SkimSlimWeight.config['printEvery'])
         skimmer.setPrintLevel(SkimSlimWeight.config['printLevel'])
         skimmer.setSkipMissingFiles(SkimSlimWeight.config['skipMissing'])
+        skimmer.setTwoPass(SkimSlimWeight.config['twoPass'])
+        skimmer.setCacheSize(SkimSlimWeight.config['cacheSize'] * 1024 * 1024)
+        skimmer.setCacheLearnEntries(SkimSlimWeight.config['cacheLearnEntries'])
+        skimmer.setPrintReadStats(SkimSlimWeight.config['readStats'])
+        skimmer.setShareOperators(SkimSlimWeight.config['shareOperators'])
 
         if SkimSlimWeight.config['openTimeout'] is not None:
             ROOT.TIMEOUT = SkimSlimWeight.config['openTimeout']
@@ -152,6 +239,23 @@ class SkimSlimWeight(object):
             logger.info('Good lumi filter: %s', SkimSlimWeight.config['json'])
             skimmer.setGoodLumiFilter(makeGoodLumiFilter(SkimSlimWeight.config['json']))
 
+        # selectors whose output depends on the full event sample cannot be split into entry ranges
+        splittable = not any(isinstance(skimmer.getSelector(i), ROOT.NormalizingSelector) for i in range(skimmer.numSelectors()))
+
+        return skimmer, splittable
+
+    def executeSkim(self):
+        """
+        Execute the skim.
+        """
+
+        skimmer, splittable = self.makeSkimmer()
+
+        nworkers = SkimSlimWeight.config['nworkers']
+        if nworkers > 1 and not splittable:
+            logger.warning('Sample %s has a normalizing selector. Running the skim in a single process.', self.sample.name)
+            nworkers = 1
+
         paths = {} # {filset: list of paths}
     
         if self.manual:
@@ -175,16 +279,20 @@ class SkimSlimWeight(object):
         for fileset, fnames in paths.items():
             print 'Fileset', fileset
 
-            skimmer.clearPaths()
-            for fname in fnames:
-                skimmer.addPath(fname)
-
             outNameBase = self.getOutNameBase(fileset)
             nentries = SkimSlimWeight.config['nentries']
             firstEntry = SkimSlimWeight.config['firstEntry']
+
+            if nworkers > 1:
+                self.executeParallelSkim(fnames, tmpOutDir, outNameBase, nentries, firstEntry, nworkers)
+
+            else:
+                skimmer.clearPaths()
+                for fname in fnames:
+                    skimmer.addPath(fname)
     
-            logger.debug('Skimmer.run(%s, %s, %s, %d, %d)', tmpOutDir, outNameBase, self.sample.data, nentries, firstEntry)
-            skimmer.run(tmpOutDir, outNameBase, self.sample.data, nentries, firstEntry)
+                logger.debug('Skimmer.run(%s, %s, %s, %d, %d)', tmpOutDir, outNameBase, self.sample.data, nentries, firstEntry)
+                skimmer.run(tmpOutDir, outNameBase, self.sample.data, nentries, firstEntry)
     
             for rname in self.selectors:
                 outName = outNameBase + '_' + rname + '.root'
@@ -197,6 +305,84 @@ class SkimSlimWeight(object):
                     logger.info('Removing %s/%s', tmpOutDir, outName)
                     os.remove(tmpOutDir + '/' + outName)
 
+            if SkimSlimWeight.config['incremental'] and not self.manual and not SkimSlimWeight.config['testRun']:
+                record = self.getInputRecord(fileset)
+                for rname in self.selectors:
+                    self.getManifest(rname).update(skimmed = {fileset: record})
+
+    def executeParallelSkim(self, fnames, tmpOutDir, outNameBase, nentries, firstEntry, nworkers):
+        """
+        Split the entry range of the fileset into nworkers contiguous blocks, skim each block in a forked
+        process with its own Skimmer, and merge the per-selector outputs in entry order.
+        """
+
+        chain = ROOT.TChain('events')
+        for fname in fnames:
+            chain.Add(fname)
+
+        lastEntry = chain.GetEntries()
+        if nentries >= 0:
+            lastEntry = min(lastEntry, firstEntry + nentries)
+
+        # ceil(nTotal / nworkers) entries per worker
+        blockSize = max((lastEntry - firstEntry + nworkers - 1) / nworkers, 1)
+
+        # run at least one block so that the selector outputs are always created
+        begins = range(firstEntry, lastEntry, blockSize) or [firstEntry]
+
+        workers = []
+        for begin in begins:
+            partNameBase = '%s_part%d' % (outNameBase, len(workers))
+            nblock = max(min(blockSize, lastEntry - begin), 0)
+
+            logger.debug('Skimmer.run(%s, %s, %s, %d, %d)', tmpOutDir, partNameBase, self.sample.data, nblock, begin)
+
+            proc = multiprocessing.Process(target = self.executeSkimRange, args = (fnames, tmpOutDir, partNameBase, nblock, begin))
+            proc.start()
+            workers.append((partNameBase, proc))
+
+        logger.info('Skimming %d entries in %d processes.', lastEntry - firstEntry, len(workers))
+
+        failed = []
+        for partNameBase, proc in workers:
+            proc.join()
+            if proc.exitcode != 0:
+                failed.append(partNameBase)
+
+        if len(failed) != 0:
+            raise RuntimeError('Skim failed for %s' % ', '.join(failed))
+
+        for rname in self.selectors:
+            outName = outNameBase + '_' + rname + '.root'
+            partPaths = [tmpOutDir + '/' + partNameBase + '_' + rname + '.root' for partNameBase, _ in workers]
+
+            if len(partPaths) == 1:
+                os.rename(partPaths[0], tmpOutDir + '/' + outName)
+                continue
+
+            logger.debug('%s %s %s', padd, tmpOutDir + '/' + outName, ' '.join(partPaths))
+            proc = subprocess.Popen([padd, tmpOutDir + '/' + outName] + partPaths, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+            out, err = proc.communicate()
+            print out.strip()
+            print err.strip()
+
+            if proc.returncode != 0:
+                raise RuntimeError('Merge failed for %s' % outName)
+
+            for path in partPaths:
+                os.remove(path)
+
+    def executeSkimRange(self, fnames, tmpOutDir, outNameBase, nentries, firstEntry):
+        """
+        Worker process body for executeParallelSkim.
+        """
+
+        skimmer, _ = self.makeSkimmer()
+        for fname in fnames:
+            skimmer.addPath(fname)
+
+        skimmer.run(tmpOutDir, outNameBase, self.sample.data, nentries, firstEntry)
+
     def setupMerge(self):
         if not os.path.exists(self.tmpDir):
             try:
@@ -216,7 +402,8 @@ class SkimSlimWeight(object):
                     logger.info('Output files for %s already exist. Skipping merge.', outNameBase)
                     self.selectors.pop(rname)
 
-            elif not SkimSlimWeight.config['testRun']:
+            elif not SkimSlimWeight.config['testRun'] and not SkimSlimWeight.config['incremental']:
+                # incremental merges append to the existing output
                 try:
                     os.remove(outPath)
                 except:
@@ -246,12 +433,32 @@ class SkimSlimWeight(object):
         
             mergePath = self.tmpDir + '/' + outName
             outPath = SkimSlimWeight.config['skimDir'] + '/' + outName
-        
-            logger.debug('%s %s %s', padd, mergePath, ' '.join(inDir + '/' + self.sample.name + '_' + fileset + '_' + rname + '.root' for fileset in self.filesets))
-            proc = subprocess.Popen([padd, mergePath] + [inDir + '/' + self.sample.name + '_' + fileset + '_' + rname + '.root' for fileset in self.filesets], stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+
+            inputs = [inDir + '/' + self.sample.name + '_' + fileset + '_' + rname + '.root' for fileset in self.filesets]
+
+            if SkimSlimWeight.config['incremental']:
+                manifest = self.getManifest(rname)
+                merged = dict((fileset, manifest.skimmed.get(fileset)) for fileset in self.filesets)
+
+                if os.path.exists(outPath) and len(manifest.merged) != 0 and all(manifest.skimmed.get(fileset) == record for fileset, record in manifest.merged.items()):
+                    # no merged fileset was re-skimmed -> append the new fragments to the existing output
+                    newFilesets = [fileset for fileset in self.filesets if fileset not in manifest.merged]
+                    if len(newFilesets) == 0:
+                        logger.info('%s is up to date. Skipping merge.', outName)
+                        continue
+
+                    logger.info('Appending %d filesets to %s', len(newFilesets), outName)
+                    inputs = [outPath] + [inDir + '/' + self.sample.name + '_' + fileset + '_' + rname + '.root' for fileset in newFilesets]
+                    merged.update(manifest.merged)
+
+            logger.debug('%s %s %s', padd, mergePath, ' '.join(inputs))
+            proc = subprocess.Popen([padd, mergePath] + inputs, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
             out, err = proc.communicate()
             print out.strip()
             print err.strip()
+
+            if proc.returncode != 0:
+                raise RuntimeError('Merge failed', outName)
         
             if SkimSlimWeight.config['testRun']:
                 logger.info('Output at %s', mergePath)
@@ -261,16 +468,19 @@ class SkimSlimWeight(object):
                 logger.info('Removing %s', mergePath)
                 os.remove(mergePath)
 
+                if SkimSlimWeight.config['incremental']:
+                    manifest.update(merged = merged)
+
 
 class SSWBatchManager(BatchManager):
-    def __init__(self, ssws):
-        BatchManager.__init__(self, 'ssw2')
+    def __init__(self, ssws, executor = 'condor'):
+        BatchManager.__init__(self, 'ssw2', executor)
 
         self.ssws = ssws # list of SlimSkimWeight objects to manage
         self.catalogDir = ''
 
     def submitMerge(self, args):
-        submitter = CondorRun(os.path.realpath(__file__))
+        submitter = self._makeSubmitter(os.path.realpath(__file__))
         submitter.requirements = 'OpSysAndVer == "SL6" && UidDomain == "mit.edu"'
 
         arguments = []
@@ -292,13 +502,16 @@ class SSWBatchManager(BatchManager):
         if self.catalogDir:
             argTemplate += ' -c ' + self.catalogDir
 
+        if args.incremental:
+            argTemplate += ' -I'
+
         submitter.job_args = [argTemplate % arg for arg in arguments]
         submitter.job_names = ['%s_%s' % arg for arg in arguments]
 
         self._submit(submitter, 'merge', argTemplate, args.noWait, args.autoResubmit)
 
     def submitSkim(self, args):
-        submitter = CondorRun(os.path.realpath(__file__))
+        submitter = self._makeSubmitter(os.path.realpath(__file__))
         submitter.requirements = 'OpSysAndVer == "SL6" && UidDomain == "mit.edu"'
 
         argTemplate = '%s -f %s'
@@ -315,6 +528,27 @@ class SSWBatchManager(BatchManager):
         if args.openTimeout is not None:
             argTemplate += ' -m ' + str(args.openTimeout)
 
+        if args.timer:
+            argTemplate += ' -T'
+
+        if args.twoPass:
+            argTemplate += ' -P'
+
+        if args.cacheSize != 0:
+            argTemplate += ' -Z ' + str(args.cacheSize)
+
+        if args.cacheLearnEntries >= 0:
+            argTemplate += ' -l ' + str(args.cacheLearnEntries)
+
+        if args.readStats:
+            argTemplate += ' -O'
+
+        if args.shareOperators:
+            argTemplate += ' -H'
+
+        if args.incremental:
+            argTemplate += ' -I'
+
         for ssw in self.ssws:
             for fileset in ssw.filesets:
                 submitter.job_args.append(argTemplate % (ssw.sample.name, fileset) + ' -s ' + ' '.join(ssw.selectors.keys()))
@@ -354,6 +588,7 @@ if __name__ == '__main__':
     argParser.add_argument('--first-entry', '-t', metavar = 'ENTRY', dest = 'firstEntry', type = int, default = 0, help = 'First entry number to process.')
     argParser.add_argument('--suffix', '-x', metavar = 'SUFFIX', dest = 'outSuffix', default = '', help = 'Output file suffix.')
     argParser.add_argument('--batch', '-B', action = 'store_true', dest = 'batch', help = 'Use condor-run to run.')
+    argParser.add_argument('--executor', '-b', metavar = 'NAME', dest = 'executor', choices = EXECUTORS, default = 'condor', help = '(With batch option) Job executor. "local" runs the batch jobs in a process pool on this machine.')
     argParser.add_argument('--skip-existing', '-X', action = 'store_true', dest = 'skipExisting', help = 'Do not run skims on files that already exist.')
     argParser.add_argument('--merge', '-M', action = 'store_true', dest = 'merge', help = 'Merge the fragments without running any skim jobs.')
     argParser.add_argument('--selectors', '-s', metavar = 'SELNAME', dest = 'selnames', nargs = '*', default = None, help = 'Selectors to process. With --list, print the selectors configured with the samples.')
@@ -364,6 +599,13 @@ if __name__ == '__main__':
     argParser.add_argument('--resubmit', '-S', action = 'store_true', dest = 'autoResubmit', help = '(Without no-wait option) Automatically release held jobs.')
     argParser.add_argument('--skip-missing', '-K', action = 'store_true', dest = 'skipMissing', help = 'Skip missing files in skim.')
     argParser.add_argument('--open-timeout', '-m', metavar = 'SECONDS', dest = 'openTimeout', type = int, help = 'Timeout for opening input files. Open is attempted every 30 seconds.')
+    argParser.add_argument('--num-workers', '-J', metavar = 'N', dest = 'nworkers', type = int, default = 1, help = '(Without batch option) Split the entries of each fileset across N local skim processes.')
+    argParser.add_argument('--two-pass', '-P', action = 'store_true', dest = 'twoPass', help = 'Scan the preskim branches first and read the full event only for the preselected entries.')
+    argParser.add_argument('--cache-size', '-Z', metavar = 'MB', dest = 'cacheSize', type = int, default = 0, help = 'Input TTreeCache size in MB. 0 for ROOT default.')
+    argParser.add_argument('--cache-learn-entries', '-l', metavar = 'N', dest = 'cacheLearnEntries', type = int, default = -1, help = 'Number of cache learning entries. 0 to register the read branches directly. Negative for ROOT default.')
+    argParser.add_argument('--read-stats', '-O', action = 'store_true', dest = 'readStats', help = 'Print per-file input read statistics at the end of the skim.')
+    argParser.add_argument('--share-operators', '-H', action = 'store_true', dest = 'shareOperators', help = 'Run identical leading operators of the selectors once per event (experimental; output equivalence with unshared skims not yet verified).')
+    argParser.add_argument('--incremental', '-I', action = 'store_true', dest = 'incremental', help = 'Skim only the filesets whose input files changed since the last skim, and append new fragments to the existing merged output.')
     argParser.add_argument('--test-run', '-E', action = 'store_true', dest = 'testRun', help = 'Don\'t copy the output files to the production area. Sets --filesets to 0000 by default.')
     
     args = argParser.parse_args()
@@ -521,7 +763,7 @@ if __name__ == '__main__':
         ## job submission only
         print 'Submitting jobs.'
        
-        batchManager = SSWBatchManager(ssws)
+        batchManager = SSWBatchManager(ssws, args.executor)
         if args.catalog:
             batchManager.catalogDir = args.catalog
 
@@ -11,7 +11,10 @@ import array
 import shutil
 import string
 import random
+import hashlib
+import sqlite3
 import subprocess
+import multiprocessing
 import mysql.connector as mc
 from argparse import ArgumentParser
     
@@ -24,6 +27,8 @@ argParser.add_argument('--log', '-l', metavar = 'PATH', dest = 'logdir', default
 argParser.add_argument('--num-merge', '-n', metavar = 'N', dest = 'nmerge', type = int, default = 50, help = 'Number of input files per output.')
 argParser.add_argument('--num-out', '-o', metavar = 'N', dest = 'nout', type = int, default = 0, help = 'Number of output files to make. 0 = continue until all input are consumed.')
 argParser.add_argument('--edm', '-E', action = 'store_true', dest = 'edm', help = 'Merge EDM input using cmsRun merge.py.')
+argParser.add_argument('--jobs', '-j', metavar = 'N', dest = 'njobs', type = int, default = 1, help = 'Number of outputs written concurrently. Also the number of processes validating the inputs.')
+argParser.add_argument('--fingerprint-db', '-f', metavar = 'PATH', dest = 'fpdb', default = '', help = 'SQLite file caching the input file fingerprints. Default (logdir)/fingerprints.db.')
 
 args = argParser.parse_args()
 sys.argv = []
@@ -57,57 +62,110 @@ def rm(infile, path = ''):
     else:
         os.unlink(path)
 
-def opensanitize(path):
+def fingerprint(path):
+    """
+    Validate the file and compute its fingerprint (status, number of events, SHA-1 of the run/lumi/event numbers).
+    status is 'ok', 'corrupt', or 'incomplete'. Module-level function to be used in a multiprocessing pool.
+    """
+
     infile = ROOT.TFile.Open(path)
     if not infile or infile.IsZombie():
-        print path, 'is corrupt'
-        rm(infile, path)
-        return None
+        return path, ('corrupt', 0, '')
 
     if set(key.GetName() for key in infile.GetListOfKeys()) != keynames:
-        print path, 'is incomplete'
-        rm(infile)
-        return None
+        infile.Close()
+        return path, ('incomplete', 0, '')
 
     if args.edm:
         inevents = infile.Get('Events')
+        idexpr = 'EventAuxiliary.run():EventAuxiliary.luminosityBlock():EventAuxiliary.event()'
     else:
         inevents = infile.Get('events')
+        idexpr = 'runNumber:lumiNumber:eventNumber'
 
     if not inevents:
-        print path, 'is incomplete'
-        rm(infile)
-        return None
+        infile.Close()
+        return path, ('incomplete', 0, '')
 
-    # nin = inevents.GetEntries()
+    nentries = inevents.GetEntries()
 
-    # if nin == 0:
-    #     print path, 'is empty'
-    #     rm(infile)
-    #     return None
+    digest = hashlib.sha1()
+    if nentries != 0:
+        inevents.SetEstimate(nentries + 1)
+        inevents.Draw(idexpr, '', 'goff')
+        for values in [inevents.GetV1(), inevents.GetV2(), inevents.GetV3()]:
+            values.SetSize(nentries)
+            digest.update(array.array('d', values).tostring())
 
-    return infile, inevents
+    infile.Close()
 
-def distinct(events1, events2):
-    if events1.GetEntries() != events2.GetEntries():
-        return True
+    return path, ('ok', nentries, digest.hexdigest())
 
-    if args.edm:
-        events1.Draw('recoGenParticles_prunedGenParticles__PAT.product().pdgId()', '', 'goff')
-        events2.Draw('recoGenParticles_prunedGenParticles__PAT.product().pdgId()', '', 'goff')
+class FingerprintCache(object):
+    """
+    Fingerprints of the input files keyed by path, valid while the file size and mtime do not change.
+    """
 
-        result = events1.GetV1()[3] != events2.GetV1()[3] or events1.GetV1()[10] != events2.GetV1()[10] or events1.GetV1()[15] != events2.GetV1()[15]
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, timeout = 60.)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS `fingerprints` (`path` TEXT PRIMARY KEY, `size` INTEGER, `mtime` REAL, `status` TEXT, `entries` INTEGER, `digest` TEXT)')
+        self._conn.commit()
 
-    else:
-        events1.Draw('genParticles.size', '', 'goff')
-        events2.Draw('genParticles.size', '', 'goff')
+    def get(self, paths, pool = None):
+        """
+        Return {path: fingerprint}. Missing or outdated entries are computed (in the pool if given).
+        """
+
+        result = {}
+        missing = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                result[path] = ('corrupt', 0, '')
+                continue
+
+            row = self._conn.execute('SELECT `status`, `entries`, `digest` FROM `fingerprints` WHERE `path` = ? AND `size` = ? AND `mtime` = ?', (path, stat.st_size, stat.st_mtime)).fetchone()
+            if row is None:
+                missing.append(path)
+            else:
+                result[path] = (str(row[0]), row[1], str(row[2]))
+
+        if pool is not None and len(missing) > 1:
+            computed = pool.map(fingerprint, missing, chunksize = 1)
+        else:
+            computed = map(fingerprint, missing)
+
+        for path, fp in computed:
+            result[path] = fp
+            self.put(path, fp)
 
-        result = events1.GetV1()[0] != events2.GetV1()[0]
+        return result
 
-    if not result:
-        print events1.GetCurrentFile().GetName(), 'and', events2.GetCurrentFile().GetName(), 'may be identical'
+    def put(self, path, fp):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
 
-    return result
+        self._conn.execute('INSERT OR REPLACE INTO `fingerprints` VALUES (?, ?, ?, ?, ?, ?)', (path, stat.st_size, stat.st_mtime) + tuple(fp))
+        self._conn.commit()
+
+    def remove(self, path):
+        self._conn.execute('DELETE FROM `fingerprints` WHERE `path` = ?', (path,))
+        self._conn.commit()
+
+def distinct(path1, fp1, path2, fp2):
+    """
+    Files are duplicates if they have the same number of events with identical event ids.
+    """
+
+    if fp1 != fp2:
+        return True
+
+    print path1, 'and', path2, 'are identical'
+
+    return False
 
 def writepanda(inpaths, outfname):
     output = ROOT.TFile.Open(outfname, 'recreate')
@@ -116,8 +174,9 @@ def writepanda(inpaths, outfname):
     for inpath in inpaths:
         chain.Add(inpath)
 
+    # fast cloning copies the compressed baskets without unpacking them
     output.cd()
-    events = chain.CloneTree()
+    events = chain.CloneTree(-1, 'fast')
     events.Write()
     chain = None
 
@@ -126,7 +185,7 @@ def writepanda(inpaths, outfname):
         chain.Add(inpath)
 
     output.cd()
-    lumiSummary = chain.CloneTree()
+    lumiSummary = chain.CloneTree(-1, 'fast')
     lumiSummary.Write()
     chain = None
 
@@ -224,106 +283,185 @@ class SynchDB(object):
             self.dbconn = None
 
 
-iout = 0
+def writeGroup(job):
+    """
+    Merge one output group. Module-level function to be used in a multiprocessing pool.
+    """
 
-while True:
-    if iout == args.nout:
-        break
+    inpaths, outfname = job
 
-    while True:
-        outbase = ''.join(random.sample(string.hexdigits, 16)) + '.root'
-        outname = args.outdir + '/' + outbase
-        if not os.path.exists(outname):
-            break
+    if args.edm:
+        return writeedm(inpaths, outfname)
+    else:
+        return writepanda(inpaths, outfname)
 
-    db = SynchDB()
+def postFiles(fname):
+    if not args.postdir:
+        return []
 
-    try:
-        inpaths = []
-        unused = []
-        for fname in os.listdir(args.indir):
-            inpath = args.indir + '/' + fname
+    dname = args.postdir + '/' + fname.replace('.root', '')
+    pnames = []
+    if os.path.isdir(dname):
+        for pname in os.listdir(dname):
+            pnames.append(dname + '/' + pname)
+
+    elif os.path.exists(args.postdir + '/' + fname):
+        pnames.append(args.postdir + '/' + fname)
+
+    return pnames
+
+def collectInputs(db, outname, candidates):
+    """
+    Claim files from candidates (consumed from the front) for outname until args.nmerge valid and distinct inputs
+    are found. Files are claimed in batches whose fingerprints are computed in the pool.
+    Returns (list of inputs, list of unused claimed files).
+    """
+
+    inpaths = []
+    unused = []
+
+    while len(inpaths) < args.nmerge and len(candidates) != 0:
+        claimed = []
+
+        db.connect()
+
+        while len(claimed) < args.nmerge - len(inpaths) and len(candidates) != 0:
+            inpath = candidates.pop(0)
 
-            do_open = False
-    
-            db.connect()
-    
             if os.path.exists(inpath) and os.stat(inpath).st_mtime < time.time() - 300:
                 db.execute('SELECT COUNT(*) FROM `inputs` WHERE `path` = %s', inpath)
                 if db.cursor.fetchall()[0][0] == 0:
                     db.execute('INSERT INTO `inputs` VALUES (%s, %s)', inpath, outname)
-                    do_open = True
-    
-            db.close()
-    
-            if not do_open:
-                continue
+                    claimed.append(inpath)
+
+        db.close()
+
+        pnames = dict((inpath, postFiles(os.path.basename(inpath))) for inpath in claimed)
 
-            instuff = opensanitize(inpath)
-            if not instuff:
+        fingerprints = fpcache.get(claimed + sum(pnames.values(), []), pool)
+
+        for inpath in claimed:
+            status = fingerprints[inpath][0]
+            if status != 'ok':
+                print inpath, 'is', status
+                rm(None, inpath)
+                fpcache.remove(inpath)
                 unused.append(inpath)
                 continue
 
-            infile, inevents = instuff
-    
-            if args.postdir:
-                dname = args.postdir + '/' + fname.replace('.root', '')
-                pnames = []
-                if os.path.isdir(dname):
-                    for pname in os.listdir(dname):
-                        pnames.append(dname + '/' + pname)
+            isdistinct = True
 
-                elif os.path.exists(args.postdir + '/' + fname):
-                    pnames.append(args.postdir + '/' + fname)
+            for pname in pnames[inpath]:
+                if fingerprints[pname][0] != 'ok':
+                    print pname, 'is', fingerprints[pname][0]
+                    rm(None, pname)
+                    fpcache.remove(pname)
+                    continue
 
-                isdistinct = True
+                if not distinct(inpath, fingerprints[inpath], pname, fingerprints[pname]):
+                    isdistinct = False
+                    rm(None, inpath)
+                    fpcache.remove(inpath)
+                    break
 
-                for pname in pnames:
-                    pstuff = opensanitize(pname)
-                    if not pstuff:
-                        continue
+            if not isdistinct:
+                continue
 
-                    pfile, pevents = pstuff
+            print '-->', inpath
+            inpaths.append(inpath)
 
-                    if not distinct(inevents, pevents):
-                        isdistinct = False
-                        rm(infile)
+    return inpaths, unused
 
-                    pfile.Close()
-                    if not isdistinct:
-                        break
+def uniqueOutname():
+    while True:
+        outbase = ''.join(random.sample(string.hexdigits, 16)) + '.root'
+        outname = args.outdir + '/' + outbase
+        if not os.path.exists(outname):
+            return outbase
 
-                if not isdistinct:
-                    continue
 
-            infile.Close()
-    
-            print '-->', inpath
-            inpaths.append(inpath)
-    
-            if len(inpaths) == args.nmerge:
+# pool is forked before any database connection is opened
+pool = multiprocessing.Pool(max(args.njobs, 1))
+
+if args.fpdb:
+    fpcache = FingerprintCache(args.fpdb)
+else:
+    fpcache = FingerprintCache(args.logdir + '/fingerprints.db')
+
+iout = 0
+# input directory listing at the last "too few files" pass
+lastListing = None
+
+while True:
+    if args.nout != 0 and iout >= args.nout:
+        break
+
+    if args.nout != 0:
+        nslots = min(args.njobs, args.nout - iout)
+    else:
+        nslots = args.njobs
+
+    outbases = []
+    for _ in range(nslots):
+        outbase = uniqueOutname()
+        while outbase in outbases:
+            outbase = uniqueOutname()
+        outbases.append(outbase)
+
+    db = SynchDB()
+
+    try:
+        listing = sorted(os.listdir(args.indir))
+        candidates = [args.indir + '/' + fname for fname in listing]
+
+        # [(outbase, inpaths)]
+        groups = []
+        unused = []
+        for outbase in outbases:
+            inpaths, groupUnused = collectInputs(db, args.outdir + '/' + outbase, candidates)
+            unused.extend(groupUnused)
+
+            if len(inpaths) == 0:
                 break
-    
-        if len(inpaths) == 0:
+
+            groups.append((outbase, inpaths))
+
+        if len(groups) == 0:
             break
 
-        elif len(inpaths) < args.nmerge / 2:
+        # a partial group is only written if it is at least half full; its claims are released otherwise
+        filled = [(outbase, inpaths) for outbase, inpaths in groups if len(inpaths) >= args.nmerge / 2]
+
+        if len(filled) != 0:
+            groups = filled
+        elif listing != lastListing:
             print 'Too few files to merge. Sleeping for 5 minutes.'
+            lastListing = listing
             time.sleep(300)
             iout += 1
             continue
-    
-        if args.edm:
-            success = writeedm(inpaths, '/tmp/' + outbase)
         else:
-            success = writepanda(inpaths, '/tmp/' + outbase)
+            # no input arrived while sleeping; merge the remainder
+            print 'No new input files. Merging the remaining', sum(len(inpaths) for _, inpaths in groups), 'files.'
+
+        # output groups are written concurrently
+        jobs = [(inpaths, '/tmp/' + outbase) for outbase, inpaths in groups]
+        if len(jobs) > 1:
+            results = pool.map(writeGroup, jobs, chunksize = 1)
+        else:
+            results = map(writeGroup, jobs)
+
+        for (outbase, inpaths), success in zip(groups, results):
+            if not success:
+                continue
+
+            outname = args.outdir + '/' + outbase
 
-        if success:
             print outname
             shutil.copy('/tmp/' + outbase, outname)
 
             db.connect()
-    
+
             for inpath in inpaths:
                 if args.postdir:
                     fname = os.path.basename(inpath)
@@ -331,30 +469,44 @@ while True:
                     pname = args.postdir + '/' + fname
                     if os.path.isdir(pdirname):
                         idx = len(os.listdir(pdirname))
-                        os.rename(inpath, pdirname + ('/%d_%s' % (idx, fname)))
+                        newpaths = [(inpath, pdirname + ('/%d_%s' % (idx, fname)))]
                     elif os.path.exists(pname):
                         os.mkdir(pdirname)
-                        os.rename(pname, pdirname + '/0_' + fname)
-                        os.rename(inpath, pdirname + '/1_' + fname)
+                        newpaths = [(pname, pdirname + '/0_' + fname), (inpath, pdirname + '/1_' + fname)]
                     else:
-                        os.rename(inpath, pname)
+                        newpaths = [(inpath, pname)]
+
+                    # fingerprints follow the renamed files (rename keeps size and mtime)
+                    fps = fpcache.get([src for src, _ in newpaths])
+                    for src, dest in newpaths:
+                        os.rename(src, dest)
+                        fpcache.put(dest, fps[src])
+                        fpcache.remove(src)
     
                 else:
                     os.unlink(inpath)
+                    fpcache.remove(inpath)
 
-            for path in unused:
-                db.execute('DELETE FROM `inputs` WHERE `path` = %s', path)
-    
             db.execute('INSERT INTO `logs` SELECT * FROM `inputs` WHERE `outpath` = %s', outname)
             db.close()
 
+            iout += 1
+
+        db.connect()
+        for path in unused:
+            db.execute('DELETE FROM `inputs` WHERE `path` = %s', path)
+        db.close()
+
     finally:
         db.close()
         db.connect()
-        db.execute('DELETE FROM `inputs` WHERE `outpath` = %s', outname)
+        for outbase in outbases:
+            db.execute('DELETE FROM `inputs` WHERE `outpath` = %s', args.outdir + '/' + outbase)
         db.close()
 
-        if os.path.exists('/tmp/' + outbase):
-            os.unlink('/tmp/' + outbase)
+        for outbase in outbases:
+            if os.path.exists('/tmp/' + outbase):
+                os.unlink('/tmp/' + outbase)
 
-    iout += 1
+pool.close()
+pool.join()
@@ -4,6 +4,7 @@ import os
 import sys
 import collections
 import time
+import multiprocessing
 import ROOT
 
 thisdir = os.path.dirname(os.path.realpath(__file__))
@@ -30,6 +31,9 @@ QUICKFIT = False # just run one main fit
 FORCEHIST = True # redraw input histograms
 ITERATIVE = False # use iterative method instead of SignalSubtraction.cc
 DOTOYS = True
+NTOYWORKERS = 8 # toy fits run in a process pool; 1 for sequential
+TOYPLOTEVERY = 0 # save the toy histogram of every Nth toy; 0 for no toy plots
+TOYSEED = 12345 # toy i is generated with seed TOYSEED + i
 
 ### take inputs and make sure they match a selection
 loc = sys.argv[1] # barrel, endcap
@@ -421,6 +425,39 @@ print '\n'
 
 NTOYS = 200
 
+def runToy(iToy):
+    """
+    Generate and fit one background template toy. Returns (iToy, purity difference, yield difference).
+    Module-level function to be used in a multiprocessing pool; each worker process has its own SSFitter.
+    """
+
+    print "\n###############\n#### Toy "+str(iToy)+" ####\n###############\n"
+
+    # seeds depend only on the toy index so results do not depend on the number of workers
+    ROOT.gRandom.SetSeed(TOYSEED + iToy)
+
+    toyHist = hDataBkgNom.Clone('toyhist%d' % iToy)
+    toyHist.Reset()
+    toyHist.FillRandom(hDataBkgNom, eventsToGenerate)
+
+    if TOYPLOTEVERY > 0 and iToy % TOYPLOTEVERY == 0:
+        toyHist.Draw()
+
+        tempName = os.path.join(toysDir, 'toy%d' % iToy)
+        canvas.SaveAs(tempName+'.pdf')
+        canvas.SaveAs(tempName+'.png')
+        canvas.SaveAs(tempName+'.C')
+
+    toyResult = runSSFit(toyHist, hMCSBNom, nominalRatio, 'toy%d' % iToy, pdir = toysDir)
+
+    purityDiff = toyResult.purity - nominalResult.purity
+    print "Purity diff is:", purityDiff
+
+    yieldDiff = toyResult.nReal - nominalResult.nReal
+    print "Yield diff is:", yieldDiff
+
+    return (iToy, purityDiff, yieldDiff)
+
 if DOTOYS:
     ### Get background stat uncertainty
     toyPlot = ROOT.TH1F("toyplot","Impurity Difference from Background Template Toys", 200, -0.010, 0.010)
@@ -432,28 +469,21 @@ if DOTOYS:
     eventsToGenerate = int(hDataBkgNom.GetSumOfWeights())
     print eventsToGenerate
 
-    for iToy in range(1, NTOYS + 1):
-        print "\n###############\n#### Toy "+str(iToy)+" ####\n###############\n"
-
-        toyHist = hDataBkgNom.Clone('toyhist')
-        toyHist.Reset()
-        toyHist.FillRandom(hDataBkgNom, eventsToGenerate)
-
-        toyHist.Draw()
+    start = time.time()
 
-        tempName = os.path.join(toysDir, 'toy%d' % iToy)
-        canvas.SaveAs(tempName+'.pdf')
-        canvas.SaveAs(tempName+'.png')
-        canvas.SaveAs(tempName+'.C')
+    if NTOYWORKERS > 1:
+        # workers are forked with the templates and the nominal result in memory
+        pool = multiprocessing.Pool(NTOYWORKERS)
+        toyResults = pool.map(runToy, range(1, NTOYS + 1), chunksize = 1)
+        pool.close()
+        pool.join()
+    else:
+        toyResults = map(runToy, range(1, NTOYS + 1))
 
-        toyResult = runSSFit(toyHist, hMCSBNom, nominalRatio, 'toy%d' % iToy, pdir = toysDir)
+    print 'Took', (time.time() - start), 'seconds to run', NTOYS, 'toys'
 
-        purityDiff = toyResult.purity - nominalResult.purity
-        print "Purity diff is:", purityDiff
+    for iToy, purityDiff, yieldDiff in sorted(toyResults):
         toyPlot.Fill(purityDiff)
-
-        yieldDiff = toyResult.nReal - nominalResult.nReal
-        print "Yield diff is:", yieldDiff
         toyPlotYield.Fill(yieldDiff)
 
     bkgdUncertainty = toyPlot.GetStdDev()
@@ -12,6 +12,12 @@ import array
 
 test = False
 
+# findSpikes.py [--local] SAMPLE.. runs the jobs on this machine instead of condor
+executor = 'condor'
+if sys.argv[1] == '--local':
+    executor = 'local'
+    sys.argv.pop(1)
+
 if sys.argv[1] == 'skim':
     task = 'skim'
     sname = sys.argv[2]
@@ -33,11 +39,12 @@ if task == 'submit':
     except OSError:
         pass
 
-    sys.path.append('/home/yiiyama/lib')
-    from condor_run import CondorRun
+    sys.path.append(basedir + '/main')
+    from batch import makeSubmitter
     
-    submitter = CondorRun(os.path.realpath(__file__))
-    submitter.logdir = '/local/' + os.environ['USER']
+    submitter = makeSubmitter(os.path.realpath(__file__), executor)
+    if executor == 'condor':
+        submitter.logdir = '/local/' + os.environ['USER']
     submitter.hold_on_fail = True
     submitter.min_memory = 1
 
@@ -56,6 +63,11 @@ if task == 'submit':
             
         submitter.submit(name = 'findSpikes')
 
+    if executor == 'local':
+        failed = submitter.wait()
+        if len(failed) != 0:
+            print 'Failed jobs:', ' '.join(failed)
+
 elif task == 'skim':
     import ROOT
 
@@ -5,6 +5,7 @@ import os
 import array
 import math
 import shutil
+import multiprocessing
 
 thisdir = os.path.dirname(os.path.realpath(__file__))
 basedir = os.path.dirname(thisdir)
@@ -20,6 +21,9 @@ binningName = sys.argv[2] # see efake_conf
 
 fitBins = getBinning(binningName)[2]
 
+NWORKERS = 8 # bins are fitted in a process pool; 1 to fit in this process (same results for any value)
+WARMCHAIN = 1 # bins are fitted in chains of WARMCHAIN consecutive bins, each starting from the converged parameters of the previous one; 1 for no warm starts
+
 lumi = sum(allsamples[s].lumi for s in lumiSamples)
 
 efake_plot.lumi = lumi
@@ -48,8 +52,6 @@ if os.path.exists(inputName):
     # copy input to local area
     shutil.copy(inputName, tmpInName)
 
-inputFile = ROOT.TFile.Open(tmpInName, 'READ')
-
 outputName = outputDir + '/fityields_' + dataType + '_' + binningName + '.root'
 
 tmpOutName = '/tmp/' + os.environ['USER'] + '/efake/' + os.path.basename(outputName)
@@ -62,8 +64,6 @@ if os.path.exists(outputName):
     # make a backup
     shutil.copy(outputName, outputName.replace('.root', '_old.root'))
 
-outputFile = ROOT.TFile.Open(tmpOutName, 'RECREATE')
-
 ### Setup ###
 
 print 'Starting common setup.'
@@ -85,70 +85,129 @@ if dataType == 'data':
         'n': 1.5
     })
 
+# parameters carried over from the previous bin in a warm-start chain
+warmParams = ['nbkg', 'nsignal', 'mZ', 'gammaZ', 'm0', 'sigma', 'alpha', 'n']
+
 # template of templates. used in both runModes
 template = ROOT.TH1D('template', '', *fitBinningT)
 
-# workspace
-work = inputFile.Get('work')
+# input workspaces; set in openInputs
+inputFile = None
+baseWork = None
+mcSource = None
+mcWork = None
 
-if dataType == 'data':
-    mcSource = ROOT.TFile.Open(outputDir + '/fityields_mc_' + binningName + '.root')
-    mcWork = mcSource.Get('work')
+def openInputs():
+    """
+    Open the fit templates (and the MC fit results when fitting data).
+    Called once per worker process; each bin is fitted in a copy of baseWork.
+    """
+
+    global inputFile, baseWork, mcSource, mcWork
+
+    inputFile = ROOT.TFile.Open(tmpInName, 'READ')
+    baseWork = inputFile.Get('work')
+    baseWork.var('mass').setBinning(compBinning, 'compWindow')
+
+    if dataType == 'data':
+        mcSource = ROOT.TFile.Open(outputDir + '/fityields_mc_' + binningName + '.root')
+        mcWork = mcSource.Get('work')
 
 # convenience
-def addToWS(obj):
+def addToWS(work, obj, *args):
     fcn = getattr(work, 'import')
     if obj.InheritsFrom(ROOT.RooAbsData.Class()):
         # need a dummy argument to execute the correct overload
         fcn(obj, ROOT.RooFit.Rename(obj.GetName()))
     else:
-        fcn(obj, ROOT.RooFit.Silence())
-
-mass = work.var('mass')
-mass.setBinning(compBinning, 'compWindow')
-
-weight = work.var('weight')
-ntarg = work.var('ntarg') # effective number of entries (differs from htarg integral in MC)
-nbkg = work.var('nbkg')
-nsignal = work.var('nsignal')
-nZ = work.var('nZ')
-mZ = work.var('mZ')
-gammaZ = work.var('gammaZ')
-m0 = work.var('m0')
-sigma = work.var('sigma')
-alpha = work.var('alpha')
-n = work.var('n')
-
-tpconf = work.arg('tpconf')
-binName = work.arg('binName')
-
-# smearing parameters are unused in dataType == mc but we'll just leave them here
-nompset = ROOT.RooArgSet(tpconf, binName, ntarg, nbkg, nsignal, nZ, mZ, gammaZ)
-nompset.add(m0)
-nompset.add(sigma)
-nompset.add(alpha)
-nompset.add(n)
-altsigpset = ROOT.RooArgSet(tpconf, binName, nbkg, nsignal, mZ, gammaZ)
-altbkgpset = ROOT.RooArgSet(tpconf, binName, nbkg, nsignal, mZ, gammaZ, m0)
-altbkgpset.add(sigma)
-altbkgpset.add(alpha)
-altbkgpset.add(n)
-
-nomparams = ROOT.RooDataSet('params_nominal', 'Nominal params', nompset)
-altsigparams = ROOT.RooDataSet('params_altsig', 'Altsig params', altsigpset)
-altbkgparams = ROOT.RooDataSet('params_altbkg', 'Altbkg params', altbkgpset)
+        fcn(obj, ROOT.RooFit.Silence(), *args)
+
+def makeParamSets(work):
+    # smearing parameters are unused in dataType == mc but we'll just leave them here
+    nompset = ROOT.RooArgSet(work.arg('tpconf'), work.arg('binName'), work.var('ntarg'), work.var('nbkg'), work.var('nsignal'), work.var('nZ'), work.var('mZ'), work.var('gammaZ'))
+    nompset.add(work.var('m0'))
+    nompset.add(work.var('sigma'))
+    nompset.add(work.var('alpha'))
+    nompset.add(work.var('n'))
+    altsigpset = ROOT.RooArgSet(work.arg('tpconf'), work.arg('binName'), work.var('nbkg'), work.var('nsignal'), work.var('mZ'), work.var('gammaZ'))
+    altbkgpset = ROOT.RooArgSet(work.arg('tpconf'), work.arg('binName'), work.var('nbkg'), work.var('nsignal'), work.var('mZ'), work.var('gammaZ'), work.var('m0'))
+    altbkgpset.add(work.var('sigma'))
+    altbkgpset.add(work.var('alpha'))
+    altbkgpset.add(work.var('n'))
+    # altbkg polynomial coefficient (pass and fail only); saved per bin because the merged workspace holds one value
+    if not work.var('a_1'):
+        work.factory('a_1[0.1, 0., 1.]')
+    altbkgpset.add(work.var('a_1'))
+
+    return nompset, altsigpset, altbkgpset
 
 print 'Finished common setup.'
 
 ### Run fits ###
 
-# fit variables
-massset = ROOT.RooArgSet(mass) # for convenience
-masslist = ROOT.RooArgList(mass) # for convenience
+def fitBin(iBin, start):
+    """
+    Run the fits of one bin in a copy of the template workspace and save the histograms and the workspace to a
+    per-bin file. start is {(conf, fit): (parameter values, target sumEntries)} of the previous bin in a warm-start chain.
+    Parameters not set by initVals or the warm start (smearing parameters in MC, a_1) start from their template values
+    in every bin, not from the results of the previous bin as in the former sequential loop.
+    Returns the file name, the names of the histograms in the order of writing, and the converged parameters of this bin.
+    """
+
+    bin = fitBins[iBin][0]
 
-for bin, _ in fitBins:
     print 'Run fits for', bin
 
+    work = ROOT.RooWorkspace(baseWork)
+
+    mass = work.var('mass')
+    ntarg = work.var('ntarg') # effective number of entries (differs from htarg integral in MC)
+    nsignal = work.var('nsignal')
+    nZ = work.var('nZ')
+    mZ = work.var('mZ')
+    gammaZ = work.var('gammaZ')
+
+    tpconf = work.arg('tpconf')
+    binName = work.arg('binName')
+
+    nompset, altsigpset, altbkgpset = makeParamSets(work)
+
+    nomparams = ROOT.RooDataSet('params_nominal', 'Nominal params', nompset)
+    altsigparams = ROOT.RooDataSet('params_altsig', 'Altsig params', altsigpset)
+    altbkgparams = ROOT.RooDataSet('params_altbkg', 'Altbkg params', altbkgpset)
+
+    # fit variables
+    massset = ROOT.RooArgSet(mass) # for convenience
+    masslist = ROOT.RooArgList(mass) # for convenience
+
+    partName = tmpOutName.replace('.root', '_' + bin + '.root')
+    outputFile = ROOT.TFile.Open(partName, 'RECREATE')
+    outNames = []
+
+    def writeOut(obj):
+        outputFile.cd()
+        obj.Write()
+        outNames.append(obj.GetName())
+
+    converged = {}
+
+    def initialize(conf, fit, targ):
+        for vname, val in initVals.items():
+            work.var(vname).setVal(val)
+        nsignal.setVal(targ.sumEntries() * 0.9)
+
+        if (conf, fit) in start:
+            # warm start; yields are scaled by the target size
+            params, sumEntries = start[(conf, fit)]
+            for vname, val in params.items():
+                if vname in ['nbkg', 'nsignal']:
+                    val *= targ.sumEntries() / sumEntries
+
+                work.var(vname).setVal(val)
+
+    def saveConverged(conf, fit, targ):
+        converged[(conf, fit)] = (dict((vname, work.var(vname).getVal()) for vname in warmParams), targ.sumEntries())
+
     binName.setLabel(bin)
 
     sigModelName = 'sigModel_' + bin
@@ -167,18 +226,18 @@ for bin, _ in fitBins:
         elif dataType == 'data':
             sigData = mcWork.data(sigDataName)
             if not sigData:
-                print 'No dataset ' + sigDataName + ' found in ' + mcSource.GetName() + '.'
-                sys.exit(1)
+                # not sys.exit: a worker process exiting would stall the pool
+                raise RuntimeError('No dataset ' + sigDataName + ' found in ' + mcSource.GetName() + '.')
 
         # no smearing
-        addToWS(sigData)
+        addToWS(work, sigData)
         altsigModel = work.factory('HistPdf::altsigModel_{bin}({{mass}}, sigData_{bin}, 2)'.format(bin = bin))
 
-    addToWS(altsigModel)
+    addToWS(work, altsigModel)
 
     res = work.factory('CBShape::res_{bin}(mass, m0, sigma, alpha, n)'.format(bin = bin))
     sigModel = work.factory('FCONV::sigModel_{bin}(mass, altsigModel_{bin}, res_{bin})'.format(bin = bin))
-    addToWS(sigModel)
+    addToWS(work, sigModel)
 
     print 'Made sigModel_' + bin
 
@@ -192,12 +251,11 @@ for bin, _ in fitBins:
 
         htarg = inputFile.Get('target_' + suffix)
         print 'htarg limits:', htarg.GetXaxis().GetXmin(), htarg.GetXaxis().GetXmax(), htarg.GetSumOfWeights()
-        outputFile.cd()
-        htarg.Write()
+        writeOut(htarg)
         inputFile.cd()
 
         if dataType == 'mc':
-            ntarg.setVal(math.pow(htarg.GetSumOfWeights(), 2.) / sum(htarg.GetSumw2()[iBin] for iBin in range(1, htarg.GetNbinsX() + 1)))
+            ntarg.setVal(math.pow(htarg.GetSumOfWeights(), 2.) / sum(htarg.GetSumw2()[iX] for iX in range(1, htarg.GetNbinsX() + 1)))
         else:
             ntarg.setVal(htarg.GetSumOfWeights())
         
@@ -211,7 +269,7 @@ for bin, _ in fitBins:
 #        else:
 #            targ = ROOT.RooDataSet(targName, 'target', ttarg, ROOT.RooArgSet(mass))
 
-        addToWS(targ)
+        addToWS(work, targ)
 
         print 'Made target_' + suffix
 
@@ -229,15 +287,14 @@ for bin, _ in fitBins:
 
             hMuBkg = inputFile.Get('mubkg_' + suffix)
             dMuBkg = ROOT.RooDataHist('dmubkg_' + suffix, 'mubkg', masslist, hMuBkg)
-            addToWS(dMuBkg)
+            addToWS(work, dMuBkg)
 
             mubkgModel = work.factory('HistPdf::mubkgModel_{suffix}({{mass}}, dmubkg_{suffix}, 2)'.format(suffix = suffix))
 
-        addToWS(mubkgModel)
+        addToWS(work, mubkgModel)
 
-        outputFile.cd()
         hMuBkg.SetDirectory(outputFile)
-        hMuBkg.Write()
+        writeOut(hMuBkg)
 
         ### Make electron+probe background template
         elbkgModel = None
@@ -256,32 +313,31 @@ for bin, _ in fitBins:
 
                 hElBkg = inputFile.Get('truebkg_' + suffix).Clone('elbkg_' + suffix)
                 dElBkg = ROOT.RooDataHist('delbkg_' + suffix, 'elbkg', masslist, hElBkg)
-                addToWS(dElBkg)
+                addToWS(work, dElBkg)
 
                 elbkgModel = work.factory('HistPdf::elbkgModel_{suffix}({{mass}}, delbkg_{suffix}, 2)'.format(suffix = suffix))
 
-            addToWS(elbkgModel)
-            outputFile.cd()
+            addToWS(work, elbkgModel)
             hElBkg.SetDirectory(outputFile)
-            hElBkg.Write()
+            writeOut(hElBkg)
 
         ### set up bkg templates
         altbkgModel = None
         nombkgModel = None
         if conf in ['pass', 'fail']:
             altbkgModel = work.factory('Polynomial::altbkgModel_{suffix}(mass, a_1[0.1, 0., 1.])'.format(suffix = suffix))
-            addToWS(altbkgModel)
+            addToWS(work, altbkgModel)
 
             nombkgModel = mubkgModel.clone('nombkgModel_' + suffix)
-            addToWS(nombkgModel)            
+            addToWS(work, nombkgModel)            
 
         elif conf in ['ee', 'eg']:
             altbkgModel = mubkgModel.clone('altbkgModel_' + suffix)
-            addToWS(altbkgModel)
+            addToWS(work, altbkgModel)
 
             if dataType == 'data':                
                 scalePdf = mcWork.pdf('elmuscale_' + suffix)
-                addToWS(scalePdf)
+                addToWS(work, scalePdf)
                 
             elif dataType == 'mc':
                 hMuBkg.Scale(1. / hMuBkg.GetSumOfWeights())
@@ -291,36 +347,34 @@ for bin, _ in fitBins:
                 elmuscale = hElBkg.Clone('elmuscale_' + suffix)
                 elmuscale.Divide(hMuBkg)
 
-                elmuscale.Write()
+                writeOut(elmuscale)
 
                 scaleHist = ROOT.RooDataHist('elmuscaleData_' + suffix, 'elmuscale', masslist, elmuscale)
                 scalePdf = ROOT.RooHistPdf('elmuscale_' + suffix, 'elmuscale', massset, scaleHist, 2)
-                addToWS(scaleHist)
-                addToWS(scalePdf)
+                addToWS(work, scaleHist)
+                addToWS(work, scalePdf)
 
             nombkgModel = work.factory('PROD::nombkgModel_{suffix}(mubkgModel_{suffix}, elmuscale_{suffix})'.format(suffix = suffix))
-            addToWS(nombkgModel)
+            addToWS(work, nombkgModel)
 
             hNomBkg = nombkgModel.createHistogram('nombkg', mass, ROOT.RooFit.Binning(fitBinning))
             hNomBkg.SetName('nombkg_' + suffix)
-            outputFile.cd()
             hNomBkg.SetDirectory(outputFile)
-            hNomBkg.Write()
+            writeOut(hNomBkg)
 
         print 'Made bkgModel_' + suffix
 
         # full fit PDF
         model = work.factory('SUM::model_{suffix}(nbkg * nombkgModel_{suffix}, nsignal * sigModel_{bin})'.format(suffix = suffix, bin = bin))
-        addToWS(model)
+        addToWS(work, model)
 
         print 'Made model_' + suffix
 
         if dataType == 'mc':
             hTrueBkg = inputFile.Get('truebkg_' + suffix)
             hTrueSig = inputFile.Get('truesig_' + suffix)
-            outputFile.cd()
-            hTrueBkg.Write()
-            hTrueSig.Write()
+            writeOut(hTrueBkg)
+            writeOut(hTrueSig)
             inputFile.cd()
         else:
             hTrueBkg = None
@@ -329,12 +383,12 @@ for bin, _ in fitBins:
         mZ.setConstant()
         gammaZ.setConstant()
 
-        for vname, val in initVals.items():
-            work.var(vname).setVal(val)
-        nsignal.setVal(targ.sumEntries() * 0.9)
+        initialize(conf, 'nominal', targ)
     
         model.fitTo(targ, ROOT.RooFit.SumW2Error(True), ROOT.RooFit.Save(True))
 
+        saveConverged(conf, 'nominal', targ)
+
         nZ.setVal(nsignal.getVal() * (intComp.getVal() / intFit.getVal()))
 
         print '################ nZ =', nZ.getVal(), '###################'
@@ -347,14 +401,17 @@ for bin, _ in fitBins:
             continue
    
         # altbkg fit
+        mZ.setConstant()
+        gammaZ.setConstant()
+
         model = work.factory('SUM::model_altbkg_{suffix}(nbkg * altbkgModel_{suffix}, nsignal * sigModel_{bin})'.format(suffix = suffix, bin = bin))
 
-        for vname, val in initVals.items():
-            work.var(vname).setVal(val)
-        nsignal.setVal(targ.sumEntries() * 0.9)
+        initialize(conf, 'altbkg', targ)
     
         model.fitTo(targ, ROOT.RooFit.SumW2Error(True), ROOT.RooFit.Save(True))
 
+        saveConverged(conf, 'altbkg', targ)
+
         altbkgparams.add(altbkgpset)
 
         efake_plot.plotFit(mass, targHist, model, dataType, suffix, bkgModel = 'altbkgModel', hmcbkg = hTrueBkg, alt = 'altbkg')
@@ -366,19 +423,112 @@ for bin, _ in fitBins:
     
             model = work.factory('SUM::model_altsig_{suffix}(nbkg * nombkgModel_{suffix}, nsignal * altsigModel_{bin})'.format(suffix = suffix, bin = bin))
     
-            for vname, val in initVals.items():
-                work.var(vname).setVal(val)
-            nsignal.setVal(targ.sumEntries() * 0.9)
+            initialize(conf, 'altsig', targ)
         
             model.fitTo(targ, ROOT.RooFit.SumW2Error(True), ROOT.RooFit.Save(True))
+
+            saveConverged(conf, 'altsig', targ)
     
             altsigparams.add(altsigpset)
     
             efake_plot.plotFit(mass, targHist, model, dataType, suffix, hmcbkg = hTrueBkg, alt = 'altsig')
 
-addToWS(nomparams)
-addToWS(altsigparams)
-addToWS(altbkgparams)
+    addToWS(work, nomparams)
+    addToWS(work, altsigparams)
+    addToWS(work, altbkgparams)
+
+    outputFile.cd()
+    work.Write()
+
+    work = None
+    outputFile.Close()
+
+    return partName, outNames, converged
+
+def fitChain(iBins):
+    """
+    Fit consecutive bins, starting each bin from the converged parameters of the previous one.
+    Module-level function to be used in a multiprocessing pool.
+    """
+
+    results = []
+    start = {}
+    for iBin in iBins:
+        partName, outNames, start = fitBin(iBin, start)
+        results.append((iBin, partName, outNames))
+
+    return results
+
+# chains of consecutive bins; results do not depend on the number of workers
+if WARMCHAIN > 1:
+    chains = [range(iBin, min(iBin + WARMCHAIN, len(fitBins))) for iBin in range(0, len(fitBins), WARMCHAIN)]
+else:
+    chains = [[iBin] for iBin in range(len(fitBins))]
+
+if NWORKERS > 1 and len(chains) > 1:
+    pool = multiprocessing.Pool(min(NWORKERS, len(chains)), initializer = openInputs)
+    chainResults = pool.map(fitChain, chains, chunksize = 1)
+    pool.close()
+    pool.join()
+
+    openInputs()
+
+else:
+    openInputs()
+    chainResults = map(fitChain, chains)
+
+### Merge the per-bin outputs ###
+
+print 'Merging the fit results.'
+
+work = baseWork
+
+nompset, altsigpset, altbkgpset = makeParamSets(work)
+
+nomparams = ROOT.RooDataSet('params_nominal', 'Nominal params', nompset)
+altsigparams = ROOT.RooDataSet('params_altsig', 'Altsig params', altsigpset)
+altbkgparams = ROOT.RooDataSet('params_altbkg', 'Altbkg params', altbkgpset)
+
+outputFile = ROOT.TFile.Open(tmpOutName, 'RECREATE')
+
+# part files must stay open until the workspace is written (imported HistPdfs refer to the datasets in them)
+partFiles = []
+
+for iBin, partName, outNames in sorted(sum(chainResults, [])):
+    partFile = ROOT.TFile.Open(partName)
+    partFiles.append(partFile)
+
+    for name in outNames:
+        obj = partFile.Get(name)
+        outputFile.cd()
+        obj.Write()
+
+    partWork = partFile.Get('work')
+
+    nomparams.append(partWork.data('params_nominal'))
+    altsigparams.append(partWork.data('params_altsig'))
+    altbkgparams.append(partWork.data('params_altbkg'))
+
+    for data in partWork.allData():
+        if data.GetName().startswith('params_'):
+            continue
+
+        if not work.data(data.GetName()):
+            addToWS(work, data)
+
+    itr = partWork.components().fwdIterator()
+    while True:
+        arg = itr.next()
+        if not arg:
+            break
+
+        # servers are imported together with the first client; shared parameters are not duplicated
+        if not work.arg(arg.GetName()):
+            addToWS(work, arg, ROOT.RooFit.RecycleConflictNodes())
+
+addToWS(work, nomparams)
+addToWS(work, altsigparams)
+addToWS(work, altbkgparams)
 
 outputFile.cd()
 work.Write()
@@ -386,4 +536,9 @@ work.Write()
 work = None
 outputFile.Close()
 
+for partFile in partFiles:
+    partName = partFile.GetName()
+    partFile.Close()
+    os.unlink(partName)
+
 shutil.copy(tmpOutName, outputName)
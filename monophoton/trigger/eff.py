@@ -4,6 +4,9 @@
 import os
 import sys
 import array
+import hashlib
+import collections
+import multiprocessing
 
 import ROOT
 ROOT.gROOT.SetBatch(True)
@@ -25,42 +28,104 @@ ROOT.gROOT.LoadMacro(basedir + '/../common/MultiDraw.cc+')
 
 REPLOT = False
 FITEFFICIENCY = False
+FORCE = False # refill measurements whose inputs did not change
+NWORKERS = 4 # measurement groups are filled in parallel processes
 
 if len(sys.argv) > 1:
     omnames = [tuple(a.split('_')) for a in sys.argv[1:]]
 else:
     omnames = measurements.keys()
 
+# {(oname, mname): set of trigger names or None for all}
+requested = collections.OrderedDict()
+for omname in omnames:
+    key = omname[:2]
+    if len(omname) > 2:
+        if key not in requested:
+            requested[key] = set()
+        if requested[key] is not None:
+            requested[key].add(omname[2])
+    else:
+        requested[key] = None
+
 outName = 'trigger'
 outDir = config.histDir + '/trigger'
 
-if not REPLOT:
-    ## FILL DISTRIBUTIONS AND GRAPHS
-    for omname in omnames:
-        oname = omname[0]
-        mname = omname[1]
-        print oname, mname
+def outputPath(oname, mname):
+    return outDir + '/trigger_efficiency_%s_%s.root' % (oname, mname)
 
-        snames, region, basesel, colname = measurements[(oname, mname)]
+def selectedTriggers(oname, tnames):
+    return [(tname, conf) for tname, conf in sorted(confs[oname].items()) if tnames is None or tname in tnames]
 
-        outputFile = ROOT.TFile.Open(outDir + '/trigger_efficiency_%s_%s.root' % (oname, mname), 'recreate')
+def fingerprint(oname, mname, tnames):
+    """
+    Hash of everything that determines the content of the output file: skim files (path, size, mtime),
+    the measurement definition, and the trigger configurations.
+    """
 
-        # fill the histograms
-        plotter = ROOT.MultiDraw()
-        plotter.setWeightBranch('')
-    
-        for sample in allsamples.getmany(snames):
-            plotter.addInputPath(utils.getSkimPath(sample.name, region))
-    
-        plotter.setBaseSelection(basesel)
-    
-        # make an empty histogram for each (trigger, variable) combination
-        histograms = []
+    snames, region, basesel, colname = measurements[(oname, mname)]
+
+    stamps = []
+    for sample in allsamples.getmany(snames):
+        path = utils.getSkimPath(sample.name, region)
+        try:
+            stat = os.stat(path)
+            stamps.append((path, stat.st_size, stat.st_mtime))
+        except OSError:
+            stamps.append((path, 0, 0))
+
+    return hashlib.sha1(repr((stamps, region, basesel, colname, selectedTriggers(oname, tnames)))).hexdigest()
+
+def isUpToDate(oname, mname, fp):
+    path = outputPath(oname, mname)
+    if not os.path.exists(path):
+        return False
+
+    source = ROOT.TFile.Open(path)
+    if not source or source.IsZombie():
+        return False
+
+    stored = source.Get('fingerprint')
+    result = bool(stored) and stored.GetString().Data() == fp
+    source.Close()
+
+    return result
+
+# [((sample names, region, base selection), [(oname, mname, tnames, fingerprint)])]
+# filled before the worker processes are forked
+groups = []
+
+def fillGroup(igroup):
+    """
+    Fill the histograms of all measurements in the group in one pass over the skims and write one file per measurement.
+    Module-level function to be used in a multiprocessing pool.
+    """
+
+    (snames, region, basesel), members = groups[igroup]
 
-        for tname, (passdef, commonsel, title, variables) in confs[oname].items():
-            if len(omname) > 2 and tname != omname[2]:
-                continue
+    plotter = ROOT.MultiDraw()
+    plotter.setWeightBranch('')
 
+    for sname in snames:
+        plotter.addInputPath(utils.getSkimPath(sname, region))
+
+    plotter.setBaseSelection(basesel)
+
+    outputFiles = []
+    # python references to the booked histograms; MultiDraw only holds raw pointers
+    histograms = []
+
+    for oname, mname, tnames, fp in members:
+        print oname, mname
+
+        colname = measurements[(oname, mname)][3]
+
+        # written under a temporary name; the fingerprint marks a complete file
+        outputFile = ROOT.TFile.Open(outputPath(oname, mname) + '.tmp', 'recreate')
+        outputFiles.append(outputFile)
+
+        # make an empty histogram for each (trigger, variable) combination
+        for tname, (passdef, commonsel, title, variables) in selectedTriggers(oname, tnames):
             trigDir = outputFile.mkdir(tname)
 
             passdef = passdef.format(col = colname)
@@ -94,14 +159,12 @@ if not REPLOT:
     
                 template.Delete()
     
-        plotter.fillPlots()
-    
-        # make efficiency graphs and save
-        for tname, (_, _, _, variables) in confs[oname].items():
-            if len(omname) > 2 and tname != omname[2]:
-                continue
+    plotter.fillPlots()
 
-            print ' ', tname
+    # make efficiency graphs and save
+    for (oname, mname, tnames, fp), outputFile in zip(members, outputFiles):
+        for tname, (_, _, _, variables) in selectedTriggers(oname, tnames):
+            print ' ', oname, mname, tname
             for vname in variables:
                 print '   ', vname
 
@@ -113,7 +176,52 @@ if not REPLOT:
                 hbase.Write()
                 eff.Write(vname + '_eff')
 
+        outputFile.cd()
+        ROOT.TObjString(fp).Write('fingerprint')
         outputFile.Close()
+
+        os.rename(outputPath(oname, mname) + '.tmp', outputPath(oname, mname))
+
+    return igroup
+
+if not REPLOT:
+    ## FILL DISTRIBUTIONS AND GRAPHS
+    # measurements sharing the samples, region, and base selection are filled in one scan
+    groupMembers = collections.OrderedDict()
+    for (oname, mname), tnames in requested.items():
+        fp = fingerprint(oname, mname, tnames)
+        if not FORCE and isUpToDate(oname, mname, fp):
+            print oname, mname, 'is up to date'
+            continue
+
+        snames, region, basesel, _ = measurements[(oname, mname)]
+        key = (tuple(sample.name for sample in allsamples.getmany(snames)), region, basesel)
+        if key not in groupMembers:
+            groupMembers[key] = []
+
+        groupMembers[key].append((oname, mname, tnames, fp))
+
+    # start from the largest inputs so that the total time is bounded by the slowest group
+    def inputSize(group):
+        (snames, region, _), _ = group
+        size = 0
+        for sname in snames:
+            try:
+                size += os.path.getsize(utils.getSkimPath(sname, region))
+            except OSError:
+                pass
+
+        return size
+
+    groups.extend(sorted(groupMembers.items(), key = inputSize, reverse = True))
+
+    if NWORKERS > 1 and len(groups) > 1:
+        pool = multiprocessing.Pool(min(NWORKERS, len(groups)))
+        pool.map(fillGroup, range(len(groups)), chunksize = 1)
+        pool.close()
+        pool.join()
+    else:
+        map(fillGroup, range(len(groups)))
     
 ## PLOT GRAPHS
 
@@ -128,21 +236,16 @@ if FITEFFICIENCY:
 canvas = SimpleCanvas()
 canvas.legend.setPosition(0.7, 0.3, 0.9, 0.5)
 
-for omname in omnames:
-    oname = omname[0]
-    mname = omname[1]
+for (oname, mname), tnames in requested.items():
     print oname, mname
 
-    source = ROOT.TFile.Open(outDir + '/trigger_efficiency_%s_%s.root' % (oname, mname))
+    source = ROOT.TFile.Open(outputPath(oname, mname))
 
     snames, region, probeSel, colname = measurements[(oname, mname)]
 
     canvas.lumi = sum(sample.lumi for sample in allsamples.getmany(snames))
 
-    for tname, (_, _, title, variables) in confs[oname].items():
-        if len(omname) > 2 and tname != omname[2]:
-            continue
-
+    for tname, (_, _, title, variables) in selectedTriggers(oname, tnames):
         print ' ', tname
 
         trigDir = source.GetDirectory(tname)